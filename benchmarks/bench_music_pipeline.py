@@ -0,0 +1,281 @@
+# benchmarks/bench_music_pipeline.py
+"""Offline benchmarks for the music pipeline (MusicCog, GuildPlayer, extraction pool).
+
+yt-dlp, ffmpeg and Discord are replaced by the stand-ins in benchmarks/fakes.py, so the
+numbers measure the bot's own scheduling overhead under a configurable extractor latency.
+
+    python -m benchmarks.bench_music_pipeline --guilds 50 --out results.json
+    python -m pytest -q benchmarks/bench_music_pipeline.py    # Small smoke-sized runs
+
+Reported: time-to-first-audio, gap between consecutive tracks, /play enqueue throughput
+across N guilds, traced memory per active guild and CPU time per audio stream.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+import discord
+
+from benchmarks.fakes import StubExtractor, FakeBot, FakeGuild, FakeTextChannel, FakeVoiceChannel, FakeMember, FakeInteraction, FakeEncoder, fake_from_data
+from cogs import music_cog
+from cogs.music_cog import MusicCog, PlayerState, YTDLSource
+from utils.audio_cache import AudioCache
+from utils.extraction import ExtractionPool
+from utils.playback_store import PlaybackStore
+from utils.ui_scheduler import UI_DEBOUNCE
+from utils.ytdl_cache import YTDLCache
+
+# --- Defaults ---
+DEFAULT_GUILDS = 20
+DEFAULT_TRACKS = 3 # Per guild
+DEFAULT_TRACK_SECONDS = 2.0
+DEFAULT_LATENCY = 0.15 # Seconds per stub extraction
+DEFAULT_REST_LATENCY = 0.05 # Seconds per fake Discord REST call
+DEFAULT_SPAWN_LATENCY = 0.005 # Seconds the fake ffmpeg spawn blocks the loop
+DEFAULT_WORKERS = 3
+SETTLE_TIMEOUT = 120 # Seconds a scenario may take to play everything out
+
+
+def summarize(values):
+    """count/mean/p50/p95/max of a list of seconds (None fields if empty)."""
+    values = sorted(values)
+    if not values: return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'max': None}
+    return {
+        'count': len(values), 'mean': statistics.fmean(values), 'p50': values[len(values) // 2],
+        'p95': values[min(len(values) - 1, int(len(values) * 0.95))], 'max': values[-1],
+    }
+
+
+@contextlib.contextmanager
+def offline_pipeline(extractor, *, workers=DEFAULT_WORKERS, spawn_latency=DEFAULT_SPAWN_LATENCY):
+    """Points the music cog's module-level services at fresh, offline instances for one run."""
+    with contextlib.ExitStack() as stack:
+        cache_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='music-bench-'))
+        pool = ExtractionPool(music_cog.extraction_pool.profiles, workers=workers, mode='thread') # Processes would import the real yt-dlp
+        stack.enter_context(mock.patch.dict(sys.modules, {'yt_dlp': extractor.module()}))
+        stack.enter_context(mock.patch.object(music_cog, 'extraction_pool', pool))
+        stack.enter_context(mock.patch.object(music_cog, 'ytdl_cache', YTDLCache(path=os.path.join(cache_dir, 'ytdl_cache.json.gz'))))
+        stack.enter_context(mock.patch.object(music_cog, 'audio_cache', AudioCache(enabled=False)))
+        stack.enter_context(mock.patch.object(music_cog, 'playback_store', PlaybackStore(enabled=False)))
+        stack.enter_context(mock.patch.object(YTDLSource, 'from_data', classmethod(fake_from_data(spawn_latency))))
+        stack.enter_context(mock.patch.object(discord.opus, 'Encoder', FakeEncoder))
+        stack.callback(pool.shutdown)
+        yield
+
+
+class SimulatedGuild:
+    def __init__(self, bot, guild_id, rest_latency):
+        self.guild = FakeGuild(guild_id); bot.guilds[guild_id] = self.guild
+        self.text_channel = FakeTextChannel(self.guild, rest_latency=rest_latency)
+        self.voice_channel = FakeVoiceChannel(self.guild)
+        self.member = FakeMember(self.guild, self.voice_channel)
+        self.play_started = None # perf_counter of the first /play
+        self.enqueued_at = None # perf_counter when the last /play returned
+        self.failed_enqueues = 0
+
+    @property
+    def voice_client(self):
+        return self.voice_channel.voice_clients[-1] if self.voice_channel.voice_clients else None
+
+    async def play(self, cog, query):
+        interaction = FakeInteraction(self.member, self.text_channel)
+        await cog.play_slash.callback(cog, interaction, query)
+        if not any(reply and reply.startswith('✅') for reply in interaction.replies): self.failed_enqueues += 1
+
+
+class Simulation:
+    """A MusicCog on a fake bot plus N simulated guilds, each with one listener in voice."""
+
+    def __init__(self, guilds, *, rest_latency=DEFAULT_REST_LATENCY):
+        self.bot = FakeBot()
+        self.cog = MusicCog(self.bot)
+        self.guilds = [SimulatedGuild(self.bot, 10_000 + i, rest_latency) for i in range(guilds)]
+
+    async def enqueue(self, simulated, tracks):
+        """Issues `tracks` /play commands in a row, as a user adding songs would."""
+        simulated.play_started = time.perf_counter()
+        for index in range(tracks): await simulated.play(self.cog, f"benchmark song {simulated.guild.id} {index}")
+        simulated.enqueued_at = time.perf_counter()
+
+    def settled(self):
+        for simulated in self.guilds:
+            guild_id = simulated.guild.id; player = self.cog.players.get(guild_id); voice_client = simulated.voice_client
+            if self.cog.music_queues.get(guild_id): return False
+            if player is not None and player.state is not PlayerState.IDLE: return False
+            if voice_client is not None and (voice_client.is_playing() or voice_client.is_paused()): return False
+        return True
+
+    async def wait_settled(self, timeout=SETTLE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while not self.settled():
+            if time.monotonic() > deadline: raise TimeoutError(f"Pipeline did not settle within {timeout}s")
+            await asyncio.sleep(0.05)
+
+    async def close(self):
+        for simulated in self.guilds:
+            if simulated.voice_client: await simulated.voice_client.disconnect()
+        self.cog.cog_unload()
+        self.cog.persist_ytdl_cache.cancel(); self.cog.persist_positions.cancel()
+        await asyncio.sleep(0) # Let cancelled tasks unwind
+
+
+# --- Scenarios ---
+async def bench_playback(*, guilds=DEFAULT_GUILDS, tracks=DEFAULT_TRACKS, track_seconds=DEFAULT_TRACK_SECONDS, latency=DEFAULT_LATENCY,
+                         failure_rate=0.0, workers=DEFAULT_WORKERS, rest_latency=DEFAULT_REST_LATENCY, spawn_latency=DEFAULT_SPAWN_LATENCY, seed=0):
+    """Every guild queues `tracks` songs at once and plays them to the end."""
+    extractor = StubExtractor(latency=latency, failure_rate=failure_rate, track_seconds=track_seconds, seed=seed)
+    with offline_pipeline(extractor, workers=workers, spawn_latency=spawn_latency):
+        simulation = Simulation(guilds, rest_latency=rest_latency)
+        try:
+            wall_started = time.perf_counter(); cpu_started = time.process_time()
+            await asyncio.gather(*(simulation.enqueue(simulated, tracks) for simulated in simulation.guilds))
+            await simulation.wait_settled()
+            cpu = time.process_time() - cpu_started; wall = time.perf_counter() - wall_started
+        finally: await simulation.close()
+    first_audio = []; gaps = []; frames = 0
+    for simulated in simulation.guilds:
+        voice_client = simulated.voice_client
+        if voice_client is None or not voice_client.tracks: continue
+        frames += voice_client.frames
+        first_audio.append(voice_client.tracks[0][0] - simulated.play_started)
+        # Only transitions whose next track was already queued measure the hand-over itself
+        gaps.extend(nxt[0] - prev[1] for prev, nxt in zip(voice_client.tracks, voice_client.tracks[1:]) if prev[1] > simulated.enqueued_at)
+    stream_seconds = frames * music_cog.FRAME_LENGTH
+    return {
+        'time_to_first_audio': summarize(first_audio), 'transition_gap': summarize(gaps),
+        'tracks_played': sum(len(simulated.voice_client.tracks) for simulated in simulation.guilds if simulated.voice_client),
+        'tracks_requested': guilds * tracks, 'failed_enqueues': sum(simulated.failed_enqueues for simulated in simulation.guilds),
+        'failed_resolves': sum(1 for simulated in simulation.guilds for content in simulated.text_channel.contents if content and content.startswith("❌ Failed")),
+        'extractions': extractor.calls, 'extraction_failures': extractor.failures,
+        'wall_seconds': wall, 'cpu_seconds': cpu, 'stream_seconds': stream_seconds,
+        'cpu_per_stream_second': cpu / stream_seconds if stream_seconds else None,
+    }
+
+
+async def bench_enqueue(*, guilds=DEFAULT_GUILDS, tracks=10, latency=0.01, workers=DEFAULT_WORKERS,
+                        rest_latency=0.0, trace_memory=False):
+    """/play throughput with all guilds adding songs concurrently; optionally traced memory per guild.
+
+    Tracks are long, so every guild ends up with one playing stream and a queue behind it.
+    """
+    extractor = StubExtractor(latency=latency, track_seconds=3600)
+    with offline_pipeline(extractor, workers=workers, spawn_latency=0):
+        if trace_memory: tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+        simulation = Simulation(guilds, rest_latency=rest_latency)
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(simulation.enqueue(simulated, tracks) for simulated in simulation.guilds))
+            elapsed = time.perf_counter() - started
+            await asyncio.sleep(UI_DEBOUNCE * 2) # Let now-playing messages go out
+            used = tracemalloc.get_traced_memory()[0] - baseline if trace_memory else None
+        finally:
+            await simulation.close()
+            if trace_memory: tracemalloc.stop()
+    enqueued = guilds * tracks - sum(simulated.failed_enqueues for simulated in simulation.guilds)
+    result = {'enqueued': enqueued, 'seconds': elapsed, 'enqueues_per_second': enqueued / elapsed if elapsed else None, 'extractions': extractor.calls}
+    if trace_memory: result.update(traced_bytes=used, bytes_per_guild=used / guilds if guilds else None)
+    return result
+
+
+async def bench_effect_switch(*, track_seconds=1.0, latency=0.01, rest_latency=0.005):
+    """Applies a filter mid-track, so a passthrough (Opus) session continues on a PCM pipeline."""
+    extractor = StubExtractor(latency=latency, track_seconds=track_seconds)
+    with offline_pipeline(extractor, spawn_latency=0):
+        simulation = Simulation(1, rest_latency=rest_latency); simulated = simulation.guilds[0]
+        try:
+            await simulation.enqueue(simulated, 1)
+            while not (simulated.voice_client and simulated.voice_client.frames): await asyncio.sleep(0.01)
+            switched = time.perf_counter()
+            applied = await simulation.cog._restart_source(simulated.guild.id, ffmpeg_options=music_cog.FFMPEG_BASS_BOOST_OPTIONS)
+            switch_seconds = time.perf_counter() - switched
+            await simulation.wait_settled()
+        finally: await simulation.close()
+    voice_client = simulated.voice_client
+    return {
+        'applied': applied, 'switch_seconds': switch_seconds, 'errors': [repr(e) for e in voice_client.errors],
+        'tracks_played': len(voice_client.tracks), 'stream_seconds': voice_client.frames * music_cog.FRAME_LENGTH,
+    }
+
+
+def run_all(*, guilds=DEFAULT_GUILDS, tracks=DEFAULT_TRACKS, track_seconds=DEFAULT_TRACK_SECONDS, latency=DEFAULT_LATENCY,
+            failure_rate=0.0, workers=DEFAULT_WORKERS, enqueue_tracks=10):
+    config = {'guilds': guilds, 'tracks': tracks, 'track_seconds': track_seconds, 'latency': latency,
+              'failure_rate': failure_rate, 'workers': workers, 'enqueue_tracks': enqueue_tracks}
+    return {
+        'meta': {'timestamp': time.time(), 'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform()},
+        'config': config,
+        'playback': asyncio.run(bench_playback(guilds=guilds, tracks=tracks, track_seconds=track_seconds, latency=latency, failure_rate=failure_rate, workers=workers)),
+        'enqueue': asyncio.run(bench_enqueue(guilds=guilds, tracks=enqueue_tracks, workers=workers)),
+        'memory': asyncio.run(bench_enqueue(guilds=guilds, tracks=enqueue_tracks, workers=workers, trace_memory=True)),
+    }
+
+
+def git_commit():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError): return None
+
+
+# --- pytest (smoke-sized; run explicitly: python -m pytest benchmarks/bench_music_pipeline.py) ---
+def test_playback_reaches_audio_in_every_guild():
+    result = asyncio.run(bench_playback(guilds=4, tracks=2, track_seconds=0.6, latency=0.02, rest_latency=0.005))
+    assert result['tracks_played'] == result['tracks_requested'] == 8
+    assert result['time_to_first_audio']['count'] == 4 and result['transition_gap']['count'] > 0
+    assert result['cpu_per_stream_second'] is not None
+
+
+def test_playback_skips_failed_extractions():
+    # Seed 1 fails one lookup at /play time and one when the queued entry is resolved
+    result = asyncio.run(bench_playback(guilds=3, tracks=3, track_seconds=0.4, latency=0.01, failure_rate=0.2, rest_latency=0.005, seed=1))
+    assert result['failed_enqueues'] == 1 and result['failed_resolves'] == 1
+    assert result['tracks_played'] > 0
+    assert result['tracks_played'] + result['failed_resolves'] == result['tracks_requested'] - result['failed_enqueues']
+
+
+def test_effect_switch_from_passthrough_to_pcm():
+    result = asyncio.run(bench_effect_switch(track_seconds=1.0))
+    assert result['applied'] and result['errors'] == []
+    assert result['tracks_played'] == 1 and result['stream_seconds'] >= 0.9 # The track played out on the PCM pipeline
+
+
+def test_enqueue_throughput_and_memory():
+    result = asyncio.run(bench_enqueue(guilds=5, tracks=4, trace_memory=True))
+    assert result['enqueued'] == 20 and result['enqueues_per_second'] > 0
+    assert result['bytes_per_guild'] > 0
+
+
+# --- CLI ---
+def main():
+    parser = argparse.ArgumentParser(description="Offline music pipeline benchmarks; writes JSON results.")
+    parser.add_argument('--guilds', type=int, default=DEFAULT_GUILDS)
+    parser.add_argument('--tracks', type=int, default=DEFAULT_TRACKS, help="Songs each guild plays in the playback scenario.")
+    parser.add_argument('--track-seconds', type=float, default=DEFAULT_TRACK_SECONDS)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help="Seconds per stub extraction.")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of stub extractions that fail.")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Extraction pool size.")
+    parser.add_argument('--enqueue-tracks', type=int, default=10, help="Songs each guild adds in the enqueue/memory scenarios.")
+    parser.add_argument('--out', help="JSON output path (default: print only).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    results = run_all(guilds=args.guilds, tracks=args.tracks, track_seconds=args.track_seconds, latency=args.latency,
+                      failure_rate=args.failure_rate, workers=args.workers, enqueue_tracks=args.enqueue_tracks)
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f: f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
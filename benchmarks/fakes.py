@@ -0,0 +1,349 @@
+# benchmarks/fakes.py
+"""Local stand-ins for yt-dlp and Discord, so the music pipeline can be benchmarked offline."""
+
+import asyncio
+import hashlib
+import itertools
+import random
+import threading
+import time
+import types
+from base64 import urlsafe_b64encode
+
+import discord
+
+from cogs.music_cog import TrackSourceMixin, FRAME_LENGTH, FFMPEG_NORMAL_OPTIONS
+
+# --- Constants ---
+OPUS_SILENCE = b'\xf8\xff\xfe' # One Opus frame of silence
+PCM_SILENCE = bytes(discord.opus.Encoder.FRAME_SIZE) # One 20 ms frame of 48 kHz stereo s16le silence
+PCM_SAMPLES_PER_FRAME = discord.opus.Encoder.SAMPLES_PER_FRAME
+STREAM_URL_TTL = 6 * 3600
+
+_ids = itertools.count(1000)
+
+
+# --- yt-dlp ---
+class StubDownloadError(Exception):
+    pass
+
+
+class StubExtractor:
+    """Configures the fake `yt_dlp` module: per-call latency, failure rate and track length.
+
+    Latency is a blocking sleep, like yt-dlp's network I/O, so it occupies an extraction
+    worker exactly as a real lookup would. Whether a lookup fails depends only on `seed` and
+    the query (a failing query fails on retry too), so failure counts don't vary with the
+    order in which workers happen to run.
+    """
+
+    def __init__(self, *, latency=0.2, jitter=0.25, failure_rate=0.0, track_seconds=3.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter # +- fraction of `latency`
+        self.failure_rate = failure_rate
+        self.track_seconds = track_seconds
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def module(self):
+        """A module object to install as sys.modules['yt_dlp']."""
+        module = types.ModuleType('yt_dlp')
+        module.YoutubeDL = lambda params=None: StubYoutubeDL(self, params or {})
+        module.utils = types.SimpleNamespace(DownloadError=StubDownloadError)
+        return module
+
+    def _call(self, query):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency * (1 + self._random.uniform(-self.jitter, self.jitter))
+            failed = random.Random(f'{self.seed}:{query}').random() < self.failure_rate
+            if failed: self.failures += 1
+        time.sleep(max(0.0, delay))
+        if failed: raise StubDownloadError(f"ERROR: [stub] {query}: simulated extraction failure")
+
+    @staticmethod
+    def video_id(search_term):
+        return urlsafe_b64encode(hashlib.sha1(search_term.encode()).digest()).decode()[:11]
+
+    def info(self, video_id, *, flat=False):
+        webpage_url = f"https://www.youtube.com/watch?v={video_id}"
+        if flat: return {'_type': 'url', 'ie_key': 'Youtube', 'id': video_id, 'url': webpage_url, 'title': f"Track {video_id}", 'duration': self.track_seconds}
+        return {
+            'id': video_id, 'title': f"Track {video_id}", 'webpage_url': webpage_url, 'duration': self.track_seconds,
+            'url': f"https://stub.invalid/audio/{video_id}.webm?expire={int(time.time()) + STREAM_URL_TTL}",
+            'extractor': 'youtube', 'extractor_key': 'Youtube', 'uploader': 'Stub Uploader', 'view_count': 1234,
+            'upload_date': '20240101', 'ext': 'webm', 'acodec': 'opus', 'abr': 128, 'thumbnail': f"https://stub.invalid/{video_id}.jpg",
+            'formats': [{'format_id': str(i), 'url': 'https://stub.invalid/'} for i in range(20)], # Bulk that trim_info drops
+        }
+
+
+class StubYoutubeDL:
+    def __init__(self, extractor, params):
+        self.extractor = extractor
+        self.params = params
+
+    def extract_info(self, query, download=False, process=True, ie_key=None):
+        self.extractor._call(query)
+        flat = bool(self.params.get('extract_flat'))
+        if query.startswith('ytsearch'):
+            return {'_type': 'playlist', 'entries': [self.extractor.info(self.extractor.video_id(query.split(':', 1)[1]), flat=flat)]}
+        return self.extractor.info(query.rsplit('v=', 1)[-1])
+
+    def prepare_filename(self, info):
+        return f"downloads/stub-{info['id']}.webm"
+
+
+# --- Audio ---
+class SilentOpusFrames(discord.AudioSource):
+    """Yields silent Opus frames for a track's length, standing in for an ffmpeg pipeline."""
+
+    def __init__(self, seconds):
+        self.remaining = max(0, int(seconds / FRAME_LENGTH))
+
+    def read(self):
+        if self.remaining <= 0: return b''
+        self.remaining -= 1
+        return OPUS_SILENCE
+
+    def is_opus(self):
+        return True
+
+
+class SilentPCMFrames(SilentOpusFrames):
+    """PCM counterpart, standing in for the filtered (FFmpegPCMAudio) pipeline."""
+
+    def read(self):
+        return PCM_SILENCE if super().read() else b''
+
+    def is_opus(self):
+        return False
+
+
+class FakeTrackSource(TrackSourceMixin, SilentOpusFrames):
+    def __init__(self, data, *, start=0, local_file=None):
+        super().__init__((data.get('duration') or 0) - start)
+        self._set_metadata(data)
+        self._init_playback(start, local_file)
+
+
+class FakePCMTrackSource(TrackSourceMixin, SilentPCMFrames):
+    def __init__(self, data, *, start=0, local_file=None):
+        super().__init__((data.get('duration') or 0) - start)
+        self._set_metadata(data)
+        self._init_playback(start, local_file)
+
+
+def fake_from_data(spawn_latency):
+    """Replacement for YTDLSource.from_data; `spawn_latency` mimics the blocking ffmpeg Popen.
+
+    Like the real one, unfiltered tracks get an Opus source and filtered ones a PCM source.
+    """
+    def from_data(cls, data, *, stream=True, ffmpeg_options=FFMPEG_NORMAL_OPTIONS, local_file=None, start=0):
+        if spawn_latency: time.sleep(spawn_latency)
+        source_cls = FakeTrackSource if ffmpeg_options == FFMPEG_NORMAL_OPTIONS else FakePCMTrackSource
+        return source_cls(data, start=start, local_file=local_file)
+    return from_data
+
+
+class FakeEncoder:
+    """Stands in for discord.opus.Encoder (libopus isn't needed offline)."""
+
+    def encode(self, pcm, frame_size):
+        return OPUS_SILENCE
+
+
+# --- Discord ---
+class FakeVoiceClient:
+    """Consumes audio frames in real time on its own thread, like discord.py's AudioPlayer.
+
+    Records when each track's first and last frame went out, for time-to-first-audio and
+    transition gap measurements. PCM frames go through `encoder`, which, as in discord.py,
+    only play() creates; a PCM source swapped in without one fails the track.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.guild = channel.guild
+        self.source = None
+        self.latency = 0.0
+        self.frames = 0
+        self.errors = [] # Exceptions that ended playback, as passed to `after`
+        self.encoder = discord.utils.MISSING
+        self.tracks = [] # [first frame perf_counter, last frame perf_counter] per played track
+        self._connected = True
+        self._thread = None
+        self._end = threading.Event()
+        self._resumed = threading.Event()
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._thread is not None and self._thread.is_alive() and self._resumed.is_set()
+
+    def is_paused(self):
+        return self._thread is not None and self._thread.is_alive() and not self._resumed.is_set()
+
+    def play(self, source, *, after=None):
+        if self._thread is not None and self._thread.is_alive(): raise discord.ClientException('Already playing audio.')
+        if not source.is_opus(): self.encoder = discord.opus.Encoder()
+        self.source = source; self._end = threading.Event(); self._resumed.set()
+        self._thread = threading.Thread(target=self._run, args=(self._end, after), name=f'fake-voice-{self.guild.id}', daemon=True)
+        self._thread.start()
+
+    def _run(self, end, after):
+        error = None; track = None; loops = 0; started = time.perf_counter()
+        try:
+            while not end.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait(); loops = 0; started = time.perf_counter(); continue
+                source = self.source; data = source.read() # Re-read every frame: sources can be swapped mid-track
+                if not data: break
+                if not source.is_opus(): data = self.encoder.encode(data, PCM_SAMPLES_PER_FRAME)
+                now = time.perf_counter(); self.frames += 1
+                if track is None: track = [now, now]; self.tracks.append(track)
+                track[1] = now
+                loops += 1
+                delay = started + loops * FRAME_LENGTH - time.perf_counter()
+                if delay > 0: end.wait(delay)
+        except Exception as e: error = e; self.errors.append(e)
+        if after is not None: after(error)
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def stop(self):
+        self._end.set(); self._resumed.set()
+
+    async def disconnect(self, *, force=False):
+        self.stop(); self._connected = False
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+
+class FakeMessage:
+    def __init__(self, channel, fields):
+        self.id = next(_ids)
+        self.channel = channel
+        self.fields = fields
+        self.edits = 0
+
+    async def edit(self, **fields):
+        await asyncio.sleep(self.channel.rest_latency)
+        self.fields.update(fields); self.edits += 1
+        return self
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.channels = {}
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+
+class FakeTextChannel:
+    def __init__(self, guild, *, rest_latency=0.05):
+        self.id = next(_ids)
+        self.guild = guild
+        self.rest_latency = rest_latency
+        self.sent = 0
+        self.contents = [] # Content of every message sent, in order
+        guild.channels[self.id] = self
+
+    async def send(self, content=None, **fields):
+        await asyncio.sleep(self.rest_latency); self.sent += 1; self.contents.append(content)
+        return FakeMessage(self, {'content': content, **fields})
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild, *, name='Music'):
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.members = []
+        self.voice_clients = []
+        guild.channels[self.id] = self
+
+    async def connect(self, **kwargs):
+        voice_client = FakeVoiceClient(self); self.voice_clients.append(voice_client)
+        return voice_client
+
+
+class FakeMember:
+    def __init__(self, guild, voice_channel=None, *, bot=False):
+        self.id = next(_ids)
+        self.guild = guild
+        self.bot = bot
+        self.name = f"user{self.id}"
+        self.mention = f"<@{self.id}>"
+        self.voice = types.SimpleNamespace(channel=voice_channel) if voice_channel else None
+        if voice_channel: voice_channel.members.append(self)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+    async def send_message(self, content=None, **fields):
+        self._done = True; self._interaction.replies.append(content)
+
+    async def edit_message(self, **fields):
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, *, wait=False, **fields):
+        channel = self._interaction.channel
+        await asyncio.sleep(channel.rest_latency); self._interaction.replies.append(content)
+        return FakeMessage(channel, {'content': content, **fields})
+
+
+class FakeInteraction:
+    """Just enough of discord.Interaction for slash command callbacks."""
+
+    def __init__(self, member, channel):
+        self.id = next(_ids)
+        self.user = member
+        self.guild = member.guild
+        self.guild_id = member.guild.id
+        self.channel = channel
+        self.channel_id = channel.id
+        self.created_at = discord.utils.utcnow()
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.replies = []
+
+
+class FakeBot:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.user = types.SimpleNamespace(id=next(_ids), bot=True)
+        self.guilds = {}
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def get_cog(self, name):
+        return None
+
+    async def wait_until_ready(self):
+        pass
@@ -0,0 +1,211 @@
+# cluster.py
+"""Runs MusicBot as K worker processes ("clusters"), each owning a contiguous range of shards.
+
+Usage: python cluster.py [--clusters K] [--shards N]
+
+The supervisor (this process) starts the clusters one after another so their gateway
+identifies don't collide, restarts clusters that crash or stop reporting, and merges
+their health reports into CLUSTER_HEALTH_FILE. Cogs run unchanged in every worker;
+each worker only sees the guilds of its own shards.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import urllib.request
+
+# --- Constants ---
+CLUSTER_COUNT = int(os.getenv('CLUSTER_COUNT', str(os.cpu_count() or 1)))
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) # 0 = Discord's recommendation
+CLUSTER_HEALTH_FILE = os.getenv('CLUSTER_HEALTH_FILE', 'cluster_health.json')
+HEALTH_INTERVAL = 15 # Seconds between worker health reports
+HEALTH_TIMEOUT = 90 # A worker silent for this long (after ready) is considered hung and restarted
+READY_TIMEOUT = 120 # Max seconds to wait for a cluster's READY before starting the next one
+RESTART_BACKOFF = 5.0 # Seconds, doubled per crash in a row
+MAX_RESTART_BACKOFF = 300.0
+STABLE_UPTIME = 600 # Seconds a cluster must stay up for its crash streak to reset
+EXIT_FATAL = 2 # Worker exit code for errors a restart can't fix (e.g. a bad token)
+
+
+# --- Shard Layout ---
+def recommended_shards(token):
+    """Asks the gateway how many shards Discord recommends for this bot."""
+    request = urllib.request.Request('https://discord.com/api/v10/gateway/bot', headers={'Authorization': f'Bot {token}', 'User-Agent': 'DiscordBot (cluster.py, 1.0)'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return max(1, json.load(response)['shards'])
+
+
+def shard_ranges(shard_count, cluster_count):
+    """Splits shards 0..shard_count-1 into `cluster_count` contiguous, near-equal ranges."""
+    cluster_count = max(1, min(cluster_count, shard_count))
+    base, extra = divmod(shard_count, cluster_count); ranges = []; start = 0
+    for cluster_id in range(cluster_count):
+        size = base + (1 if cluster_id < extra else 0)
+        ranges.append(list(range(start, start + size))); start += size
+    return ranges
+
+
+# --- Worker Side ---
+def _cluster_main(cluster_id, shard_ids, shard_count, reports):
+    import discord
+    import main_bot
+    main_bot.setup_logging(f'discord_bot.cluster{cluster_id}.log')
+    logging.info(f"Cluster {cluster_id} starting with shards {shard_ids[0]}-{shard_ids[-1]} of {shard_count}.")
+
+    async def runner():
+        bot = main_bot.MusicBot(shard_ids=shard_ids, shard_count=shard_count, cluster_id=cluster_id)
+        try: asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(bot.close()))
+        except NotImplementedError: pass # Windows
+        async with bot:
+            reporter = asyncio.ensure_future(_report_health(bot, cluster_id, reports))
+            try: await bot.start(main_bot.TOKEN)
+            finally: reporter.cancel()
+
+    try: asyncio.run(runner())
+    except discord.LoginFailure:
+        logging.critical(f"Cluster {cluster_id}: invalid Discord token."); raise SystemExit(EXIT_FATAL)
+    except KeyboardInterrupt: pass
+
+
+async def _report_health(bot, cluster_id, reports):
+    await bot.wait_until_ready()
+    reports.put(('ready', cluster_id, bot.health()))
+    while True:
+        await asyncio.sleep(HEALTH_INTERVAL)
+        reports.put(('health', cluster_id, bot.health()))
+
+
+# --- Supervisor Side ---
+class Cluster:
+    __slots__ = ('cluster_id', 'shard_ids', 'process', 'started_at', 'last_report', 'health', 'ready', 'crashes', 'restart_at')
+
+    def __init__(self, cluster_id, shard_ids):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.process = None
+        self.started_at = 0.0
+        self.last_report = 0.0
+        self.health = None
+        self.ready = False
+        self.crashes = 0 # Crashes in a row
+        self.restart_at = None # Monotonic time a crashed cluster is due to restart
+
+
+class Supervisor:
+    def __init__(self, shard_count, cluster_count):
+        self.shard_count = shard_count
+        self.context = multiprocessing.get_context('spawn')
+        self.reports = self.context.Queue()
+        self.clusters = [Cluster(cluster_id, shard_ids) for cluster_id, shard_ids in enumerate(shard_ranges(shard_count, cluster_count))]
+        self.stopping = False
+        self.restarts = 0
+        self.last_health_write = 0.0
+
+    def start(self, cluster):
+        cluster.process = self.context.Process(target=_cluster_main, args=(cluster.cluster_id, cluster.shard_ids, self.shard_count, self.reports), name=f'cluster-{cluster.cluster_id}', daemon=False)
+        cluster.process.start()
+        cluster.started_at = cluster.last_report = time.monotonic(); cluster.ready = False; cluster.restart_at = None
+        logging.info(f"Started cluster {cluster.cluster_id} (pid {cluster.process.pid}, shards {cluster.shard_ids[0]}-{cluster.shard_ids[-1]}).")
+
+    def run(self):
+        for cluster in self.clusters: # One at a time, so identifies are spread out
+            self.start(cluster)
+            deadline = time.monotonic() + READY_TIMEOUT
+            while not self.stopping and not cluster.ready and cluster.process.is_alive() and time.monotonic() < deadline: self.poll(1.0)
+            if self.stopping: break
+        while not self.stopping: self.poll(1.0); self.check()
+        self.shutdown()
+
+    def poll(self, timeout):
+        """Handles worker reports for up to `timeout` seconds."""
+        try: kind, cluster_id, health = self.reports.get(timeout=timeout)
+        except queue.Empty: return
+        cluster = self.clusters[cluster_id]
+        cluster.last_report = time.monotonic(); cluster.health = health
+        if kind == 'ready':
+            cluster.ready = True; logging.info(f"Cluster {cluster_id} ready with {health['guilds']} guild(s).")
+        if time.monotonic() - self.last_health_write >= HEALTH_INTERVAL: self.write_health()
+
+    def check(self):
+        now = time.monotonic()
+        for cluster in self.clusters:
+            process = cluster.process
+            if cluster.restart_at is not None:
+                if now >= cluster.restart_at: self.start(cluster)
+                continue
+            if process.is_alive():
+                if cluster.ready and now - cluster.last_report > HEALTH_TIMEOUT:
+                    logging.error(f"Cluster {cluster.cluster_id} stopped reporting; restarting it.")
+                    process.kill(); process.join(5)
+                else: continue
+            if process.exitcode == EXIT_FATAL:
+                logging.critical(f"Cluster {cluster.cluster_id} exited with a fatal error; stopping all clusters."); self.stopping = True; return
+            if now - cluster.started_at >= STABLE_UPTIME: cluster.crashes = 0
+            cluster.crashes += 1; self.restarts += 1; cluster.ready = False; cluster.health = None
+            delay = min(RESTART_BACKOFF * 2 ** (cluster.crashes - 1), MAX_RESTART_BACKOFF)
+            logging.warning(f"Cluster {cluster.cluster_id} exited (code {process.exitcode}); restarting in {delay:.0f}s.")
+            cluster.restart_at = now + delay
+
+    def health(self):
+        clusters = []
+        for cluster in self.clusters:
+            alive = cluster.process is not None and cluster.process.is_alive()
+            clusters.append({
+                'cluster_id': cluster.cluster_id, 'shards': [cluster.shard_ids[0], cluster.shard_ids[-1]], 'alive': alive,
+                'ready': cluster.ready, 'crashes': cluster.crashes, 'seconds_since_report': round(time.monotonic() - cluster.last_report, 1),
+                'report': cluster.health,
+            })
+        reports = [cluster.health for cluster in self.clusters if cluster.health]
+        return {
+            'updated_at': time.time(), 'shard_count': self.shard_count, 'restarts': self.restarts,
+            'clusters_ready': sum(1 for cluster in self.clusters if cluster.ready), 'cluster_count': len(self.clusters),
+            'guilds': sum(report['guilds'] for report in reports), 'voice_clients': sum(report['voice_clients'] for report in reports),
+            'clusters': clusters,
+        }
+
+    def write_health(self):
+        self.last_health_write = time.monotonic()
+        try:
+            tmp_path = f"{CLUSTER_HEALTH_FILE}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(self.health(), f, indent=2)
+            os.replace(tmp_path, CLUSTER_HEALTH_FILE)
+        except OSError as e: logging.error(f"Could not write cluster health: {e}")
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def shutdown(self):
+        logging.info("Stopping clusters...")
+        for cluster in self.clusters:
+            if cluster.process and cluster.process.is_alive(): cluster.process.terminate() # SIGTERM -> bot.close()
+        for cluster in self.clusters:
+            if cluster.process:
+                cluster.process.join(30)
+                if cluster.process.is_alive(): cluster.process.kill()
+        self.write_health()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run MusicBot as a supervised set of sharded worker processes.")
+    parser.add_argument('--clusters', type=int, default=CLUSTER_COUNT, help="Number of worker processes.")
+    parser.add_argument('--shards', type=int, default=SHARD_COUNT, help="Total shard count (default: Discord's recommendation).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:supervisor: %(message)s')
+    from dotenv import load_dotenv
+    load_dotenv(); token = os.getenv('DISCORD_TOKEN')
+    if token is None: logging.critical("DISCORD_TOKEN environment variable not set!"); return
+    shard_count = args.shards or recommended_shards(token)
+    supervisor = Supervisor(shard_count, args.clusters)
+    logging.info(f"Running {shard_count} shard(s) in {len(supervisor.clusters)} cluster(s).")
+    signal.signal(signal.SIGTERM, supervisor.stop); signal.signal(signal.SIGINT, supervisor.stop)
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
+import io
 import logging
+import sys
+import time
+from utils.tracing import tracer
 
 class AdminCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -56,6 +60,57 @@ class AdminCog(commands.Cog):
         except Exception as e: await interaction.followup.send(f"❌ Clear failed: {e}", ephemeral=True); logging.error(f"Clear failed C{interaction.channel.id}: {e}")
 
 
+    @app_commands.command(name="music_stats", description="Shows extraction pool, lookup cache and audio cache statistics.")
+    @app_commands.default_permissions(manage_guild=True)
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def music_stats_slash(self, interaction: discord.Interaction):
+        music_cog = self.bot.get_cog('MusicCog')
+        if not music_cog: await interaction.response.send_message("Music module not loaded.", ephemeral=True); return
+        music = sys.modules[type(music_cog).__module__] # The loaded extension's module-level services, without importing it here
+        pool = music.extraction_pool.stats(); cache = music.ytdl_cache.stats(); audio = music.audio_cache.stats()
+        embed = discord.Embed(title="Music Stats", color=discord.Color.blurple())
+        embed.add_field(name="Extraction Pool", value=(
+            f"{pool['workers']} {pool['mode']} worker(s), {pool['running']} running, {pool['pending']} pending\n"
+            f"Done: {pool['completed']} | Failed: {pool['failed']} | Cancelled: {pool['cancelled']}\n"
+            f"Queue wait: avg {pool['avg_queue_wait']:.2f}s, max {pool['max_queue_wait']:.2f}s\n"
+            f"Extraction: avg {pool['avg_extract_time']:.2f}s, max {pool['max_extract_time']:.2f}s"), inline=False)
+        embed.add_field(name="Lookup Cache", value=(
+            f"{cache['entries']} entries | Hit ratio: {cache['hit_ratio']:.0%}\n"
+            f"Hits: {cache['hits']} | Stale: {cache['stale_hits']} | Misses: {cache['misses']} | Evictions: {cache['evictions']}"), inline=False)
+        if audio['enabled']:
+            embed.add_field(name="Audio Cache", value=(
+                f"{audio['files']} file(s), {audio['bytes'] / 1024**2:.1f} / {audio['max_bytes'] / 1024**2:.0f} MiB | Hit ratio: {audio['hit_ratio']:.0%}\n"
+                f"Hits: {audio['hits']} | Misses: {audio['misses']} | Fills: {audio['fills']} ({audio['filling']} running, {audio['failed_fills']} failed) | Evictions: {audio['evictions']}"), inline=False)
+        else: embed.add_field(name="Audio Cache", value="Disabled (set AUDIO_CACHE_ENABLED=1).", inline=False)
+        state = music.playback_store.stats()
+        embed.add_field(name="Playback State", value=(f"{state['writes']} write(s) in {state['flushes']} flush(es), {state['pending']} pending" if state['enabled'] else "Disabled (set PLAYBACK_RESUME=1)."), inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+    @app_commands.command(name="slow_spans", description="Dumps recent slow playback traces and event loop stalls.")
+    @app_commands.describe(limit="How many traces/stalls to show (default 10).")
+    @app_commands.default_permissions(manage_guild=True)
+    @app_commands.checks.has_permissions(manage_guild=True)
+    async def slow_spans_slash(self, interaction: discord.Interaction, limit: app_commands.Range[int, 1, 50] = 10):
+        traces = tracer.recent_slow(limit); monitor = getattr(self.bot, 'loop_monitor', None)
+        stalls = monitor.recent_stalls(limit) if monitor else []
+        embed = discord.Embed(title="Slow Spans", color=discord.Color.orange())
+        if monitor:
+            loop = monitor.stats()
+            embed.add_field(name="Event Loop", value=f"Max lag: {loop['max_lag'] * 1000:.0f} ms | Stalls > {loop['threshold'] * 1000:.0f} ms: {loop['stalls']} kept", inline=False)
+        summary = '\n'.join(f"`{trace.duration or 0:.2f}s` G{trace.guild_id} " + ', '.join(f"{span.name} {span.duration:.2f}s" for span in trace.spans) for trace in traces)
+        embed.add_field(name=f"Slow Traces ({len(traces)})", value=(summary[:1021] + '...' if len(summary) > 1024 else summary) or "None recorded.", inline=False)
+        if not traces and not stalls: await interaction.response.send_message(embed=embed, ephemeral=True); return
+        # Full detail (stacks included) goes into an attached text file
+        lines = ["# Slow traces (newest first)"] + [trace.describe() for trace in traces] + ["", "# Event loop stalls (newest first)"]
+        for stall in stalls:
+            stamp = time.strftime('%H:%M:%S', time.localtime(stall.wall_time))
+            lines.append(f"--- {stamp} blocked {stall.duration:.3f}s{' (length not yet measured)' if stall.ongoing else ''}")
+            lines.append(stall.stack)
+        dump = discord.File(io.BytesIO('\n'.join(lines).encode()), filename='slow_spans.txt')
+        await interaction.response.send_message(embed=embed, file=dump, ephemeral=True)
+
+
     # Optional: Add a global Cog error handler if desired
     # async def cog_app_command_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
     #     # Handle errors specific to this cog's commands
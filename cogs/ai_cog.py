@@ -1,24 +1,27 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
-import google.generativeai as genai
+import asyncio
 import os
 import logging
+import time
 from dotenv import load_dotenv
 
+from utils import metrics
+from utils.message_split import MESSAGE_LIMIT, split_message
+from utils.response_cache import ResponseCache, prompt_key, load_opt_outs, save_opt_outs
+
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+MODEL_NAME = "gemini-1.5-flash" # Or your preferred model
+if not GOOGLE_API_KEY: logging.warning("GOOGLE_API_KEY not found. AICog will be limited.")
+AI_STREAM = os.getenv('AI_STREAM', '1') == '1' # Show /ask answers while they are generated
+STREAM_EDIT_INTERVAL = 1.0 # Seconds between progressive edits of a streamed answer
+STREAM_CURSOR = " ▌"
 
-# Configure Google AI Client
-if GOOGLE_API_KEY:
-    try:
-        genai.configure(api_key=GOOGLE_API_KEY)
-        logging.info("Google AI Client configured successfully (AICog).")
-    except Exception as e:
-         logging.error(f"Failed to configure Google AI Client (AICog): {e}")
-         GOOGLE_API_KEY = None
-else:
-    logging.warning("GOOGLE_API_KEY not found. AICog will be limited.")
+# --- Metrics ---
+ASK_SECONDS = metrics.histogram('ai_ask_seconds', "Time from /ask to the answer being sent, by outcome and cache result.", ('outcome', 'cache'))
+ASK_FIRST_TOKEN_SECONDS = metrics.histogram('ai_ask_first_token_seconds', "Time from sending a streamed /ask request upstream to its first text chunk.")
 
 safety_settings = [ # Example safety settings
     {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
@@ -26,46 +29,137 @@ safety_settings = [ # Example safety settings
 ]
 generation_config = {"max_output_tokens": 2000}
 
+def _build_model():
+    """Imports the Gemini SDK and builds the model client. Slow (~1s); runs in a thread on first use."""
+    import google.generativeai as genai
+    genai.configure(api_key=GOOGLE_API_KEY)
+    return genai.GenerativeModel(model_name=MODEL_NAME, generation_config=generation_config, safety_settings=safety_settings)
+
+
+class StreamedReply:
+    """The /ask followup(s) for one answer, kept in sync with its text.
+
+    While the answer streams in, updates are throttled to one per STREAM_EDIT_INTERVAL;
+    text past MESSAGE_LIMIT continues in further followups (see split_message). Only
+    messages whose content changed are edited.
+    """
+
+    def __init__(self, interaction, header):
+        self.interaction = interaction
+        self.header = header
+        self.messages = [] # Followups sent so far, in order
+        self.shown = [] # Content each of them currently has
+        self.text = '' # Latest answer text, shown or not
+        self.updated_at = 0.0
+
+    async def update(self, text, *, final=False):
+        """Shows `text`. Interim updates are dropped inside the throttle window and never raise."""
+        self.text = text
+        if not final and time.monotonic() - self.updated_at < STREAM_EDIT_INTERVAL: return
+        self.updated_at = time.monotonic()
+        chunks = split_message(self.header + text)
+        if not final and len(chunks[-1]) + len(STREAM_CURSOR) <= MESSAGE_LIMIT: chunks[-1] += STREAM_CURSOR
+        try:
+            for i, content in enumerate(chunks):
+                if i < len(self.messages):
+                    if self.shown[i] != content: await self.messages[i].edit(content=content); self.shown[i] = content
+                else: self.messages.append(await self.interaction.followup.send(content, wait=True)); self.shown.append(content)
+        except discord.HTTPException as e:
+            if final: raise
+            logging.warning(f"Streamed /ask update failed G{self.interaction.guild_id}: {e}")
+
+    async def abort(self):
+        """Leaves the partial answer in place without the streaming cursor (the stream failed)."""
+        if not self.messages: return
+        try: await self.update(self.text, final=True)
+        except discord.HTTPException as e: logging.warning(f"Final /ask update failed G{self.interaction.guild_id}: {e}")
+
+
 class AICog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.model = None
-        if GOOGLE_API_KEY:
-            try:
-                self.model = genai.GenerativeModel(
-                    model_name="gemini-1.5-flash", # Or your preferred model
-                    generation_config=generation_config,
-                    safety_settings=safety_settings
-                )
-                logging.info("Google AI Model initialized (AICog).")
-            except Exception as e:
-                logging.error(f"Failed to initialize Google AI Model (AICog): {e}")
-        else:
-             logging.warning("Google AI Model not initialized in AICog (No API Key).")
+        self.model = None # Built lazily by _get_model(), so loading the cog stays cheap
+        self.model_failed = False
+        self._model_lock = asyncio.Lock()
+        self.cache = ResponseCache()
+        self.cache_opt_outs = set() # Guild IDs whose prompts are never cached or shared
+        metrics.gauge('ai_cache_entries', "Answers held by the /ask response cache.", collect=lambda: {(): len(self.cache)})
+
+    async def cog_load(self):
+        self.cache_opt_outs = await asyncio.to_thread(load_opt_outs)
+
+    async def _get_model(self):
+        """Returns the model client, importing and configuring the SDK on the first call."""
+        if self.model is not None or self.model_failed: return self.model
+        async with self._model_lock:
+            if self.model is None and not self.model_failed:
+                try:
+                    self.model = await asyncio.to_thread(_build_model)
+                    logging.info("Google AI Model initialized (AICog).")
+                except Exception as e:
+                    logging.error(f"Failed to initialize Google AI Model (AICog): {e}"); self.model_failed = True
+        return self.model
 
     @app_commands.command(name="ask", description="Ask the AI (Gemini) a question.")
     @app_commands.describe(prompt="The question or prompt for the AI.")
     async def ask_command(self, interaction: discord.Interaction, prompt: str):
-        if not self.model:
+        if self.model_failed:
             await interaction.response.send_message("AI module not available.", ephemeral=True); return
 
-        await interaction.response.defer(thinking=True)
+        started = time.monotonic()
+        await interaction.response.defer(thinking=True) # Before the first-use SDK import, which can take a moment
+        metrics.observe_ack(interaction, 'ask')
+        model = await self._get_model()
+        if not model: await interaction.followup.send("AI module not available.", ephemeral=True); return
+        outcome = 'ok'; cache = 'bypass'
+        reply = StreamedReply(interaction, f">>> {interaction.user.mention} asked:\n> {prompt}\n\n**AI:**\n")
         try:
-            response = await self.model.generate_content_async(prompt)
-            ai_response_text = ""
-            if response.parts: ai_response_text = response.text
-            elif response.prompt_feedback and response.prompt_feedback.block_reason:
-                 ai_response_text = f"⚠️ Response blocked: {response.prompt_feedback.block_reason.name}"
-                 logging.warning(f"AI blocked: {response.prompt_feedback.block_reason.name}. Prompt: '{prompt}'")
-            else: ai_response_text = "😕 Empty response from AI."; logging.warning(f"AI empty response. Prompt: '{prompt}'")
-
-            if len(ai_response_text) > 1950: ai_response_text = ai_response_text[:1950] + "... (truncated)" # Adjust limit slightly
-
-            await interaction.followup.send(f">>> {interaction.user.mention} asked:\n> {prompt}\n\n**AI:**\n{ai_response_text}")
+            generate = lambda: self._generate(model, prompt, reply) # Only the request that goes upstream streams
+            if interaction.guild_id in self.cache_opt_outs: self.cache.bypass(); ai_response_text, outcome, _ = await generate()
+            else: ai_response_text, outcome, cache = await self.cache.get_or_generate(prompt_key(prompt), generate)
+            await reply.update(ai_response_text, final=True)
 
         except Exception as e:
-            logging.error(f"Error during AI generation: {e}")
+            logging.error(f"Error during AI generation: {e}"); outcome = 'error'
+            await reply.abort()
             await interaction.followup.send(f"❌ AI Error: {e}")
+        finally: ASK_SECONDS.observe(time.monotonic() - started, outcome=outcome, cache=cache)
+
+    async def _generate(self, model, prompt, reply=None):
+        """One upstream call; returns (text, outcome, cacheable) for ResponseCache.get_or_generate.
+
+        With AI_STREAM, partial text is shown through `reply` as it arrives.
+        """
+        if not AI_STREAM or reply is None: response = await model.generate_content_async(prompt)
+        else:
+            requested = time.monotonic(); text = ''
+            response = await model.generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                if not chunk.parts: continue # e.g. the prompt feedback of a blocked request
+                if not text: ASK_FIRST_TOKEN_SECONDS.observe(time.monotonic() - requested)
+                text += chunk.text; await reply.update(text)
+        if response.parts: return response.text, 'ok', True
+        if response.prompt_feedback and response.prompt_feedback.block_reason:
+            logging.warning(f"AI blocked: {response.prompt_feedback.block_reason.name}. Prompt: '{prompt}'")
+            return f"⚠️ Response blocked: {response.prompt_feedback.block_reason.name}", 'blocked', True
+        logging.warning(f"AI empty response. Prompt: '{prompt}'")
+        return "😕 Empty response from AI.", 'empty', False
+
+    @app_commands.command(name="ask_cache", description="Turns reuse of /ask answers for identical questions on or off for this server.")
+    @app_commands.describe(enabled="Whether this server's questions may be answered from (and added to) the shared cache.")
+    @app_commands.default_permissions(manage_guild=True)
+    @app_commands.checks.has_permissions(manage_guild=True)
+    @app_commands.guild_only()
+    async def ask_cache_command(self, interaction: discord.Interaction, enabled: bool):
+        if enabled: self.cache_opt_outs.discard(interaction.guild_id)
+        else: self.cache_opt_outs.add(interaction.guild_id)
+        await asyncio.to_thread(save_opt_outs, set(self.cache_opt_outs))
+        stats = self.cache.stats()
+        await interaction.response.send_message(
+            f"{'✅ /ask answers may now be reused' if enabled else '🚫 /ask answers will no longer be cached or shared'} for this server.\n"
+            f"Cache: {stats['entries']} answer(s) | Hit ratio: {stats['hit_ratio']:.0%} (hits: {stats['hits']}, coalesced: {stats['coalesced']}, misses: {stats['misses']})",
+            ephemeral=True)
+        logging.info(f"/ask cache {'enabled' if enabled else 'disabled'} by {interaction.user} G{interaction.guild_id}")
 
 
 async def setup(bot: commands.Bot):
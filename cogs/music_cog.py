@@ -4,19 +4,49 @@ import discord
 from discord import app_commands
 from discord import ui
 from discord.ext import commands, tasks
-import yt_dlp
 import asyncio
+import enum
 import logging
+import math
 import time
-from collections import deque
+from contextlib import aclosing
+from urllib.parse import urlparse
 import os
 
+from utils.audio_cache import AudioCache
+from utils.component_router import component_id
+from utils.idle_timers import IdleTimers
+from utils.ui_scheduler import UIScheduler
+from utils.extraction import ExtractionPool, ExtractionError
+from utils.music_queue import TrackQueue, QueueEntry, QueueFullError
+from utils.playback_store import PlaybackStore
+from utils.tracing import tracer
+from utils import metrics
+from utils.ytdl_cache import YTDLCache, stream_url_expiry, search_key, url_key, CACHED_INFO_KEYS
+
 # --- Constants ---
 FFMPEG_BASE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
 FFMPEG_NORMAL_OPTIONS = f'{FFMPEG_BASE_OPTIONS} -vn'
 FFMPEG_BASS_BOOST_OPTIONS = f'{FFMPEG_BASE_OPTIONS} -af "bass=g=15,dynaudnorm=f=150:g=15" -vn'
 FFMPEG_8D_OPTIONS = f'{FFMPEG_BASE_OPTIONS} -af "apulsator=hz=0.08" -vn'
-INACTIVITY_TIMEOUT = 120 # Seconds
+INACTIVITY_TIMEOUT = 120 # Seconds idle (nothing playing or queued) before leaving
+ALONE_TIMEOUT = int(os.getenv('ALONE_TIMEOUT', '60')) # Seconds left alone in the voice channel before leaving
+OPUS_PASSTHROUGH = os.getenv('OPUS_PASSTHROUGH', '1') == '1' # Unfiltered tracks skip in-process PCM decode/volume/encode
+OPUS_PASSTHROUGH_BITRATE = 128 # kbps, only used when ffmpeg has to encode (non-Opus source)
+PLAYBACK_VOLUME = float(os.getenv('PLAYBACK_VOLUME', '0.5')) # Gain on both paths; 1.0 lets passthrough stream-copy Opus
+FRAME_LENGTH = 0.02 # Seconds of audio per frame read by the voice client
+PLAYLIST_DEFAULT_LIMIT = int(os.getenv('PLAYLIST_DEFAULT_LIMIT', '100')) # Tracks added per playlist request
+PLAYLIST_MAX_LIMIT = int(os.getenv('PLAYLIST_MAX_LIMIT', '500'))
+PLAYLIST_PROGRESS_INTERVAL = 2 # Seconds between edits of the progress message
+RESOLVE_ATTEMPTS = 2 # Lookups per queue entry before it is skipped
+RETRY_BACKOFF = 1.0 # Seconds, doubled per retry / consecutive failure
+MAX_RETRY_BACKOFF = 8.0
+MAX_CONSECUTIVE_FAILURES = 5 # Failed entries in a row before the player stops advancing
+SEEK_URL_EXPIRY_MARGIN = 30 # Seconds; a stream URL expiring sooner is re-resolved before seeking
+LOOKAHEAD_DEPTH = 2 # Queue entries resolved in the background while a track plays
+STREAM_URL_EXPIRY_MARGIN = 120 # Re-resolve if the URL expires within this many seconds
+POSITION_SAVE_INTERVAL = 10 # Seconds between saved positions of playing tracks
+RESUME_CONCURRENCY = 8 # Guilds rejoined at once after a restart
 
 # --- YTDL Options ---
 YTDL_FORMAT_OPTIONS = {
@@ -34,13 +64,52 @@ YTDL_FORMAT_OPTIONS = {
     'cookiefile': '/home/ubuntu/discord-music-bot/cookies.txt',
 }
 
-ytdl = yt_dlp.YoutubeDL(YTDL_FORMAT_OPTIONS)
+# Metadata-only search for enqueue time: no format selection, no stream URL
+YTDL_FLAT_OPTIONS = {**YTDL_FORMAT_OPTIONS, 'extract_flat': 'in_playlist'}
 
+# Lazy flat walk over playlists/albums; entries are resolved one by one when they come up
+YTDL_PLAYLIST_OPTIONS = {**YTDL_FLAT_OPTIONS, 'noplaylist': False, 'lazy_playlist': True}
 
-# --- YTDLSource Class (Keep as is) ---
-class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=0.5):
-        super().__init__(source, volume)
+# Each extraction worker builds its own YoutubeDL from these profiles
+extraction_pool = ExtractionPool({'default': YTDL_FORMAT_OPTIONS, 'flat': YTDL_FLAT_OPTIONS, 'playlist': YTDL_PLAYLIST_OPTIONS})
+ytdl_cache = YTDLCache()
+audio_cache = AudioCache()
+playback_store = PlaybackStore()
+
+# --- Metrics ---
+EXTRACTION_SECONDS = metrics.histogram('music_extraction_seconds', "yt-dlp extraction time (incl. pool queueing), by lookup kind.", ('kind',))
+EXTRACTION_FAILURES = metrics.counter('music_extraction_failures_total', "Failed yt-dlp lookups, by extractor and lookup kind.", ('extractor', 'kind'))
+PLAY_TO_AUDIO_SECONDS = metrics.histogram('music_play_to_audio_seconds', "Time from /play on an idle player to the track starting.")
+QUEUE_DEPTH = metrics.gauge('music_queue_depth', "Queued tracks per guild.", ('guild',))
+FFMPEG_PROCESSES = metrics.gauge('music_ffmpeg_processes', "Live ffmpeg processes (playback pipelines and audio cache fills).")
+VOICE_LATENCY = metrics.gauge('music_voice_latency_seconds', "Voice websocket heartbeat latency per guild.", ('guild',))
+
+
+def extractor_label(query):
+    """Short extractor name for metrics: 'youtube' for searches, else the site's name from the URL."""
+    if query.startswith('ytsearch'): return 'youtube'
+    host = (urlparse(query).hostname or '').lower()
+    if host in ('youtu.be', 'youtube-nocookie.com'): return 'youtube'
+    parts = host.split('.')
+    return parts[-2] if len(parts) >= 2 else 'unknown'
+
+
+async def timed_extract(kind, query, **kwargs):
+    """extraction_pool.extract() that records latency and failures; cancellations are not counted."""
+    started = time.monotonic()
+    try: data = await extraction_pool.extract(query, **kwargs)
+    except asyncio.CancelledError: raise
+    except Exception:
+        EXTRACTION_SECONDS.observe(time.monotonic() - started, kind=kind)
+        EXTRACTION_FAILURES.inc(extractor=extractor_label(query), kind=kind); raise
+    EXTRACTION_SECONDS.observe(time.monotonic() - started, kind=kind)
+    if data is None: EXTRACTION_FAILURES.inc(extractor=extractor_label(query), kind=kind)
+    return data
+
+
+# --- Track Source Mixin (metadata + playback position, shared by both playback paths) ---
+class TrackSourceMixin:
+    def _set_metadata(self, data):
         self.data = data
         self.title = data.get('title', 'Unknown Title')
         self.url = data.get('webpage_url')
@@ -56,171 +125,378 @@ class YTDLSource(discord.PCMVolumeTransformer):
         self.like_count = data.get('like_count')
         self.upload_date = data.get('upload_date') # Format: YYYYMMDD
 
+    def _init_playback(self, start, local_file):
+        self.start_offset = start # Seconds into the track where this ffmpeg pipeline started
+        self.local_file = local_file
+        self.frames_read = 0
+        self._primed = None
+
+    @property
+    def position(self):
+        """Seconds into the track, counted from the frames handed to the voice client."""
+        return self.start_offset + self.frames_read * FRAME_LENGTH
+
+    def read(self):
+        if self._primed is not None: data, self._primed = self._primed, None
+        else: data = super().read()
+        if data: self.frames_read += 1
+        return data
+
+    def prime(self, catch_up_to=None):
+        """Blocks until ffmpeg delivers its first frame, so swapping this source in is gapless.
+
+        `catch_up_to` returns the position of the pipeline being replaced; frames up to it are
+        dropped here, which makes up for the time ffmpeg needed to start.
+        """
+        frame = super().read()
+        if catch_up_to is not None:
+            while frame and self.position + FRAME_LENGTH <= catch_up_to():
+                self.frames_read += 1; frame = super().read()
+        self._primed = frame
+
+
+# --- YTDLOpusSource Class (passthrough: ffmpeg emits Opus, no decode/scale/re-encode in-process) ---
+class YTDLOpusSource(TrackSourceMixin, discord.FFmpegOpusAudio):
+    def __init__(self, source, *, data, start=0, local_file=None, **ffmpeg_kwargs):
+        super().__init__(source, **ffmpeg_kwargs)
+        self._set_metadata(data)
+        self._init_playback(start, local_file)
+
+
+# --- YTDLSource Class (PCM path, used when filters are applied) ---
+class YTDLSource(TrackSourceMixin, discord.PCMVolumeTransformer):
+    def __init__(self, source, *, data, volume=PLAYBACK_VOLUME, start=0, local_file=None):
+        super().__init__(source, volume)
+        self._set_metadata(data)
+        self._init_playback(start, local_file)
+
     @classmethod
-    async def from_url(cls, url, *, loop=None, stream=False, ffmpeg_options=FFMPEG_NORMAL_OPTIONS):
-        loop = loop or asyncio.get_event_loop()
-        try: data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
-        except yt_dlp.utils.DownloadError as e: logging.error(f"YTDL DownloadError URL: {e}"); return None
-        if 'entries' in data: data = data['entries'][0]
-        filename = data['url'] if stream else ytdl.prepare_filename(data); final_ffmpeg_opts = f'{ffmpeg_options}'
-        return cls(discord.FFmpegPCMAudio(filename, before_options=FFMPEG_BASE_OPTIONS, options=final_ffmpeg_opts.replace(FFMPEG_BASE_OPTIONS, '').strip()), data=data)
+    async def fetch_url_data(cls, url, *, download=False, guild_id=None, owner=None):
+        """Resolves a URL to its yt-dlp info dict without building an audio source."""
+        key = url_key(url); cached = None if download else ytdl_cache.get(key, STREAM_URL_EXPIRY_MARGIN)
+        if cached and cached.stream_is_fresh(STREAM_URL_EXPIRY_MARGIN): return cached.info
+        try: data = await timed_extract('url', url, download=download, guild_id=guild_id, owner=owner)
+        except ExtractionError as e: logging.error(f"YTDL DownloadError URL: {e}"); return None
+        if data is not None and not download: ytdl_cache.put(key, data)
+        return data
 
     @classmethod
-    async def search(cls, query, *, loop=None, stream=False, ffmpeg_options=FFMPEG_NORMAL_OPTIONS):
-        loop = loop or asyncio.get_event_loop()
+    async def fetch_search_data(cls, query, *, download=False, guild_id=None, owner=None):
+        """Resolves a search term to the info dict of the first result."""
+        key = search_key(query); cached = None if download else ytdl_cache.get(key, STREAM_URL_EXPIRY_MARGIN)
+        if cached:
+            if cached.stream_is_fresh(STREAM_URL_EXPIRY_MARGIN): return cached.info
+            if cached.info.get('webpage_url'):
+                # Search result is known; only the stream URL needs re-resolving
+                data = await cls.fetch_url_data(cached.info['webpage_url'], guild_id=guild_id, owner=owner)
+                if data is not None: ytdl_cache.put(key, data); return data
         try:
             search_query = f"ytsearch1:{query}" # YouTube Search (or scsearch1:)
-            data = await loop.run_in_executor(None, lambda: ytdl.extract_info(search_query, download=not stream))
-        except yt_dlp.utils.DownloadError as e: logging.error(f"YTDL Search DownloadError: {e}"); return None
+            data = await timed_extract('search', search_query, download=download, guild_id=guild_id, owner=owner)
+        except ExtractionError as e: logging.error(f"YTDL Search DownloadError: {e}"); return None
+        except asyncio.CancelledError: raise
         except Exception as e: logging.error(f"YTDL Search Error: {e}"); return None
-        if not data or not data.get('entries'): logging.warning(f"YTDL No results '{query}'"); return None
-        data = data['entries'][0]; filename = data['url'] if stream else ytdl.prepare_filename(data); final_ffmpeg_opts = f'{ffmpeg_options}'
-        return cls(discord.FFmpegPCMAudio(filename, before_options=FFMPEG_BASE_OPTIONS, options=final_ffmpeg_opts.replace(FFMPEG_BASE_OPTIONS, '').strip()), data=data)
+        if not data: logging.warning(f"YTDL No results '{query}'"); return None
+        if download: return data
+        ytdl_cache.put(key, data)
+        if data.get('webpage_url'): ytdl_cache.put(url_key(data['webpage_url']), data)
+        return data
 
+    @classmethod
+    async def fetch_search_metadata(cls, query, *, guild_id=None):
+        """Cheap first phase of a search: title/ID/duration via a flat lookup, no format resolution."""
+        key = search_key(query); cached = ytdl_cache.get(key)
+        if cached: return cached.info
+        try: data = await timed_extract('search_flat', f"ytsearch1:{query}", profile='flat', guild_id=guild_id)
+        except ExtractionError as e: logging.error(f"YTDL Flat Search DownloadError: {e}"); return None
+        except asyncio.CancelledError: raise
+        except Exception as e: logging.error(f"YTDL Flat Search Error: {e}"); return None
+        if not data or not data.get('webpage_url'): logging.warning(f"YTDL No results '{query}'"); return None
+        ytdl_cache.put(key, data) # Cached without a stream URL; fetch_search_data resolves it on demand
+        return data
 
-# --- MusicControlsView Class ---
-class MusicControlsView(ui.View):
-    def __init__(self, *, timeout=None, music_cog_instance):
-        super().__init__(timeout=timeout)
-        self.music_cog = music_cog_instance
-        self.guild_id = None
-        logging.debug(f"Initializing MusicControlsView (Timeout: {timeout})")
-        for item in self.children:
-             if isinstance(item, ui.Button): logging.debug(f"View Init found child button: {item.custom_id} ({item.label})")
-        logging.debug(f"MusicControlsView initialized with {len(self.children)} children.")
-
-    def _get_voice_client(self):
-        if not self.guild_id: logging.debug(f"_get_voice_client: No guild_id set."); return None
-        vc = self.music_cog.voice_clients.get(self.guild_id)
-        logging.debug(f"_get_voice_client G{self.guild_id}: Found VC: {'Yes' if vc else 'No'}")
-        return vc
-
-    def _update_buttons(self):
-        vc = self._get_voice_client()
-        if not vc:
-            logging.debug(f"_update_buttons G{self.guild_id}: No VC, disabling playback controls.")
-            for item in self.children:
-                if isinstance(item, ui.Button):
-                    if item.custom_id in ["pause_resume", "skip", "stop"]: item.disabled = True
-                    else: item.disabled = False # Keep effect/queue enabled
-            return
+    @classmethod
+    async def fetch_data(cls, query, *, meta=None, guild_id=None, owner=None):
+        """Resolves a queue query (URL or search term) for streaming; `meta` is its flat lookup, if any."""
+        if meta and meta.get('webpage_url'): return await cls.fetch_url_data(meta['webpage_url'], guild_id=guild_id, owner=owner)
+        if "http://" in query or "https://" in query: return await cls.fetch_url_data(query, guild_id=guild_id, owner=owner)
+        return await cls.fetch_search_data(query, guild_id=guild_id, owner=owner)
 
-        is_paused=vc.is_paused(); is_playing=vc.is_playing()
-        can_interact_playback = is_playing or is_paused
-        logging.debug(f"_update_buttons G{self.guild_id}: playing={is_playing}, paused={is_paused}, can_interact={can_interact_playback}")
-
-        for item in self.children:
-            if isinstance(item, ui.Button):
-                if item.custom_id == "pause_resume":
-                    item.label = "▶️ Resume" if is_paused else "⏸️ Pause"
-                    item.style = discord.ButtonStyle.green if is_paused else discord.ButtonStyle.secondary
-                    item.disabled = not can_interact_playback
-                    logging.debug(f"  Btn {item.custom_id}: Disabled={item.disabled}")
-                elif item.custom_id in ["skip", "stop"]:
-                     item.disabled = not can_interact_playback
-                     logging.debug(f"  Btn {item.custom_id}: Disabled={item.disabled}")
-                elif item.custom_id.startswith("effect_") or item.custom_id == "show_queue":
-                     item.disabled = False # Keep effect/queue enabled
-                     logging.debug(f"  Btn {item.custom_id}: Disabled={item.disabled}")
-
-    async def disable_all(self, interaction: discord.Interaction = None):
-        guild_id = self.guild_id
-        if not guild_id: return
-        for item in self.children:
-            if isinstance(item, ui.Button): item.disabled = True
-        target_message = None
-        if interaction: target_message = interaction.message
-        elif guild_id in self.music_cog.now_playing_messages:
-            target_message = self.music_cog.now_playing_messages.get(guild_id)
-        if target_message:
-            try: await target_message.edit(view=self)
-            except discord.NotFound: pass
-            except Exception as e: logging.error(f"Error disabling music view G{guild_id}: {e}")
-        if guild_id in self.music_cog.now_playing_messages:
-            del self.music_cog.now_playing_messages[guild_id]
-
-    # --- Button Callbacks ---
-    @ui.button(label="⏸️ Pause", style=discord.ButtonStyle.secondary, custom_id="pause_resume", row=0)
-    async def pause_resume_button(self, interaction: discord.Interaction, button: ui.Button):
-        vc = self._get_voice_client(); action = "Unknown"
-        if not vc: await interaction.response.send_message("Not connected.", ephemeral=True); return
-        if vc.is_playing(): vc.pause(); action="Paused"
-        elif vc.is_paused(): vc.resume(); action="Resumed"
-        else: await interaction.response.send_message("Nothing playing/paused.", ephemeral=True); return
-        logging.debug(f"{action} via button G{self.guild_id}")
-        self._update_buttons(); await interaction.response.edit_message(view=self)
-
-    @ui.button(label="⏭️ Skip", style=discord.ButtonStyle.primary, custom_id="skip", row=0)
-    async def skip_button(self, interaction: discord.Interaction, button: ui.Button):
-        vc = self._get_voice_client(); guild_id = interaction.guild_id;
-        if not guild_id: return
-        queue = self.music_cog.music_queues.get(guild_id)
-        if vc and (vc.is_playing() or vc.is_paused()):
-             if not interaction.response.is_done(): await interaction.response.defer(ephemeral=True)
-             vc.stop(); await interaction.followup.send("Skipping...", ephemeral=True)
-             logging.debug(f"Skipped via button G{guild_id}")
-        elif queue:
-             if not interaction.response.is_done(): await interaction.response.defer(ephemeral=True)
-             await self.music_cog._play_next(interaction.channel); await interaction.followup.send("Trying next...", ephemeral=True)
-             logging.debug(f"Forcing next via skip G{guild_id}")
-        else:
-             if not interaction.response.is_done(): await interaction.response.send_message("Nothing to skip.", ephemeral=True)
-             else: await interaction.followup.send("Nothing to skip.", ephemeral=True)
+    @classmethod
+    def from_data(cls, data, *, stream=True, ffmpeg_options=FFMPEG_NORMAL_OPTIONS, local_file=None, start=0):
+        """Builds a player from an already resolved info dict (only spawns ffmpeg).
 
-    @ui.button(label="⏹️ Stop", style=discord.ButtonStyle.danger, custom_id="stop", row=0)
-    async def stop_button(self, interaction: discord.Interaction, button: ui.Button):
-        vc = self._get_voice_client(); guild_id = interaction.guild_id
-        if not guild_id: return
-        if vc and (vc.is_playing() or vc.is_paused()):
-             if not interaction.response.is_done(): await interaction.response.defer(ephemeral=True)
-             if guild_id in self.music_cog.music_queues: self.music_cog.music_queues[guild_id].clear()
-             vc.stop(); await self.disable_all(interaction)
-             await interaction.channel.send("⏹️ Stopped music and cleared queue.")
-             self.music_cog.last_activity[guild_id] = time.time()
-             logging.debug(f"Stopped via button G{guild_id}, timer updated.")
-        else:
-             if not interaction.response.is_done(): await interaction.response.send_message("Not playing.", ephemeral=True)
-             else: await interaction.followup.send("Not playing.", ephemeral=True)
+        Without an audio filter the Opus passthrough path is used: ffmpeg stream-copies Opus
+        sources (or encodes in its own process) and frames go to Discord untouched. Below unity
+        PLAYBACK_VOLUME, ffmpeg applies the same gain the PCM path does and encodes itself, so
+        switching effects mid-track doesn't change loudness.
+        """
+        final_ffmpeg_opts = ffmpeg_options.replace(FFMPEG_BASE_OPTIONS, '').strip()
+        before_options = ('' if local_file else FFMPEG_BASE_OPTIONS) + (f' -ss {start:.2f}' if start else '') # No reconnect flags for files
+        source = local_file or (data['url'] if stream else data['_filename'])
+        if OPUS_PASSTHROUGH and ffmpeg_options == FFMPEG_NORMAL_OPTIONS:
+            level_matched = PLAYBACK_VOLUME == 1.0
+            codec = 'copy' if level_matched and (local_file or data.get('acodec') == 'opus') else None
+            options = final_ffmpeg_opts if level_matched else f'{final_ffmpeg_opts} -af volume={PLAYBACK_VOLUME}'
+            return YTDLOpusSource(source, data=data, start=start, local_file=local_file, codec=codec, bitrate=OPUS_PASSTHROUGH_BITRATE,
+                                  before_options=before_options.strip() or None, options=options)
+        return cls(discord.FFmpegPCMAudio(source, before_options=before_options.strip() or None, options=final_ffmpeg_opts), data=data, start=start, local_file=local_file)
 
-    @ui.button(label="#️⃣ Q", style=discord.ButtonStyle.secondary, custom_id="show_queue", row=0)
-    async def queue_button(self, interaction: discord.Interaction, button: ui.Button):
-        guild_id = interaction.guild_id
-        if not guild_id: return await interaction.response.send_message("Error: Cannot find server.", ephemeral=True)
-        queue = self.music_cog.music_queues.get(guild_id)
-        voice_client = self.music_cog.voice_clients.get(guild_id)
-        if not queue and (not voice_client or not voice_client.source):
-            await interaction.response.send_message("The queue is empty and nothing is playing!", ephemeral=True); return
+    @classmethod
+    async def from_url(cls, url, *, loop=None, stream=False, ffmpeg_options=FFMPEG_NORMAL_OPTIONS):
+        data = await cls.fetch_url_data(url, download=not stream)
+        if data is None: return None
+        return cls.from_data(data, stream=stream, ffmpeg_options=ffmpeg_options)
+
+    @classmethod
+    async def search(cls, query, *, loop=None, stream=False, ffmpeg_options=FFMPEG_NORMAL_OPTIONS):
+        data = await cls.fetch_search_data(query, download=not stream)
+        if data is None: return None
+        return cls.from_data(data, stream=stream, ffmpeg_options=ffmpeg_options)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes >= 60: return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def is_playlist_url(query):
+    """True for links that point at a whole playlist/album rather than a single track."""
+    try: parsed = urlparse(query.strip())
+    except ValueError: return False
+    host = (parsed.hostname or '').lower(); path = parsed.path
+    if host.endswith('youtube.com') and path.startswith('/playlist'): return True
+    if host.endswith('soundcloud.com') and '/sets/' in path: return True
+    if host.endswith('bandcamp.com') and path.startswith('/album/'): return True
+    return False
+
+
+def queue_line(index, queue_entry):
+    return f"{index + 1}. {entry_title(queue_entry)}"
+
+
+def entry_title(queue_entry):
+    """Display name of a queue entry: the looked-up title if known, else what the user typed."""
+    meta = queue_entry.data or queue_entry.meta
+    if meta and meta.get('title'):
+        return f"{meta['title']} ({format_duration(meta['duration'])})" if meta.get('duration') else meta['title']
+    return queue_entry.query
+
+
+# --- Music Controls (stateless: rebuilt per update, clicks routed as 'music:<guild_id>:<action>') ---
+MUSIC_BUTTONS = ( # action, label, style, row
+    ('pause_resume', "⏸️ Pause", discord.ButtonStyle.secondary, 0),
+    ('skip', "⏭️ Skip", discord.ButtonStyle.primary, 0),
+    ('stop', "⏹️ Stop", discord.ButtonStyle.danger, 0),
+    ('queue', "#️⃣ Q", discord.ButtonStyle.secondary, 0),
+    ('effect_bassboost', "🔊 BB", discord.ButtonStyle.primary, 1),
+    ('effect_8d', "🎧 8D", discord.ButtonStyle.primary, 1),
+    ('effect_normal', "⚪ Normal", discord.ButtonStyle.secondary, 1),
+)
+PLAYBACK_BUTTONS = ('pause_resume', 'skip', 'stop') # Only usable while something plays or is paused
+BUTTON_EFFECTS = {'effect_bassboost': ("Bass Boost", FFMPEG_BASS_BOOST_OPTIONS), 'effect_8d': ("8D Audio", FFMPEG_8D_OPTIONS), 'effect_normal': ("Normal", FFMPEG_NORMAL_OPTIONS)}
+LEGACY_MUSIC_IDS = {'pause_resume': 'pause_resume', 'skip': 'skip', 'stop': 'stop', 'show_queue': 'queue', # custom_id -> action, for
+                    'effect_bassboost': 'effect_bassboost', 'effect_8d': 'effect_8d', 'effect_normal': 'effect_normal'} # pre-router messages
+
+
+def music_controls(guild_id, *, active=True, paused=False, disabled=False):
+    """Builds the now-playing buttons.
+
+    The view is stopped before it is sent, so discord.py never stores it; clicks reach
+    MusicCog._on_music_button through the bot's component router, also after a restart.
+    """
+    view = ui.View(timeout=None)
+    for action, label, style, row in MUSIC_BUTTONS:
+        button = ui.Button(label=label, style=style, row=row, custom_id=component_id('music', guild_id, action))
+        if action == 'pause_resume' and paused: button.label = "▶️ Resume"; button.style = discord.ButtonStyle.green
+        button.disabled = disabled or (action in PLAYBACK_BUTTONS and not active)
+        view.add_item(button)
+    view.stop()
+    return view
+
+
+# --- Queue Browser ---
+class QueuePageView(ui.View):
+    """Prev/next browser over a guild's queue. Each click renders one (cached) page only."""
+
+    def __init__(self, music_cog, guild_id, *, timeout=180):
+        super().__init__(timeout=timeout)
+        self.music_cog = music_cog
+        self.guild_id = guild_id
+        self.page = 0
+
+    def build_embed(self):
+        queue = self.music_cog.music_queues.get(self.guild_id) or TrackQueue()
+        voice_client = self.music_cog.voice_clients.get(self.guild_id)
+        pages = queue.page_count(); self.page = max(0, min(self.page, pages - 1))
         embed = discord.Embed(title="Music Queue", color=discord.Color.blue()); current_song = ""
-        if voice_client and voice_client.source and hasattr(voice_client.source, 'title'):
+        if voice_client and isinstance(voice_client.source, TrackSourceMixin):
             current_song = f"▶️ **{voice_client.source.title}**"
-            if hasattr(voice_client.source, 'duration') and voice_client.source.duration:
-                 duration = voice_client.source.duration; current_song += f" ({int(duration // 60)}:{int(duration % 60):02d})"
+            if voice_client.source.duration: current_song += f" ({format_duration(voice_client.source.duration)})"
             current_song += "\n\n"
-        queue_list = ""
-        if queue:
-            for i, item in enumerate(list(queue)[:10]): queue_list += f"{i + 1}. {item['query']}\n"
-            if len(queue) > 10: queue_list += f"\n...and {len(queue) - 10} more."
-        else: queue_list = "Queue is empty."
-        embed.description = current_song + queue_list
-        await interaction.response.send_message(embed=embed, ephemeral=True)
-
-    @ui.button(label="🔊 BB", style=discord.ButtonStyle.primary, custom_id="effect_bassboost", row=1)
-    async def bassboost_button(self, interaction: discord.Interaction, button: ui.Button):
-        logging.debug(f"BB button clicked G{interaction.guild_id}")
-        try: await self.music_cog._apply_effect(interaction, "Bass Boost", FFMPEG_BASS_BOOST_OPTIONS)
-        except Exception as e: logging.error(f"Error in BB button cb: {e}")
-
-    @ui.button(label="🎧 8D", style=discord.ButtonStyle.primary, custom_id="effect_8d", row=1)
-    async def eightd_button(self, interaction: discord.Interaction, button: ui.Button):
-        logging.debug(f"8D button clicked G{interaction.guild_id}")
-        try: await self.music_cog._apply_effect(interaction, "8D Audio", FFMPEG_8D_OPTIONS)
-        except Exception as e: logging.error(f"Error in 8D button cb: {e}")
-
-    @ui.button(label="⚪ Normal", style=discord.ButtonStyle.secondary, custom_id="effect_normal", row=1)
-    async def normal_button(self, interaction: discord.Interaction, button: ui.Button):
-        logging.debug(f"Normal button clicked G{interaction.guild_id}")
-        try: await self.music_cog._apply_effect(interaction, "Normal", FFMPEG_NORMAL_OPTIONS)
-        except Exception as e: logging.error(f"Error in Normal button cb: {e}")
+        embed.description = current_song + (queue.render_page(self.page, queue_line) if queue else "Queue is empty.")
+        footer = f"Page {self.page + 1}/{pages} • {len(queue)} track(s) • {format_duration(queue.total_duration)} total"
+        if queue.unknown_durations: footer += f" (+{queue.unknown_durations} of unknown length)"
+        embed.set_footer(text=footer)
+        self.prev_button.disabled = self.page == 0; self.next_button.disabled = self.page >= pages - 1
+        return embed
+
+    @ui.button(label="◀️ Prev", style=discord.ButtonStyle.secondary)
+    async def prev_button(self, interaction: discord.Interaction, button: ui.Button):
+        self.page -= 1; await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @ui.button(label="Next ▶️", style=discord.ButtonStyle.secondary)
+    async def next_button(self, interaction: discord.Interaction, button: ui.Button):
+        self.page += 1; await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+
+# --- Guild Player (one long-lived task per guild owns every track transition) ---
+class PlayerState(enum.Enum):
+    IDLE = 'idle'
+    RESOLVING = 'resolving'
+    PLAYING = 'playing'
+    PAUSED = 'paused'
+
+
+class GuildPlayer:
+    """Consumes 'play' commands and 'track_end' events for one guild from an asyncio queue.
+
+    Transitions run strictly one at a time in this task, so concurrent triggers (the
+    after-callback, /play, the skip button) can't race each other or resolve an entry twice.
+    """
+
+    def __init__(self, cog, guild_id):
+        self.cog = cog
+        self.guild_id = guild_id
+        self.state = PlayerState.IDLE
+        self.channel = None # Text channel for now-playing/error messages
+        self.generation = 0 # Bumped per started track; track_end events of older tracks are ignored
+        self.current_entry = None
+        self.trace = None # Trace of the transition in progress
+        self.finish_content = None # Replaces "Queue finished." in the final now-playing edit (e.g. after the Stop button)
+        self._events = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run())
+
+    def post(self, kind, **payload):
+        self._events.put_nowait((kind, payload))
+
+    def post_threadsafe(self, kind, **payload):
+        self.cog.bot.loop.call_soon_threadsafe(self._events.put_nowait, (kind, payload))
+
+    def close(self):
+        self._task.cancel()
+
+    def pause(self, voice_client):
+        voice_client.pause(); self.state = PlayerState.PAUSED
+
+    def resume(self, voice_client):
+        voice_client.resume(); self.state = PlayerState.PLAYING
+
+    async def _run(self):
+        while True:
+            kind, payload = await self._events.get()
+            if payload.get('channel') is not None: self.channel = payload['channel']
+            try:
+                if kind == 'play':
+                    if self.state is PlayerState.IDLE: await self._advance()
+                elif kind == 'track_end':
+                    if payload['generation'] != self.generation: continue # Stale event
+                    error = payload.get('error')
+                    if error:
+                        logging.error(f'Player error G{self.guild_id}: {error}')
+                        try: await self.channel.send(f'Player error: {error}. Skipping.')
+                        except Exception as e: logging.error(f"Failed send player error G{self.guild_id}: {e}")
+                    self.state = PlayerState.IDLE
+                    await self._advance()
+            except asyncio.CancelledError: raise
+            except Exception:
+                logging.exception(f"GuildPlayer error G{self.guild_id}")
+                self.state = PlayerState.IDLE
+
+    async def _advance(self):
+        """Plays the next playable queue entry; failed entries are skipped in a loop, not by recursion."""
+        cog = self.cog; guild_id = self.guild_id; channel = self.channel; failures = 0
+        while True:
+            queue = cog.music_queues.get(guild_id); voice_client = cog.voice_clients.get(guild_id)
+            if not voice_client or not voice_client.is_connected():
+                logging.warning(f"VC disconnected G{guild_id}."); self.state = PlayerState.IDLE; return
+            if not queue:
+                self.state = PlayerState.IDLE
+                cog._arm_idle_timer(guild_id); self.current_entry = None
+                playback_store.update_guild(guild_id, track=None, position=0)
+                logging.debug(f"Queue finished G{guild_id}, timer armed.")
+                content = self.finish_content or "⏹️ Queue finished."; self.finish_content = None
+                cog._update_now_playing(guild_id, channel, forget=True, content=content, embed=None, view=cog._disabled_view(guild_id))
+                return
+
+            queue_entry = queue.popleft(); self.state = PlayerState.RESOLVING
+            query = queue_entry.query; requester_id = queue_entry.requester_id
+            trace = self.trace = tracer.start('track_start', guild_id)
+            try:
+                source = await self._build_source(queue_entry)
+                if source is not None:
+                    self.current_entry = queue_entry
+                    self._start(voice_client, source, requester_id, len(queue)); return
+                if queue_entry.dropped: continue # Queue was cleared while resolving
+                with trace.span('error_send'): await channel.send(f"❌ Failed '{query}'. Skipping.")
+            except Exception as e:
+                logging.exception(f"Error during playback setup G{guild_id}")
+                try: await channel.send(f"Playback error: {e}")
+                except Exception: pass
+            finally: trace.finish(); self.trace = None
+            failures += 1
+            if failures >= MAX_CONSECUTIVE_FAILURES:
+                logging.warning(f"{failures} consecutive failures G{guild_id}; pausing the queue.")
+                await channel.send(f"⚠️ {failures} tracks in a row failed. Use skip or /play to continue.")
+                self.state = PlayerState.IDLE; cog._arm_idle_timer(guild_id); return
+            await asyncio.sleep(min(RETRY_BACKOFF * 2 ** (failures - 1), MAX_RETRY_BACKOFF))
+
+    async def _build_source(self, queue_entry):
+        """Returns a ready audio source for the entry (from the audio cache, a prefetched or a fresh lookup), or None."""
+        cog = self.cog; guild_id = self.guild_id; query = queue_entry.query
+        ffmpeg_options = cog.current_effects.get(guild_id, FFMPEG_NORMAL_OPTIONS)
+        known = queue_entry.data or queue_entry.meta; trace = self.trace
+        with trace.span('cache_lookup'): local_file = audio_cache.lookup(known)
+        if local_file:
+            logging.debug(f"Playing '{query}' from audio cache G{guild_id}")
+            with trace.span('ffmpeg_spawn'): return YTDLSource.from_data(known, ffmpeg_options=ffmpeg_options, local_file=local_file, start=queue_entry.start_at)
+        prefetched = cog._entry_is_fresh(queue_entry)
+        if not prefetched: cog._update_now_playing(guild_id, self.channel, content=f"🔄 Searching for `{query}`...", embed=None, view=None)
+        logging.debug(f"Fetching player '{query}' G{guild_id} (prefetched: {prefetched})")
+        data = None
+        for attempt in range(RESOLVE_ATTEMPTS):
+            try:
+                with trace.span('search' if attempt == 0 else f'search_retry{attempt}'): data = await cog._resolve_entry(queue_entry)
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling(): raise
+                queue_entry.dropped = True; return None # Its extraction job was cancelled
+            if data is not None or attempt + 1 == RESOLVE_ATTEMPTS: break
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+        logging.debug(f"Player fetch '{query}': {'OK' if data else 'Fail'}")
+        if data is None: return None
+        local_file = None if known else audio_cache.lookup(data) # URL entries are only identifiable now
+        if not local_file: audio_cache.record_play(data)
+        with trace.span('ffmpeg_spawn'): return YTDLSource.from_data(data, stream=True, ffmpeg_options=ffmpeg_options, local_file=local_file, start=queue_entry.start_at)
+
+    def _start(self, voice_client, source, requester_id, queue_len):
+        cog = self.cog; guild_id = self.guild_id; trace = self.trace
+        self.generation += 1; generation = self.generation
+        cog.idle_timers.cancel(guild_id, 'idle')
+        with trace.span('voice_play'): voice_client.play(source, after=lambda e: self.post_threadsafe('track_end', generation=generation, error=e))
+        self.state = PlayerState.PLAYING
+        if self.current_entry.requested_at is not None: PLAY_TO_AUDIO_SECONDS.observe(time.monotonic() - self.current_entry.requested_at)
+        logging.info(f"Started playing '{source.title}' G{guild_id}")
+        cog._schedule_lookahead(guild_id)
+        entry = self.current_entry; meta = {key: source.data[key] for key in CACHED_INFO_KEYS if key != 'url' and source.data.get(key) is not None}
+        playback_store.update_guild(guild_id, text_channel_id=self.channel.id, position=source.position,
+                                    track={'query': entry.query, 'requester_id': entry.requester_id, 'meta': meta})
+
+        # Now-playing message follows through the (coalescing) UI scheduler
+        with trace.span('embed_build'):
+            view = music_controls(guild_id)
+            embed = cog._build_now_playing_embed(source, requester_id, queue_len)
+        cog._update_now_playing(guild_id, self.channel, trace=trace, content=None, embed=embed, view=view)
 
 
 # --- Music Cog Class ---
@@ -232,13 +508,43 @@ class MusicCog(commands.Cog):
         self.current_effects = {}
         self.voice_clients = {}
         self.now_playing_messages = {}
-        self.last_activity = {}
-        self.check_inactivity.start()
-        logging.info("MusicCog initialized and inactivity check started.")
+        self.idle_timers = IdleTimers(self._on_idle_timeout)
+        self.lookahead_tasks = {}
+        self.ingest_tasks = {}
+        self.ui = UIScheduler()
+        self.players = {}
+        self.resume_task = None
+        QUEUE_DEPTH.collect = lambda: {(guild_id,): len(queue) for guild_id, queue in self.music_queues.items() if queue}
+        VOICE_LATENCY.collect = lambda: {(guild_id,): vc.latency for guild_id, vc in self.voice_clients.items() if vc and vc.is_connected()}
+        FFMPEG_PROCESSES.collect = lambda: {(): self._count_ffmpeg_processes()}
+        self.persist_ytdl_cache.start()
+        self.persist_positions.start()
+        logging.info("MusicCog initialized.")
+
+    async def cog_load(self):
+        router = getattr(self.bot, 'component_router', None)
+        if router:
+            router.register('music', self._on_music_button)
+            for custom_id, action in LEGACY_MUSIC_IDS.items(): router.add_legacy_id(custom_id, 'music', action)
+        self.resume_task = asyncio.ensure_future(self._resume_all())
 
     def cog_unload(self):
-        self.check_inactivity.cancel()
-        logging.info("MusicCog unloaded and inactivity check cancelled.")
+        router = getattr(self.bot, 'component_router', None)
+        if router: router.unregister('music')
+        self.idle_timers.close()
+        QUEUE_DEPTH.collect = VOICE_LATENCY.collect = FFMPEG_PROCESSES.collect = None
+        if self.resume_task: self.resume_task.cancel()
+        self.persist_positions.cancel(); self._save_positions()
+        playback_store.close()
+        for guild_id in list(self.lookahead_tasks): self._cancel_lookahead(guild_id)
+        for task in self.ingest_tasks.values(): task.cancel()
+        self.ui.close()
+        for guild_id in list(self.players): self._destroy_player(guild_id)
+        self.persist_ytdl_cache.cancel()
+        if ytdl_cache.dirty: ytdl_cache.write(ytdl_cache.snapshot())
+        extraction_pool.shutdown()
+        audio_cache.cancel_fills()
+        logging.info("MusicCog unloaded.")
 
     # --- Helper Methods (Use self.* for state) ---
     async def _ensure_voice(self, interaction: discord.Interaction):
@@ -255,10 +561,10 @@ class MusicCog(commands.Cog):
         try:
             voice_client = await channel.connect()
             self.voice_clients[guild_id] = voice_client
-            if guild_id not in self.music_queues: self.music_queues[guild_id] = deque()
+            self._get_queue(guild_id)
             if guild_id not in self.current_effects: self.current_effects[guild_id] = FFMPEG_NORMAL_OPTIONS
-            if guild_id not in self.last_activity: self.last_activity[guild_id] = 0
-            self.last_activity[guild_id] = time.time(); logging.debug(f"Joined VC G{guild_id}, timer started.")
+            playback_store.update_guild(guild_id, voice_channel_id=channel.id, text_channel_id=interaction.channel_id, effect=self.current_effects[guild_id])
+            self._arm_idle_timer(guild_id); logging.debug(f"Joined VC G{guild_id}, timer armed.")
             return voice_client
         except Exception as e:
             logging.error(f"Error joining VC {channel.name} G{guild_id}: {e}"); error_msg = f"Failed join {channel.name}. Error: {e}"
@@ -269,183 +575,385 @@ class MusicCog(commands.Cog):
     async def _apply_effect(self, interaction: discord.Interaction, effect_name: str, ffmpeg_options: str):
         guild_id = interaction.guild_id
         if guild_id is None: return
-        self.current_effects[guild_id] = ffmpeg_options
+        self.current_effects[guild_id] = ffmpeg_options; playback_store.update_guild(guild_id, effect=ffmpeg_options)
         logging.info(f"Effect set: {effect_name} G{guild_id} by {interaction.user.id}")
-        await interaction.response.send_message(f"🎧 Effect: **{effect_name}** (applies next).", ephemeral=True)
-
-    # --- _play_next Method (With manual button state fix) ---
-    async def _play_next(self, interaction_or_channel):
-        is_interaction = isinstance(interaction_or_channel, discord.Interaction)
-        if is_interaction: guild_id=interaction_or_channel.guild_id; channel=interaction_or_channel.channel
-        elif isinstance(interaction_or_channel, discord.TextChannel): guild_id=interaction_or_channel.guild.id; channel=interaction_or_channel
-        else: logging.error(f"Invalid context: {type(interaction_or_channel)}"); return
-
-        # Cleanup previous message
-        if guild_id in self.now_playing_messages and self.now_playing_messages[guild_id]:
-             old_message = self.now_playing_messages[guild_id]
-             try:
-                 view = MusicControlsView(music_cog_instance=self); view.guild_id = guild_id
-                 for item in view.children: item.disabled = True
-                 await old_message.edit(content="*Playback ended/skipped.*", embed=None, view=view)
-             except Exception as e: logging.debug(f"Error editing old NP G{guild_id}: {e}")
-             finally: self.now_playing_messages[guild_id] = None
-
-        # Play next song
+        await interaction.response.defer(ephemeral=True); metrics.observe_ack(interaction, 'effect')
+        applied = await self._restart_source(guild_id, ffmpeg_options=ffmpeg_options)
+        await interaction.followup.send(f"🎧 Effect: **{effect_name}**" + (" (applied)." if applied else " (applies next)."), ephemeral=True)
+
+    async def _restart_source(self, guild_id, *, ffmpeg_options=None, position=None):
+        """Swaps the current track's ffmpeg pipeline for one with new filters and/or start position.
+
+        Without `position` the new pipeline continues where the old one is. Returns False if
+        nothing swappable is playing.
+        """
+        vc = self.voice_clients.get(guild_id); old = vc.source if vc else None
+        if not isinstance(old, TrackSourceMixin) or not (vc.is_playing() or vc.is_paused()): return False
+        ffmpeg_options = ffmpeg_options or self.current_effects.get(guild_id, FFMPEG_NORMAL_OPTIONS)
+        data = old.data
+        if not old.local_file and stream_url_expiry(data, time.time()) - SEEK_URL_EXPIRY_MARGIN < time.time():
+            # Only re-extract when the stream URL is about to die
+            data = await YTDLSource.fetch_url_data(data['webpage_url'], guild_id=guild_id) if data.get('webpage_url') else None
+            if data is None: return False
+        start = old.position if position is None else max(0, position)
+        new = YTDLSource.from_data(data, ffmpeg_options=ffmpeg_options, local_file=old.local_file, start=start)
+        await asyncio.to_thread(new.prime, None if position is not None else (lambda: old.position))
+        if not new._primed: # ffmpeg could not open the stream, or started past the end: keep the old pipeline
+            new.cleanup(); logging.warning(f"Restarted pipeline G{guild_id} produced no audio at {start:.1f}s; keeping the current one"); return False
+        if vc.source is not old or not (vc.is_playing() or vc.is_paused()): new.cleanup(); return False # Track changed meanwhile
+        if not new.is_opus() and not vc.encoder: # play() only builds the encoder for sessions that started on PCM
+            try: vc.encoder = discord.opus.Encoder()
+            except Exception as e: new.cleanup(); logging.error(f"No Opus encoder for PCM pipeline G{guild_id}: {e}"); return False
+        was_paused = vc.is_paused()
+        vc.source = new
+        if was_paused: vc.pause()
+        self.bot.loop.call_later(1, old.cleanup) # The player thread may still be finishing a read from it
+        logging.debug(f"Restarted pipeline G{guild_id} at {start:.1f}s")
+        return True
+
+    # --- Look-ahead Resolution ---
+    @staticmethod
+    def _entry_is_fresh(queue_entry):
+        return queue_entry.data is not None and time.time() < queue_entry.expires_at - STREAM_URL_EXPIRY_MARGIN
+
+    async def _resolve_entry(self, queue_entry):
+        """Returns fresh info for a queue entry, joining an in-flight look-ahead lookup if there is one."""
+        if self._entry_is_fresh(queue_entry): return queue_entry.data
+        pending = queue_entry.pending
+        if pending is None or pending.done():
+            pending = asyncio.ensure_future(self._fetch_entry(queue_entry)); queue_entry.pending = pending
+        return await asyncio.shield(pending)
+
+    async def _fetch_entry(self, queue_entry):
+        query = queue_entry.query
+        try:
+            data = await YTDLSource.fetch_data(query, meta=queue_entry.meta, guild_id=queue_entry.guild_id, owner=queue_entry)
+            if data is not None:
+                resolved_at = time.time()
+                queue_entry.data = data; queue_entry.expires_at = stream_url_expiry(data, resolved_at)
+                queue = self.music_queues.get(queue_entry.guild_id)
+                if queue is not None: queue.recount(queue_entry); queue.invalidate(0, LOOKAHEAD_DEPTH) # Resolved entries sit at the head; titles may change
+            return data
+        finally: queue_entry.pending = None
+
+    def _schedule_lookahead(self, guild_id):
+        """Starts (or restarts) the background resolver for the head of a guild's queue."""
+        task = self.lookahead_tasks.get(guild_id)
+        if task and not task.done(): task.cancel()
+        if self.music_queues.get(guild_id): self.lookahead_tasks[guild_id] = asyncio.ensure_future(self._lookahead(guild_id))
+        else: self.lookahead_tasks.pop(guild_id, None)
+
+    def _clear_queue(self, guild_id):
+        """Empties a guild's queue and drops any look-ahead or extraction work queued for it."""
+        if guild_id in self.music_queues: self.music_queues[guild_id].clear()
+        self._cancel_lookahead(guild_id)
+        extraction_pool.cancel_guild(guild_id)
+        ingest = self.ingest_tasks.pop(guild_id, None)
+        if ingest and not ingest.done(): ingest.cancel()
+
+    @staticmethod
+    def _discard_entries(entries):
+        """Marks removed entries as dropped and cancels their queued lookups."""
+        for entry in entries:
+            entry.dropped = True
+            if entry.pending: extraction_pool.cancel_owner(entry)
+
+    def _cancel_lookahead(self, guild_id):
+        task = self.lookahead_tasks.pop(guild_id, None)
+        if task and not task.done(): task.cancel()
+
+    async def _lookahead(self, guild_id):
+        # Re-reads the live queue after every lookup, so removed or reordered entries are never
+        # resolved needlessly; a result for an entry that was dropped meanwhile is simply discarded.
+        try:
+            while True:
+                queue = self.music_queues.get(guild_id)
+                if not queue: return
+                window = [entry for entry in queue.slice(0, LOOKAHEAD_DEPTH) if not entry.lookahead_failed]
+                stale = next((entry for entry in window if not self._entry_is_fresh(entry)), None)
+                if stale is None:
+                    if not window: return
+                    # Everything in the window is resolved; wake up again when the soonest URL goes stale
+                    soonest = min(entry.expires_at for entry in window)
+                    await asyncio.sleep(max(1, soonest - STREAM_URL_EXPIRY_MARGIN - time.time())); continue
+                logging.debug(f"Look-ahead resolving '{stale.query}' G{guild_id}")
+                if await self._resolve_entry(stale) is None: stale.lookahead_failed = True # GuildPlayer retries & reports
+        except asyncio.CancelledError: pass
+        except Exception: logging.exception(f"Look-ahead failed G{guild_id}")
+
+    # --- Playlist Ingestion ---
+    async def _ingest_playlist(self, channel, progress_message, url, requester_id, limit):
+        """Appends a playlist to the queue batch by batch; playback starts with the first entry."""
+        guild_id = channel.guild.id; added = 0; title = "playlist"; last_edit = time.monotonic()
+        try:
+            async with aclosing(extraction_pool.iter_playlist(url, limit=limit)) as batches:
+                async for kind, payload in batches:
+                    if kind == 'meta':
+                        if payload is None: await progress_message.edit(content=f"❌ Nothing found at <{url}>."); return
+                        title = payload.get('title') or title; continue
+                    voice_client = self.voice_clients.get(guild_id)
+                    if not voice_client or not voice_client.is_connected(): return
+                    queue = self._get_queue(guild_id); queued_before = len(queue)
+                    accepted = queue.extend(QueueEntry(meta.get('webpage_url') or meta.get('title', 'Unknown'), requester_id, guild_id, meta) for meta in payload)
+                    if added == 0: self._get_player(guild_id).post('play', channel=channel) # No-op unless idle
+                    elif queued_before < LOOKAHEAD_DEPTH: self._schedule_lookahead(guild_id)
+                    added += accepted
+                    if accepted < len(payload): await progress_message.edit(content=f"⚠️ Queue is full; added {added} track(s) from **{title}**."); return
+                    if time.monotonic() - last_edit >= PLAYLIST_PROGRESS_INTERVAL:
+                        last_edit = time.monotonic()
+                        await progress_message.edit(content=f"📃 Loading **{title}**: {added} track(s) queued so far...")
+            capped = f" (limit {limit} reached)" if added >= limit else ""
+            await progress_message.edit(content=f"✅ Added {added} track(s) from **{title}**{capped}.")
+            logging.info(f"Ingested {added} playlist entries G{guild_id}")
+        except ExtractionError as e:
+            logging.error(f"Playlist extraction failed G{guild_id}: {e}")
+            await progress_message.edit(content=f"❌ Failed to load playlist after {added} track(s).")
+        except asyncio.CancelledError:
+            try: await progress_message.edit(content=f"⏹️ Stopped loading **{title}** after {added} track(s).")
+            except Exception: pass
+            raise
+        except Exception: logging.exception(f"Playlist ingestion error G{guild_id}")
+        finally:
+            if self.ingest_tasks.get(guild_id) is asyncio.current_task(): del self.ingest_tasks[guild_id]
+
+    # --- Now Playing Message ---
+    def _disabled_view(self, guild_id):
+        return music_controls(guild_id, disabled=True)
+
+    def _controls_view(self, guild_id):
+        vc = self.voice_clients.get(guild_id)
+        return music_controls(guild_id, active=bool(vc and (vc.is_playing() or vc.is_paused())), paused=bool(vc and vc.is_paused()))
+
+    def _build_now_playing_embed(self, player, requester_id, queue_len):
+        embed = discord.Embed(title="🎶 Now Playing", color=discord.Color.green())
+        if player.url: embed.description = f"**[{player.title}]({player.url})**"
+        else: embed.description = f"**{player.title}**"
+        if player.thumbnail: embed.set_thumbnail(url=player.thumbnail)
+        if player.duration: embed.add_field(name="Duration", value=format_duration(player.duration), inline=True)
+        else: embed.add_field(name="Duration", value="N/A", inline=True)
+        if requester_id: embed.add_field(name="Requested by", value=f"<@{requester_id}>", inline=True)
+        else: embed.add_field(name="Requested by", value="Unknown", inline=True)
+        embed.add_field(name="Queue", value=f"{queue_len} remaining", inline=True)
+        if player.extractor == 'Youtube':
+             if player.uploader: uploader_text = f"[{player.uploader}]({player.uploader_url})" if player.uploader_url else player.uploader; embed.add_field(name="Uploader", value=uploader_text, inline=True)
+             if player.view_count is not None: embed.add_field(name="Views", value=f"{player.view_count:,}", inline=True)
+             if player.upload_date: formatted_date = f"{player.upload_date[:4]}-{player.upload_date[4:6]}-{player.upload_date[6:]}"; embed.add_field(name="Uploaded", value=formatted_date, inline=True)
+        footer_text=f"Source: {player.extractor}"; icon_url="";
+        if player.extractor == 'Soundcloud': icon_url="https://icons.iconarchive.com/icons/custom-icon-design/pretty-office-7/32/Soundcloud-icon.png"
+        elif player.extractor == 'Youtube': icon_url="https://icons.iconarchive.com/icons/social-media-icons/glossy-social-media/32/Youtube-icon.png"
+        if icon_url: embed.set_footer(text=footer_text, icon_url=icon_url)
+        else: embed.set_footer(text=footer_text)
+        return embed
+
+    def _update_now_playing(self, guild_id, channel, *, forget=False, trace=None, **fields):
+        """Coalesced in-place edit of the guild's now-playing message (sent once if there is none).
+
+        Only the latest state per guild reaches Discord; `forget` releases the message afterwards
+        so the next session starts a fresh one at the bottom of the channel. If given, `trace`
+        gets a 'message_send' span when (and if) this update is the one sent.
+        """
+        async def send():
+            message = self.now_playing_messages.get(guild_id)
+            if message and message.channel.id == channel.id:
+                try: await message.edit(**fields)
+                except discord.NotFound: message = None
+            else: message = None
+            if message is None: message = await channel.send(**fields)
+            self.now_playing_messages[guild_id] = None if forget else message
+        async def job():
+            if trace is None: await send(); return
+            with trace.span('message_send'): await send()
+        self.ui.submit(guild_id, 'now_playing', channel.id, job)
+
+    def _count_ffmpeg_processes(self):
+        count = audio_cache.stats()['filling']
+        for voice_client in self.voice_clients.values():
+            source = voice_client.source if voice_client else None
+            source = getattr(source, 'original', source) # PCMVolumeTransformer wraps the FFmpegPCMAudio
+            process = getattr(source, '_process', None)
+            if process is not None and process.poll() is None: count += 1
+        return count
+
+    # --- Now-Playing Buttons ('music:<guild_id>:<action>', see music_controls) ---
+    async def _on_music_button(self, interaction: discord.Interaction, args):
+        try: guild_part, action = args
+        except ValueError: return
+        guild_id = interaction.guild_id
+        if not guild_id: await interaction.response.send_message("Error: Cannot find server.", ephemeral=True); return
+        if guild_part and guild_part != str(guild_id): await interaction.response.send_message("This button belongs to another server.", ephemeral=True); return
+        logging.debug(f"Music button '{action}' clicked G{guild_id}")
+        if action in BUTTON_EFFECTS:
+            effect_name, ffmpeg_options = BUTTON_EFFECTS[action]
+            await self._apply_effect(interaction, effect_name, ffmpeg_options); return
+        handler = {'pause_resume': self._pause_resume_button, 'skip': self._skip_button, 'stop': self._stop_button, 'queue': self._queue_button}.get(action)
+        if handler: await handler(interaction, guild_id)
+
+    async def _pause_resume_button(self, interaction, guild_id):
+        vc = self.voice_clients.get(guild_id); action = "Unknown"
+        if not vc: await interaction.response.send_message("Not connected.", ephemeral=True); return
+        player = self._get_player(guild_id)
+        if vc.is_playing(): player.pause(vc); action="Paused"
+        elif vc.is_paused(): player.resume(vc); action="Resumed"
+        else: await interaction.response.send_message("Nothing playing/paused.", ephemeral=True); return
+        logging.debug(f"{action} via button G{guild_id}")
+        await interaction.response.edit_message(view=self._controls_view(guild_id))
+
+    async def _skip_button(self, interaction, guild_id):
+        vc = self.voice_clients.get(guild_id); queue = self.music_queues.get(guild_id)
+        if vc and (vc.is_playing() or vc.is_paused()):
+             await interaction.response.defer(ephemeral=True)
+             vc.stop(); await interaction.followup.send("Skipping...", ephemeral=True)
+             logging.debug(f"Skipped via button G{guild_id}")
+        elif queue:
+             await interaction.response.defer(ephemeral=True)
+             self._get_player(guild_id).post('play', channel=interaction.channel); await interaction.followup.send("Trying next...", ephemeral=True)
+             logging.debug(f"Forcing next via skip G{guild_id}")
+        else: await interaction.response.send_message("Nothing to skip.", ephemeral=True)
+
+    async def _stop_button(self, interaction, guild_id):
+        vc = self.voice_clients.get(guild_id)
+        if vc and (vc.is_playing() or vc.is_paused()):
+             await interaction.response.defer(ephemeral=True)
+             self._clear_queue(guild_id)
+             # The track_end this causes finds the queue empty: the player then edits the now-playing
+             # message in place (disabled controls) and arms the idle timer, in one UI update
+             self._get_player(guild_id).finish_content = "⏹️ Stopped music and cleared queue."
+             vc.stop()
+             logging.debug(f"Stopped via button G{guild_id}.")
+        else: await interaction.response.send_message("Not playing.", ephemeral=True)
+
+    async def _queue_button(self, interaction, guild_id):
+        queue = self.music_queues.get(guild_id); voice_client = self.voice_clients.get(guild_id)
+        if not queue and (not voice_client or not voice_client.source):
+            await interaction.response.send_message("The queue is empty and nothing is playing!", ephemeral=True); return
+        view = QueuePageView(self, guild_id)
+        await interaction.response.send_message(embed=view.build_embed(), view=view, ephemeral=True)
+
+    # --- Guild Players ---
+    def _get_queue(self, guild_id):
         queue = self.music_queues.get(guild_id)
-        if queue:
-            queue_entry = queue.popleft()
-            query = queue_entry.get('query', 'Unknown'); requester = queue_entry.get('requester')
-            ffmpeg_options = self.current_effects.get(guild_id, FFMPEG_NORMAL_OPTIONS)
+        if queue is None:
+            queue = self.music_queues[guild_id] = TrackQueue()
+            queue.listener = lambda op, entries: playback_store.queue_changed(guild_id, op, entries)
+        return queue
+
+    def _get_player(self, guild_id):
+        player = self.players.get(guild_id)
+        if player is None: player = self.players[guild_id] = GuildPlayer(self, guild_id)
+        return player
+
+    def _destroy_player(self, guild_id):
+        player = self.players.pop(guild_id, None)
+        if player: player.close()
+
+    # --- Inactivity Timers (armed/cancelled by playback and voice state changes) ---
+    def _arm_idle_timer(self, guild_id):
+        self.idle_timers.arm(guild_id, 'idle', INACTIVITY_TIMEOUT)
+
+    def _check_alone(self, guild_id):
+        """Arms the alone timer if no humans are left in the bot's channel, cancels it otherwise."""
+        voice_client = self.voice_clients.get(guild_id)
+        if not voice_client or not voice_client.is_connected(): self.idle_timers.cancel(guild_id, 'alone'); return
+        if any(not member.bot for member in voice_client.channel.members): self.idle_timers.cancel(guild_id, 'alone')
+        else: self.idle_timers.arm_if_unset(guild_id, 'alone', ALONE_TIMEOUT)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        guild_id = member.guild.id; voice_client = self.voice_clients.get(guild_id)
+        if member.id == self.bot.user.id:
+            if after.channel is None and voice_client: # Kicked/disconnected from outside the bot
+                logging.info(f"Voice disconnected externally G{guild_id}.")
+                self._forget_voice(guild_id)
+            else:
+                if after.channel and voice_client: playback_store.update_guild(guild_id, voice_channel_id=after.channel.id)
+                self._check_alone(guild_id)
+            return
+        if not voice_client or not voice_client.is_connected(): return
+        if voice_client.channel in (before.channel, after.channel) and before.channel != after.channel: self._check_alone(guild_id)
+
+    async def _on_idle_timeout(self, guild_id, kind):
+        voice_client = self.voice_clients.get(guild_id)
+        if not voice_client or not voice_client.is_connected(): self._forget_voice(guild_id); return
+        if kind == 'idle' and (voice_client.is_playing() or voice_client.is_paused() or self.music_queues.get(guild_id)): return
+        if kind == 'alone' and any(not member.bot for member in voice_client.channel.members): return
+        reason = "Leaving due to inactivity." if kind == 'idle' else "Leaving, everyone left the voice channel."
+        logging.info(f"{kind.capitalize()} timeout G{guild_id}. Leaving.")
+        self.ui.drop_guild(guild_id)
+        old_message = self.now_playing_messages.get(guild_id)
+        if old_message:
+            try: await old_message.edit(content=reason, embed=None, view=self._disabled_view(guild_id))
+            except Exception as e: logging.error(f"Error editing NP on {kind} leave G{guild_id}: {e}")
+        try: await voice_client.disconnect()
+        except Exception: logging.exception(f"Error during auto disconnect G{guild_id}")
+        finally: self._forget_voice(guild_id)
+
+    def _forget_voice(self, guild_id):
+        """Drops all playback state of a guild whose voice connection is gone."""
+        self.idle_timers.cancel_guild(guild_id); playback_store.forget_guild(guild_id)
+        self.ui.drop_guild(guild_id); self.now_playing_messages.pop(guild_id, None)
+        self._clear_queue(guild_id)
+        self._destroy_player(guild_id)
+        self.voice_clients.pop(guild_id, None)
+
+    # --- Playback State Persistence & Resume ---
+    @tasks.loop(seconds=POSITION_SAVE_INTERVAL)
+    async def persist_positions(self):
+        self._save_positions()
+
+    def _save_positions(self):
+        for guild_id, player in self.players.items():
             voice_client = self.voice_clients.get(guild_id)
-            if not voice_client or not voice_client.is_connected(): logging.warning(f"VC disconnected G{guild_id}."); return
+            if player.current_entry and voice_client and isinstance(voice_client.source, TrackSourceMixin):
+                playback_store.save_position(guild_id, voice_client.source.position)
 
-            thinking_message = None; player = None
-            try:
-                if not is_interaction: thinking_message = await channel.send(f"🔄 Searching for `{query}`...")
-                logging.debug(f"Fetching player '{query}' G{guild_id}")
-                if "http://" in query or "https://" in query: player = await YTDLSource.from_url(query, loop=self.bot.loop, stream=True, ffmpeg_options=ffmpeg_options)
-                else: player = await YTDLSource.search(query, loop=self.bot.loop, stream=True, ffmpeg_options=ffmpeg_options)
-                logging.debug(f"Player fetch '{query}': {'OK' if player else 'Fail'}")
-                if thinking_message: await thinking_message.delete()
-
-                if player is None:
-                     err_msg = f"❌ Failed '{query}'. Skipping."
-                     if is_interaction and interaction_or_channel.response.is_done(): await interaction_or_channel.followup.send(err_msg, ephemeral=True)
-                     else: await channel.send(err_msg)
-                     if not queue: self.last_activity[guild_id] = time.time()
-                     await self._play_next(channel); return
-
-                # Build Embed & View
-                view = MusicControlsView(music_cog_instance=self); view.guild_id = guild_id
-                embed = discord.Embed(title="🎶 Now Playing", color=discord.Color.green())
-                # ... (Build embed fields) ...
-                if player.url: embed.description = f"**[{player.title}]({player.url})**"
-                else: embed.description = f"**{player.title}**"
-                if player.thumbnail: embed.set_thumbnail(url=player.thumbnail)
-                if player.duration: embed.add_field(name="Duration", value=f"{int(player.duration // 60)}:{int(player.duration % 60):02d}", inline=True)
-                else: embed.add_field(name="Duration", value="N/A", inline=True)
-                if requester: embed.add_field(name="Requested by", value=requester.mention, inline=True)
-                else: embed.add_field(name="Requested by", value="Unknown", inline=True)
-                queue_len = len(queue)
-                embed.add_field(name="Queue", value=f"{queue_len} remaining", inline=True)
-                if player.extractor == 'Youtube':
-                     if player.uploader: uploader_text = f"[{player.uploader}]({player.uploader_url})" if player.uploader_url else player.uploader; embed.add_field(name="Uploader", value=uploader_text, inline=True)
-                     if player.view_count is not None: embed.add_field(name="Views", value=f"{player.view_count:,}", inline=True)
-                     if player.upload_date: formatted_date = f"{player.upload_date[:4]}-{player.upload_date[4:6]}-{player.upload_date[6:]}"; embed.add_field(name="Uploaded", value=formatted_date, inline=True)
-                footer_text=f"Source: {player.extractor}"; icon_url="";
-                if player.extractor == 'Soundcloud': icon_url="https://icons.iconarchive.com/icons/custom-icon-design/pretty-office-7/32/Soundcloud-icon.png"
-                elif player.extractor == 'Youtube': icon_url="https://icons.iconarchive.com/icons/social-media-icons/glossy-social-media/32/Youtube-icon.png"
-                if icon_url: embed.set_footer(text=footer_text, icon_url=icon_url)
-                else: embed.set_footer(text=footer_text)
-
-                # --- Manually Set Initial Button States ---
-                logging.debug(f"Manually setting initial btn states G{guild_id}")
-                for item in view.children:
-                    if isinstance(item, ui.Button):
-                        if item.custom_id in ["pause_resume", "skip", "stop", "show_queue"]:
-                            item.disabled = False # Start ENABLED
-                            if item.custom_id == "pause_resume": # Set initial pause style
-                                item.label = "⏸️ Pause"; item.style = discord.ButtonStyle.secondary
-                        elif item.custom_id.startswith("effect_"):
-                            item.disabled = False # Keep effects enabled
-                logging.debug(f"Button states after manual set: {[f'{b.custom_id}({b.disabled})' for b in view.children if isinstance(b, ui.Button)]}")
-                # ---
-
-                # Send Message
-                logging.debug(f"Attempting send NP G{guild_id}. View type: {type(view)}, Children: {len(view.children)}, Timeout: {view.timeout}")
-                now_playing_msg = None
-                try:
-                    if is_interaction and interaction_or_channel.response.is_done():
-                        now_playing_msg = await interaction_or_channel.followup.send(embed=embed, view=view, wait=True)
-                    else: now_playing_msg = await channel.send(embed=embed, view=view)
-
-                    if now_playing_msg: logging.debug(f"NP message sent G{guild_id} ID: {now_playing_msg.id}. Components: {len(now_playing_msg.components)} rows.")
-                    else: logging.error("Failed get NP message object.")
-                    self.now_playing_messages[guild_id] = now_playing_msg
-
-                    # Start playing
-                    self.last_activity[guild_id] = 0
-                    voice_client.play(player, after=lambda e: asyncio.run_coroutine_threadsafe(self._play_next_after_error(channel, e), self.bot.loop))
-                    logging.info(f"Started playing '{player.title}' G{guild_id}")
-
-                except Exception as send_e: logging.exception(f"ERROR Sending NP message G{guild_id}")
+    async def _resume_all(self):
+        """Rejoins the voice channels saved before a restart and resumes their tracks, guilds in parallel."""
+        await self.bot.wait_until_ready()
+        extraction_pool.warm_up()
+        try: states = await asyncio.to_thread(playback_store.load)
+        except Exception: logging.exception("Could not load playback state"); return
+        if not states: return
+        started = time.monotonic(); slots = asyncio.Semaphore(RESUME_CONCURRENCY)
+        async def resume(state):
+            async with slots: return await self._resume_guild(state)
+        results = await asyncio.gather(*(resume(state) for state in states.values()), return_exceptions=True)
+        for state, result in zip(states.values(), results):
+            if isinstance(result, Exception): logging.error(f"Resume failed G{state['guild_id']}: {result!r}")
+        resumed = sum(1 for result in results if result is True)
+        logging.info(f"Resumed playback in {resumed}/{len(states)} guild(s) in {time.monotonic() - started:.1f}s.")
 
-            except Exception as e:
-                 logging.exception(f"Error during playback setup G{guild_id}")
-                 err_msg = f"Playback error: {e}"
-                 if is_interaction and interaction_or_channel.response.is_done(): await interaction_or_channel.followup.send(err_msg, ephemeral=True)
-                 else: await channel.send(err_msg)
-                 if not queue: self.last_activity[guild_id] = time.time()
-                 await asyncio.sleep(2); await self._play_next(channel)
-
-        else: # Queue empty
-            self.last_activity[guild_id] = time.time()
-            logging.debug(f"Queue finished G{guild_id}, timer updated.")
-            # ... (Cleanup last NP msg) ...
-            if guild_id in self.now_playing_messages and self.now_playing_messages[guild_id]:
-                 old_message = self.now_playing_messages[guild_id]
-                 try:
-                      view = MusicControlsView(music_cog_instance=self); view.guild_id = guild_id
-                      for item in view.children: item.disabled = True
-                      await old_message.edit(content="⏹️ Queue finished.", embed=None, view=view)
-                 except Exception as e: logging.debug(f"Error editing final NP msg G{guild_id}: {e}")
-                 finally: self.now_playing_messages[guild_id] = None
-            else: await channel.send("⏹️ Queue finished!")
-
-
-    # --- _play_next_after_error Method (Corrected Syntax) ---
-    async def _play_next_after_error(self, channel: discord.TextChannel, error):
-        """Handles the 'after' callback from voice_client.play"""
-        guild_id = channel.guild.id
-        # --- SYNTAX FIX APPLIED HERE ---
-        if error:
-            logging.error(f'Player error G{guild_id}: {error}')
-            # Start try block on new line, indented
-            try:
-                # Indent the statement inside the try block
-                await channel.send(f'Player error: {error}. Skipping.')
-            except Exception as e:
-                logging.error(f"Failed send player error G{guild_id}: {e}")
-        # --- END SYNTAX FIX ---
-
-        # Check queue *after* error/finish and update timer if needed
-        queue = self.music_queues.get(guild_id) # Use self.
-        if not queue:
-            self.last_activity[guild_id] = time.time() # Use self.
-            logging.debug(f"Queue empty after end/error G{guild_id}, timer updated.")
-
-        # Always try to play the next song or trigger inactivity cleanup
-        await self._play_next(channel) # Call cog's method
-
-
-    # --- Inactivity Check Task (Keep as is) ---
-    @tasks.loop(seconds=30)
-    async def check_inactivity(self):
-        # ... (Implementation unchanged, uses self.* for state) ...
-        await self.bot.wait_until_ready(); current_time = time.time()
-        guild_ids_to_check = list(self.voice_clients.keys())
-        for guild_id in guild_ids_to_check:
-            vc = self.voice_clients.get(guild_id); queue = self.music_queues.get(guild_id)
-            if vc and vc.is_connected() and not vc.is_playing() and not vc.is_paused() and not queue:
-                last_active_time = self.last_activity.get(guild_id, 0)
-                if last_active_time == 0: self.last_activity[guild_id] = current_time; logging.debug(f"Inactivity timer started G{guild_id}"); continue
-                if current_time - last_active_time > INACTIVITY_TIMEOUT:
-                    logging.info(f"Inactivity timeout G{guild_id}. Leaving.")
-                    try:
-                        guild = self.bot.get_guild(guild_id)
-                        if guild:
-                             if guild_id in self.now_playing_messages and self.now_playing_messages[guild_id]:
-                                 old_message = self.now_playing_messages[guild_id]
-                                 try:
-                                     view = MusicControlsView(music_cog_instance=self); view.guild_id = guild_id
-                                     for item in view.children: item.disabled = True
-                                     await old_message.edit(content="Leaving due to inactivity.", embed=None, view=view)
-                                 except Exception as e: logging.error(f"Error editing NP on inactivity leave G{guild_id}: {e}")
-                                 finally: self.now_playing_messages[guild_id] = None
-                             await vc.disconnect()
-                             self.voice_clients[guild_id] = None; self.last_activity[guild_id] = 0
-                             if guild_id in self.music_queues: self.music_queues[guild_id].clear()
-                    except Exception as e: logging.exception(f"Error during auto disconnect G{guild_id}"); self.voice_clients[guild_id] = None; self.last_activity[guild_id] = 0
+    async def _resume_guild(self, state):
+        guild_id = state['guild_id']; guild = self.bot.get_guild(guild_id)
+        if guild is None: return False # Not on this process' shards (or the bot was removed)
+        voice_channel = guild.get_channel(state['voice_channel_id'] or 0)
+        if self.voice_clients.get(guild_id): return False
+        if not isinstance(voice_channel, discord.abc.Connectable) or not any(not member.bot for member in voice_channel.members):
+            playback_store.forget_guild(guild_id); return False # Nobody to resume for
+        text_channel = guild.get_channel(state['text_channel_id'] or 0) or voice_channel
+        voice_client = await voice_channel.connect()
+        self.voice_clients[guild_id] = voice_client
+        self.current_effects[guild_id] = state['effect'] or FFMPEG_NORMAL_OPTIONS
+        entries = []
+        for order_key, query, requester_id, meta in state['entries']:
+            entry = QueueEntry(query, requester_id, guild_id, meta); entry.order_key = order_key; entries.append(entry)
+        queue = self._get_queue(guild_id); queue.restore(entries) # Already stored: restoring writes nothing
+        track = state['track']
+        if track: # Goes back to the head of the queue, starting where it stopped
+            entry = QueueEntry(track['query'], track['requester_id'], guild_id, track['meta'] or None)
+            entry.start_at = max(0, (state['position'] or 0) - 2); queue.insert(0, entry) # A little overlap beats a gap
+        logging.info(f"Resuming G{guild_id}: {len(queue)} queued, position {format_duration(state['position'] or 0)}")
+        self._check_alone(guild_id)
+        if queue: self._get_player(guild_id).post('play', channel=text_channel)
+        else: self._arm_idle_timer(guild_id)
+        return True
+
+    # --- YTDL Cache Persistence Task ---
+    @tasks.loop(minutes=5)
+    async def persist_ytdl_cache(self):
+        if not ytdl_cache.dirty: return
+        rows = ytdl_cache.snapshot()
+        await self.bot.loop.run_in_executor(None, ytdl_cache.write, rows)
+        logging.debug(f"YTDL cache saved: {ytdl_cache.stats()}")
 
     # --- Slash Commands (Keep as is, use self.* for state) ---
     @app_commands.command(name="join", description="Tells the bot to join your voice channel.")
@@ -458,64 +966,115 @@ class MusicCog(commands.Cog):
              msg = "";
              if vc.channel != channel: await vc.move_to(channel); msg = f"Moved to {channel.name}."
              else: msg = "Already in your voice channel."
-             if not vc.is_playing() and not vc.is_paused() and not self.music_queues.get(guild_id): self.last_activity[guild_id] = time.time()
+             if not vc.is_playing() and not vc.is_paused() and not self.music_queues.get(guild_id): self._arm_idle_timer(guild_id)
+             self._check_alone(guild_id)
              await interaction.response.send_message(msg, ephemeral=True)
         else:
              new_vc = await self._ensure_voice(interaction)
              if new_vc: await interaction.response.send_message(f"Joined {channel.name}.", ephemeral=True)
 
     @app_commands.command(name="play", description="Searches YouTube/plays URL and adds to queue.")
-    @app_commands.describe(query="The YouTube search term or a URL (YT/SC).")
-    async def play_slash(self, interaction: discord.Interaction, query: str):
-        # ... (Implementation unchanged) ...
-        guild_id = interaction.guild_id; await interaction.response.defer()
+    @app_commands.describe(query="The YouTube search term or a URL (YT/SC), playlists included.", limit="Max tracks to add from a playlist.")
+    async def play_slash(self, interaction: discord.Interaction, query: str, limit: app_commands.Range[int, 1, PLAYLIST_MAX_LIMIT] = PLAYLIST_DEFAULT_LIMIT):
+        guild_id = interaction.guild_id; requested_at = time.monotonic()
+        await interaction.response.defer(); metrics.observe_ack(interaction, 'play')
         voice_client = await self._ensure_voice(interaction);
         if not voice_client: return
-        if guild_id not in self.music_queues: self.music_queues[guild_id] = deque()
-        is_playing_or_paused = voice_client.is_playing() or voice_client.is_paused()
-        queue_entry = {'query': query, 'requester': interaction.user}
-        self.music_queues[guild_id].append(queue_entry)
-        await interaction.followup.send(f"✅ Added: **{query}**")
-        if not is_playing_or_paused: await self._play_next(interaction)
+        self._get_queue(guild_id)
+        if is_playlist_url(query):
+            if guild_id in self.ingest_tasks: await interaction.followup.send("A playlist is already being loaded.", ephemeral=True); return
+            progress_message = await interaction.followup.send("📃 Loading playlist...", wait=True)
+            self.ingest_tasks[guild_id] = asyncio.ensure_future(self._ingest_playlist(interaction.channel, progress_message, query, interaction.user.id, limit))
+            return
+        if not self.music_queues[guild_id].can_add(): await interaction.followup.send(f"❌ Queue is full ({len(self.music_queues[guild_id])} tracks)."); return
+        meta = None
+        if "http://" not in query and "https://" not in query:
+            meta = await YTDLSource.fetch_search_metadata(query, guild_id=guild_id)
+            if meta is None: await interaction.followup.send(f"❌ No results for **{query}**."); return
+        queue_entry = QueueEntry(query, interaction.user.id, guild_id, meta)
+        if not self.music_queues[guild_id] and self._get_player(guild_id).state == PlayerState.IDLE: queue_entry.requested_at = requested_at
+        try: self.music_queues[guild_id].append(queue_entry)
+        except QueueFullError as e: await interaction.followup.send(f"❌ {e}"); return
+        await interaction.followup.send(f"✅ Added: **{entry_title(queue_entry)}**")
+        self._get_player(guild_id).post('play', channel=interaction.channel) # Ignored unless the player is idle
+        if len(self.music_queues[guild_id]) <= LOOKAHEAD_DEPTH: self._schedule_lookahead(guild_id)
 
     @app_commands.command(name="queue", description="Shows the current music queue.")
-    async def queue_slash(self, interaction: discord.Interaction):
-        # ... (Implementation unchanged) ...
+    @app_commands.describe(page="Page to start on.")
+    async def queue_slash(self, interaction: discord.Interaction, page: app_commands.Range[int, 1] = 1):
         guild_id = interaction.guild_id; queue = self.music_queues.get(guild_id)
-        voice_client = self.voice_clients.get(guild_id); current_msg = self.now_playing_messages.get(guild_id)
+        voice_client = self.voice_clients.get(guild_id)
         if not queue and (not voice_client or not voice_client.source): await interaction.response.send_message("Queue empty/inactive.", ephemeral=True); return
-        embed = discord.Embed(title="Music Queue", color=discord.Color.blue()); current_song = ""
-        if voice_client and voice_client.source and hasattr(voice_client.source, 'title'):
-             current_song = f"▶️ **{voice_client.source.title}**";
-             if hasattr(voice_client.source, 'duration') and voice_client.source.duration: current_song += f" ({int(voice_client.source.duration // 60)}:{int(voice_client.source.duration % 60):02d})"
-             current_song += "\n\n"
-        elif current_msg and current_msg.embeds: current_song = f"▶️ {current_msg.embeds[0].description}\n\n" # Approx
-        queue_list = "";
-        if queue:
-             for i, item in enumerate(list(queue)[:10]): queue_list += f"{i + 1}. {item['query']}\n"
-             if len(queue) > 10: queue_list += f"\n...and {len(queue) - 10} more."
-        else: queue_list = "Queue is empty."
-        embed.description = current_song + queue_list
-        await interaction.response.send_message(embed=embed)
+        view = QueuePageView(self, guild_id); view.page = page - 1
+        await interaction.response.send_message(embed=view.build_embed(), view=view); metrics.observe_ack(interaction, 'queue')
+
+    @app_commands.command(name="seek", description="Jumps to a position in the current track.")
+    @app_commands.describe(position="Target position, e.g. 1:30 or 90 (seconds).")
+    async def seek_slash(self, interaction: discord.Interaction, position: str):
+        guild_id = interaction.guild_id; voice_client = self.voice_clients.get(guild_id)
+        try: seconds = sum(float(part) * 60 ** i for i, part in enumerate(reversed(position.strip().split(':'))))
+        except ValueError: await interaction.response.send_message("Invalid position. Use `1:30` or `90`.", ephemeral=True); return
+        if not voice_client or not isinstance(voice_client.source, TrackSourceMixin): await interaction.response.send_message("Nothing playing.", ephemeral=True); return
+        duration = voice_client.source.duration
+        if not math.isfinite(seconds) or seconds < 0 or (duration and seconds >= duration):
+            await interaction.response.send_message(f"Position must be between 0:00 and {format_duration(duration)}." if duration else "Invalid position. Use `1:30` or `90`.", ephemeral=True); return
+        await interaction.response.defer(ephemeral=True); metrics.observe_ack(interaction, 'seek')
+        if await self._restart_source(guild_id, position=seconds): await interaction.followup.send(f"⏩ Seeked to **{format_duration(seconds)}**.", ephemeral=True)
+        else: await interaction.followup.send("❌ Could not seek in this track.", ephemeral=True)
+
+    # --- Queue Editing (positions are 1-based, as shown by /queue) ---
+    @app_commands.command(name="remove", description="Removes a track from the queue.")
+    @app_commands.describe(position="Queue position of the track to remove.")
+    async def remove_slash(self, interaction: discord.Interaction, position: app_commands.Range[int, 1]):
+        guild_id = interaction.guild_id; queue = self.music_queues.get(guild_id)
+        if not queue or position > len(queue): await interaction.response.send_message(f"No track at position {position}.", ephemeral=True); return
+        entry = queue.pop(position - 1); self._discard_entries((entry,))
+        if position <= LOOKAHEAD_DEPTH: self._schedule_lookahead(guild_id)
+        await interaction.response.send_message(f"🗑️ Removed: **{entry_title(entry)}**")
+
+    @app_commands.command(name="move", description="Moves a track to another position in the queue.")
+    @app_commands.describe(source="Current queue position of the track.", destination="New queue position.")
+    async def move_slash(self, interaction: discord.Interaction, source: app_commands.Range[int, 1], destination: app_commands.Range[int, 1]):
+        guild_id = interaction.guild_id; queue = self.music_queues.get(guild_id)
+        if not queue or source > len(queue): await interaction.response.send_message(f"No track at position {source}.", ephemeral=True); return
+        destination = min(destination, len(queue))
+        entry = queue.move(source - 1, destination - 1)
+        if min(source, destination) <= LOOKAHEAD_DEPTH: self._schedule_lookahead(guild_id)
+        await interaction.response.send_message(f"↕️ Moved **{entry_title(entry)}** to position {destination}.")
+
+    @app_commands.command(name="shuffle", description="Shuffles the queue.")
+    async def shuffle_slash(self, interaction: discord.Interaction):
+        guild_id = interaction.guild_id; queue = self.music_queues.get(guild_id)
+        if not queue or len(queue) < 2: await interaction.response.send_message("Not enough tracks to shuffle.", ephemeral=True); return
+        queue.shuffle(); self._schedule_lookahead(guild_id)
+        await interaction.response.send_message(f"🔀 Shuffled {len(queue)} track(s).")
 
+    @app_commands.command(name="skipto", description="Skips to a track in the queue, dropping the ones before it.")
+    @app_commands.describe(position="Queue position to skip to.")
+    async def skipto_slash(self, interaction: discord.Interaction, position: app_commands.Range[int, 1]):
+        guild_id = interaction.guild_id; queue = self.music_queues.get(guild_id); voice_client = self.voice_clients.get(guild_id)
+        if not queue or position > len(queue): await interaction.response.send_message(f"No track at position {position}.", ephemeral=True); return
+        self._discard_entries(queue.drop_front(position - 1)); self._schedule_lookahead(guild_id)
+        title = entry_title(queue[0])
+        if voice_client and (voice_client.is_playing() or voice_client.is_paused()): voice_client.stop() # track_end advances to the new head
+        else: self._get_player(guild_id).post('play', channel=interaction.channel)
+        await interaction.response.send_message(f"⏭️ Skipping to **{title}**.")
+        logging.debug(f"Skipped to position {position} G{guild_id}")
 
     @app_commands.command(name="leave", description="Disconnects the bot from the voice channel.")
     async def leave_slash(self, interaction: discord.Interaction):
         # ... (Implementation unchanged) ...
         guild_id = interaction.guild_id; voice_client = self.voice_clients.get(guild_id)
         if voice_client and voice_client.is_connected():
+             self.ui.drop_guild(guild_id)
              if guild_id in self.now_playing_messages and self.now_playing_messages[guild_id]:
                  old_message = self.now_playing_messages[guild_id]
                  try:
-                     view = MusicControlsView(music_cog_instance=self); view.guild_id = guild_id
-                     for item in view.children: item.disabled = True
-                     await old_message.edit(content="Disconnected.", embed=None, view=view)
+                     await old_message.edit(content="Disconnected.", embed=None, view=self._disabled_view(guild_id))
                  except Exception as e: logging.error(f"Error editing NP on leave G{guild_id}: {e}")
-                 finally: self.now_playing_messages[guild_id] = None
-             if guild_id in self.music_queues: self.music_queues[guild_id].clear()
+             self._forget_voice(guild_id)
              await voice_client.disconnect()
-             self.voice_clients[guild_id] = None; self.last_activity[guild_id] = 0
-             logging.debug(f"Left VC via command G{guild_id}, timer reset.")
+             logging.debug(f"Left VC via command G{guild_id}, timers cancelled.")
              await interaction.response.send_message("Disconnected.", ephemeral=True)
         else: await interaction.response.send_message("Not in a voice channel.", ephemeral=True)
 
@@ -527,6 +1086,9 @@ async def setup(bot: commands.Bot):
         if not os.path.exists('downloads'):
             try: os.makedirs('downloads'); logging.info("Created downloads directory.")
             except OSError as e: logging.error(f"Could not create downloads directory: {e}")
+    ytdl_cache.load()
+    audio_cache.load_index()
+    playback_store.open()
 
     await bot.add_cog(MusicCog(bot))
     logging.info("MusicCog loaded.")
@@ -2,12 +2,23 @@ import discord
 from discord import app_commands
 from discord import ui
 from discord.ext import commands
-import json
 import logging
-import os
-
-# --- Constants ---
-ROLE_CONFIG_FILE = "role_config.json"
+from utils import metrics
+from utils.component_router import component_id
+from utils.role_store import RoleStore
+from utils.role_toggles import RoleEligibilityIndex, RoleToggleBatcher
+
+# --- Metrics ---
+ROLE_TOGGLES = metrics.counter('role_button_toggles_total', "Persistent role button clicks, by result.", ('result',))
+
+# --- Role Button Replies (keyed by utils.role_toggles problem codes) ---
+ROLE_PROBLEM_MESSAGES = {
+    'not_configured': "Role not configured for this button.",
+    'missing': "Role not found on server.",
+    'no_permission': "I lack 'Manage Roles' permission.",
+    'too_high': "My role isn't high enough for '{name}'.",
+    'managed': "'{name}' is managed by an integration and can't be self-assigned.",
+}
 
 # Define allowed button styles for the choice parameter
 ButtonStyleChoices = [
@@ -17,7 +28,7 @@ ButtonStyleChoices = [
     app_commands.Choice(name="Danger (Red)", value="danger"),
 ]
 
-# --- RoleAssignView Class (Only builds the view, no callbacks here) ---
+# --- RoleAssignView Class (Only builds the view; clicks go through the bot's component router) ---
 class RoleAssignView(ui.View):
     def __init__(self, guild_id: int, role_mappings_for_guild: dict, timeout=None):
         super().__init__(timeout=timeout) # Pass timeout=None for persistence
@@ -35,9 +46,10 @@ class RoleAssignView(ui.View):
                 label=config.get('label', f'Role {role_id}'),
                 emoji=config.get('emoji'),
                 style=style,
-                custom_id=f"role_assign_{role_id}" # Persistent ID handled by on_interaction
+                custom_id=component_id('role', guild_id, role_id) # Routed to RoleAssignCog._on_role_button
             )
             self.add_item(button)
+        self.stop() # Nothing to keep in memory per message: the custom_ids say it all
 
 
 # --- Role Assign Cog Class ---
@@ -45,38 +57,92 @@ class RoleAssignCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.role_mappings = {} # Cog holds the authoritative mapping
-        self._load_role_config() # Load config when cog initializes
-
-    def _load_role_config(self):
-        """Loads role mappings from the JSON file."""
-        try:
-            with open(ROLE_CONFIG_FILE, 'r') as f:
-                loaded_config = json.load(f)
-                # Convert keys back to integers
-                self.role_mappings = {int(gid): {int(rid): data for rid, data in roles.items()}
-                                      for gid, roles in loaded_config.items()}
-                logging.info("Role configuration loaded successfully by RoleAssignCog.")
-                # Update the main bot instance's reference if needed after loading
-                self.bot.role_mappings = self.role_mappings
-        except FileNotFoundError:
-             logging.warning(f"{ROLE_CONFIG_FILE} not found. RoleAssignCog starting empty.")
-             self.role_mappings = {}; self.bot.role_mappings = {}
-        except Exception as e:
-            logging.error(f"Failed to load role config in RoleAssignCog: {e}")
-            self.role_mappings = {}; self.bot.role_mappings = {}
-
-
-    def _save_role_config(self):
-        """Saves current role mappings to the JSON file."""
+        self.eligibility = RoleEligibilityIndex(lambda guild_id: self.role_mappings.get(guild_id, {}))
+        self.toggles = RoleToggleBatcher()
+        self.store = RoleStore()
+        self.store_ready = False # False if the store failed to open; buttons then answer "unavailable"
+        self.bot.role_mappings = self.role_mappings
+
+    async def cog_load(self):
+        router = getattr(self.bot, 'component_router', None)
+        if router: # First, so existing menus get a reply even if the store is down
+            router.register('role', self._on_role_button)
+            router.add_legacy_prefix('role_assign', 'role') # Menus posted before custom_ids carried the guild
+        # Fills the dict in place: the bot keeps a reference to it
+        try: self.role_mappings.update(await self.store.open())
+        except Exception: logging.exception("Failed to load role config in RoleAssignCog; starting empty."); return
+        self.store_ready = True
+        self.store.start_watching(self._on_remote_change)
+
+    def cog_unload(self):
+        router = getattr(self.bot, 'component_router', None)
+        if router: router.unregister('role')
+        self.toggles.close()
+        self.store.close()
+
+    def _on_remote_change(self, guild_id, buttons):
+        """Another cluster process (or this one) committed a change to a guild's buttons."""
+        if buttons: self.role_mappings[guild_id] = buttons
+        else: self.role_mappings.pop(guild_id, None)
+        self.eligibility.invalidate(guild_id)
+
+
+    # --- Persistent Role Buttons ('role:<guild_id>:<role_id>') ---
+    async def _on_role_button(self, interaction: discord.Interaction, args):
+        guild = interaction.guild
+        async def reply(message):
+            if not interaction.response.is_done(): await interaction.response.send_message(message, ephemeral=True)
+            else: await interaction.followup.send(message, ephemeral=True)
+        if not self.store_ready: await reply("Role system unavailable."); return
+        if not guild or not isinstance(interaction.user, discord.Member): await reply("Guild/Member context error."); return
+        try: guild_part, role_part = args; guild_id = int(guild_part) if guild_part else guild.id; role_id = int(role_part)
+        except ValueError: await reply("Invalid button ID."); return
+        if guild_id != guild.id: await reply("This button belongs to another server."); return
+        member = interaction.user
+
+        # --- Eligibility comes from the precomputed per-guild index ---
+        role, problem = self.eligibility.check(guild, role_id)
+        if problem: await reply(ROLE_PROBLEM_MESSAGES[problem].format(name=role.name if role else role_id)); return
+
+        await interaction.response.defer(ephemeral=True); metrics.observe_ack(interaction, 'role_button')
+
+        # --- Toggle Role (a member's rapid clicks share one member.edit) ---
         try:
-            # Convert keys to strings for JSON
-            config_to_save = {str(gid): {str(rid): data for rid, data in roles.items()}
-                              for gid, roles in self.role_mappings.items()}
-            with open(ROLE_CONFIG_FILE, 'w') as f:
-                json.dump(config_to_save, f, indent=4)
-            logging.info("Role configuration saved successfully by RoleAssignCog.")
-        except Exception as e:
-            logging.error(f"Failed to save role config in RoleAssignCog: {e}")
+            action = await self.toggles.toggle(member, role)
+            await interaction.followup.send(f"✅ Role '{role.name}' {action}.", ephemeral=True); ROLE_TOGGLES.inc(result=action)
+            logging.info(f"[Persistent] {action.capitalize()} role {role.id} for {member.id} G{guild.id}")
+        except discord.Forbidden:
+            self.eligibility.invalidate(guild.id) # Our view of the bot's permissions was stale
+            await interaction.followup.send(f"❌ Forbidden: Cannot modify role '{role.name}'.", ephemeral=True); ROLE_TOGGLES.inc(result='forbidden')
+            logging.warning(f"[Persistent] Forbidden role {role.id} for {member.id} G{guild.id}")
+        except discord.HTTPException as e:
+            await interaction.followup.send(f"❌ Error modifying role: {e}", ephemeral=True); ROLE_TOGGLES.inc(result='error')
+            logging.error(f"[Persistent] HTTPException role {role.id} for {member.id}: {e}")
+        except Exception:
+            await interaction.followup.send("❌ Unexpected error.", ephemeral=True)
+            logging.exception(f"[Persistent] Unexpected error role {role.id} user {member.id}")
+
+
+    # --- Eligibility Index Invalidation (anything that changes what the bot may assign) ---
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role):
+        self.eligibility.invalidate(role.guild.id) # Positions of existing roles may have shifted
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.eligibility.invalidate(role.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        self.eligibility.invalidate(after.guild.id)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if after.id == self.bot.user.id and before.roles != after.roles: self.eligibility.invalidate(after.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.eligibility.invalidate(guild.id)
 
 
     # --- Slash Commands for Role Management ---
@@ -94,10 +160,12 @@ class RoleAssignCog(commands.Cog):
         if emoji and len(emoji) > 50: await interaction.response.send_message("Emoji too long.", ephemeral=True); return
         if interaction.guild.me.top_role <= role: await interaction.response.send_message(f"My role isn't high enough to manage '{role.name}'.", ephemeral=True); return
 
-        if guild_id not in self.role_mappings: self.role_mappings[guild_id] = {}
         button_config = {'label': label, 'style': style.value if style else 'secondary', 'emoji': emoji}
-        self.role_mappings[guild_id][role.id] = button_config
-        self._save_role_config()
+        try: await self.store.set_button(guild_id, role.id, button_config)
+        except Exception as e:
+            logging.error(f"Failed to save role {role.id} G{guild_id}: {e}")
+            await interaction.response.send_message("❌ Could not save the role configuration.", ephemeral=True); return
+        self.role_mappings.setdefault(guild_id, {})[role.id] = button_config; self.eligibility.invalidate(guild_id)
 
         await interaction.response.send_message(f"✅ Role button for '{role.name}' configured. Use `/role_menu`.", ephemeral=True)
         logging.info(f"Role {role.id} configured by {interaction.user.id} G{guild_id}")
@@ -112,9 +180,13 @@ class RoleAssignCog(commands.Cog):
         if not guild_id: return
 
         if guild_id in self.role_mappings and role.id in self.role_mappings[guild_id]:
+            try: await self.store.remove_button(guild_id, role.id)
+            except Exception as e:
+                logging.error(f"Failed to remove role {role.id} G{guild_id}: {e}")
+                await interaction.response.send_message("❌ Could not save the role configuration.", ephemeral=True); return
             del self.role_mappings[guild_id][role.id]
             if not self.role_mappings[guild_id]: del self.role_mappings[guild_id]
-            self._save_role_config()
+            self.eligibility.invalidate(guild_id)
             await interaction.response.send_message(f"🗑️ Config for '{role.name}' removed.", ephemeral=True)
             logging.info(f"Role {role.id} removed by {interaction.user.id} G{guild_id}")
         else:
@@ -3,22 +3,40 @@ from discord.ext import commands
 import os
 import asyncio
 import logging
+import logging.handlers
+import importlib.abc
+import importlib.machinery
 import json # For role interactions if handled here
+import sys
 import time # For role interactions if handled here
 from dotenv import load_dotenv
+from utils.command_sync import sync_if_changed
+from utils import metrics
+from utils.loop_monitor import LoopMonitor
+from utils.component_router import ComponentRouter
 # deque is not needed here anymore
 
 # --- Load Environment Variables ---
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+DEV_GUILD_ID = os.getenv('DEV_GUILD_ID') # If set, commands are synced to this guild only (instant updates)
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC') == '1' or '--force-sync' in sys.argv
+STARTUP_PROFILE = os.getenv('STARTUP_PROFILE') == '1' or '--profile-startup' in sys.argv # Per-extension import/setup times
+STARTUP_BUDGET = float(os.getenv('STARTUP_BUDGET', '0')) # Seconds until READY; 0 disables the warning
 
 # --- Logging ---
-# Keep logging setup as before
-logging.basicConfig(level=logging.INFO)
-handler = logging.FileHandler(filename='discord_bot.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logging.getLogger().addHandler(handler)
+LOG_MAX_BYTES = 10 * 1024**2
+LOG_BACKUPS = 5
+
+
+def setup_logging(log_file='discord_bot.log'):
+    """Configures the root logger; cluster workers each pass their own log file."""
+    logging.basicConfig(level=logging.INFO)
+    # Appends and rotates, so a restart (or crash loop) keeps the log that explains it
+    handler = logging.handlers.RotatingFileHandler(filename=log_file, encoding='utf-8', maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
+    logging.getLogger().addHandler(handler)
 
 # --- Bot Intents ---
 intents = discord.Intents.default()
@@ -26,10 +44,48 @@ intents.message_content = True
 intents.voice_states = True
 intents.members = True
 
+# --- Metrics ---
+GATEWAY_LATENCY = metrics.gauge('discord_gateway_latency_seconds', "Gateway heartbeat latency per shard.", ('shard',))
+
+# --- Startup Profiling ---
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """Times the import of one extension as load_extension performs it.
+
+    load_extension always executes the module itself, so importing it beforehand to time the
+    import would run its body twice; wrapping its loader measures the one real import instead.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != self.name: return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path, target)
+        if spec is None or spec.loader is None: return spec
+        exec_module = spec.loader.exec_module
+        def timed_exec_module(module):
+            started = time.perf_counter()
+            try: exec_module(module)
+            finally: self.seconds = time.perf_counter() - started
+        spec.loader.exec_module = timed_exec_module
+        return spec
+
+
 # --- Bot Class ---
-class MusicBot(commands.Bot):
-    def __init__(self):
-        super().__init__(command_prefix="!", intents=intents) # Prefix optional if only slash
+class MusicBot(commands.AutoShardedBot):
+    def __init__(self, *, shard_ids=None, shard_count=None, cluster_id=None):
+        # Without shard_ids/shard_count every recommended shard runs in this process;
+        # cluster.py passes a contiguous slice of shards per worker process instead.
+        super().__init__(command_prefix="!", intents=intents, shard_ids=shard_ids, shard_count=shard_count) # Prefix optional if only slash
+        self.cluster_id = cluster_id
+        self.started_at = time.time()
+        self.startup_timings = {} # Phase -> seconds, logged once on first READY
+        self.extension_timings = {} # Extension -> (import seconds, setup seconds), in profile mode
+        self.metrics_runner = None
+        self.loop_monitor = LoopMonitor()
+        self.component_router = ComponentRouter() # Cogs register their custom_id namespaces here
+        self._setup_done_at = None
 
         # --- State Dictionaries REMOVED from Bot instance ---
         # Let Cogs manage their own state
@@ -43,6 +99,12 @@ class MusicBot(commands.Bot):
         """Loads extensions (Cogs) and syncs commands."""
         print("Running setup hook...")
         logging.info("Running setup hook...")
+        phase_start = time.perf_counter()
+        self.loop_monitor.start() # Before extensions load, so slow setup steps are caught too
+        if metrics.METRICS_PORT:
+            GATEWAY_LATENCY.collect = lambda: {(shard_id,): shard.latency for shard_id, shard in self.shards.items() if not shard.is_closed()}
+            try: self.metrics_runner = await metrics.start_server(metrics.METRICS_PORT + (self.cluster_id or 0))
+            except OSError as e: logging.error(f"Could not start metrics endpoint: {e}")
         cogs_to_load = ['cogs.music_cog', 'cogs.role_assign_cog', 'cogs.admin_cog']
 
         if GOOGLE_API_KEY:
@@ -53,12 +115,21 @@ class MusicBot(commands.Bot):
 
         for extension in cogs_to_load:
             try:
-                await self.load_extension(extension)
+                import_timer = ImportTimer(extension) if STARTUP_PROFILE else None
+                if import_timer: sys.meta_path.insert(0, import_timer)
+                started = time.perf_counter()
+                try: await self.load_extension(extension) # Imports the module (and its not yet loaded dependencies), then runs setup()
+                finally:
+                    if import_timer: sys.meta_path.remove(import_timer)
+                if import_timer:
+                    total = time.perf_counter() - started
+                    self.extension_timings[extension] = (import_timer.seconds, total - import_timer.seconds)
                 print(f"Successfully loaded extension: {extension}")
                 logging.info(f"Successfully loaded extension: {extension}")
             except Exception as e:
                 print(f"ERROR: Failed to load '{extension}': {e}")
                 logging.exception(f"Failed to load extension {extension}")
+        if STARTUP_PROFILE: self._log_extension_profile()
 
         # Get RoleAssignCog instance AFTER loading and link mappings
         self.role_cog_instance = self.get_cog('RoleAssignCog')
@@ -69,22 +140,32 @@ class MusicBot(commands.Bot):
              logging.warning("Could not find RoleAssignCog or its role_mappings after load.")
 
 
-        # Sync commands AFTER loading extensions
-        print("Syncing commands...")
-        logging.info("Syncing commands...")
+        self.startup_timings['extensions'] = time.perf_counter() - phase_start; phase_start = time.perf_counter()
+
+        # Sync commands AFTER loading extensions; commands are global, so one process syncing them is enough
+        if self.cluster_id not in (None, 0): logging.info(f"Cluster {self.cluster_id}: leaving command sync to cluster 0.")
+        else: await self._sync_commands()
+        self.startup_timings['command_sync'] = time.perf_counter() - phase_start
+        self._setup_done_at = time.perf_counter()
+
+    def _log_extension_profile(self):
+        lines = [f"  {extension:<24} import {imported:6.3f}s  setup {setup:6.3f}s"
+                 for extension, (imported, setup) in sorted(self.extension_timings.items(), key=lambda item: -sum(item[1]))]
+        logging.info("Startup profile (slowest first):\n" + "\n".join(lines))
+        print("Startup profile (slowest first):\n" + "\n".join(lines))
+
+    async def _sync_commands(self):
+        """Syncs the command tree only when its fingerprint changed (or FORCE_COMMAND_SYNC / --force-sync)."""
+        guild = None
+        if DEV_GUILD_ID:
+            guild = discord.Object(id=int(DEV_GUILD_ID))
+            self.tree.copy_global_to(guild=guild)
+        target = f"to guild {DEV_GUILD_ID}" if guild else "globally"
         try:
-            # --- CHOOSE SYNC METHOD ---
-            synced = await self.tree.sync()
-            print(f"Synced {len(synced)} command(s) globally.")
-            logging.info(f"Synced {len(synced)} command(s) globally.")
-            # --- OR ---
-            # GUILD_ID = YOUR_TEST_GUILD_ID # Replace
-            # guild_obj = discord.Object(id=GUILD_ID)
-            # self.tree.copy_global_to(guild=guild_obj)
-            # synced = await self.tree.sync(guild=guild_obj)
-            # print(f"Synced {len(synced)} command(s) to guild {GUILD_ID}.")
-            # logging.info(f"Synced {len(synced)} command(s) to guild {GUILD_ID}.")
-            # --- CHOOSE SYNC METHOD ---
+            count = await sync_if_changed(self.tree, self.application_id, guild=guild, force=FORCE_COMMAND_SYNC)
+            if count is not None:
+                print(f"Synced {count} command(s) {target}.")
+                logging.info(f"Synced {count} command(s) {target}.")
         except Exception as e:
             print(f"Error syncing commands: {e}")
             logging.exception("Command sync failed")
@@ -96,90 +177,34 @@ class MusicBot(commands.Bot):
         print('Ready and operational.')
         logging.info(f'Bot logged in as {self.user.name}')
         # Role config loading is now handled by the RoleAssignCog init
+        if self._setup_done_at is not None and 'gateway' not in self.startup_timings:
+            self.startup_timings['gateway'] = time.perf_counter() - self._setup_done_at
+            total = time.time() - self.started_at
+            logging.info("Startup timings: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.startup_timings.items())
+                         + f", total {total:.2f}s")
+            if STARTUP_BUDGET and total > STARTUP_BUDGET: logging.warning(f"Startup took {total:.2f}s, over the {STARTUP_BUDGET:.2f}s budget.")
+
+    async def close(self):
+        if self.metrics_runner: await self.metrics_runner.cleanup(); self.metrics_runner = None
+        await super().close()
+        self.loop_monitor.stop()
+
+    def health(self):
+        """Snapshot reported to the cluster supervisor."""
+        return {
+            'cluster_id': self.cluster_id, 'pid': os.getpid(), 'uptime': time.time() - self.started_at,
+            'ready': self.is_ready(), 'guilds': len(self.guilds), 'voice_clients': len(self.voice_clients),
+            'loop_max_lag': self.loop_monitor.max_lag, 'loop_stalls': len(self.loop_monitor.stalls),
+            'shards': {shard_id: {'latency': shard.latency, 'closed': shard.is_closed()} for shard_id, shard in self.shards.items()},
+        }
 
     async def on_interaction(self, interaction: discord.Interaction):
-        """Global interaction listener, primarily for persistent role buttons."""
-        custom_id = interaction.data.get('custom_id', '')
-
-        # --- Persistent Role Button Handling ---
-        if custom_id.startswith("role_assign_"):
-            logging.debug(f"Handling persistent role button click: {custom_id}")
-            # Ensure the cog holding the logic and mappings is loaded
-            if not self.role_cog_instance:
-                 logging.warning("RoleAssignCog instance not found in on_interaction.")
-                 try:
-                      if not interaction.response.is_done(): await interaction.response.send_message("Role system unavailable.", ephemeral=True)
-                      else: await interaction.followup.send("Role system unavailable.", ephemeral=True)
-                 except discord.NotFound: pass # Ignore if interaction already gone
-                 return
-
-            # Delegate the actual role handling logic maybe? Or keep it here?
-            # Keeping it here for now, but requires self.bot.role_mappings to be linked correctly.
-            try:
-                role_id = int(custom_id.split('_')[-1])
-            except (IndexError, ValueError):
-                 if not interaction.response.is_done(): await interaction.response.send_message("Invalid button ID.", ephemeral=True); return
-                 else: await interaction.followup.send("Invalid button ID.", ephemeral=True); return
-
-            guild = interaction.guild
-            if not guild or not isinstance(interaction.user, discord.Member):
-                 if not interaction.response.is_done(): await interaction.response.send_message("Guild/Member context error.", ephemeral=True); return
-                 else: await interaction.followup.send("Guild/Member context error.", ephemeral=True); return
-            member = interaction.user
-
-            # --- Check if role is configured in the mappings LINKED from the cog ---
-            guild_map = self.role_mappings.get(guild.id, {})
-            if role_id not in guild_map:
-                 if not interaction.response.is_done(): await interaction.response.send_message("Role not configured for this button.", ephemeral=True); return
-                 else: await interaction.followup.send("Role not configured for this button.", ephemeral=True); return
-
-            role = guild.get_role(role_id)
-            if not role:
-                 if not interaction.response.is_done(): await interaction.response.send_message("Role not found on server.", ephemeral=True); return
-                 else: await interaction.followup.send("Role not found on server.", ephemeral=True); return
-
-            # Permission Checks (Bot)
-            if not guild.me.guild_permissions.manage_roles:
-                 if not interaction.response.is_done(): await interaction.response.send_message("I lack 'Manage Roles' permission.", ephemeral=True); return
-                 else: await interaction.followup.send("I lack 'Manage Roles' permission.", ephemeral=True); return
-            if guild.me.top_role <= role:
-                 if not interaction.response.is_done(): await interaction.response.send_message(f"My role isn't high enough for '{role.name}'.", ephemeral=True); return
-                 else: await interaction.followup.send(f"My role isn't high enough for '{role.name}'.", ephemeral=True); return
-
-            # Defer before role modification
-            if not interaction.response.is_done():
-                await interaction.response.defer(ephemeral=True)
-
-            # --- Toggle Role ---
-            try:
-                action = ""
-                if role in member.roles:
-                    await member.remove_roles(role, reason="Self-removed via persistent button")
-                    action = "removed"
-                else:
-                    await member.add_roles(role, reason="Self-assigned via persistent button")
-                    action = "added"
-                await interaction.followup.send(f"✅ Role '{role.name}' {action}.", ephemeral=True)
-                logging.info(f"[Persistent] {action.capitalize()} role {role.id} for {member.id} G{guild.id}")
-            except discord.Forbidden:
-                 await interaction.followup.send(f"❌ Forbidden: Cannot modify role '{role.name}'.", ephemeral=True)
-                 logging.warning(f"[Persistent] Forbidden role {role.id} for {member.id} G{guild.id}")
-            except discord.HTTPException as e:
-                 await interaction.followup.send(f"❌ Error modifying role: {e}", ephemeral=True)
-                 logging.error(f"[Persistent] HTTPException role {role.id} for {member.id}: {e}")
-            except Exception as e:
-                 await interaction.followup.send(f"❌ Unexpected error.", ephemeral=True)
-                 logging.exception(f"[Persistent] Unexpected error role {role.id} user {member.id}")
-
-        # --- Dispatch other interactions (might not be needed) ---
-        # If slash commands / other component interactions are handled by cogs,
-        # the bot usually dispatches them automatically.
-        # You might need this if you have global checks or prefix commands.
-        # elif interaction.type == discord.InteractionType.application_command and not custom_id:
-        #    pass # Let the command tree handle it
+        """Routes component clicks (persistent role and music buttons) by custom_id namespace."""
+        if interaction.type is discord.InteractionType.component: await self.component_router.dispatch(interaction)
 
 # --- Run the Bot ---
 if __name__ == "__main__":
+    setup_logging()
     if TOKEN is None:
         print("ERROR: DISCORD_TOKEN environment variable not set!")
         logging.critical("DISCORD_TOKEN environment variable not set!")
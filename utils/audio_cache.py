@@ -0,0 +1,155 @@
+# utils/audio_cache.py
+
+import asyncio
+import logging
+import os
+import re
+from collections import OrderedDict
+
+# --- Constants ---
+AUDIO_CACHE_ENABLED = os.getenv('AUDIO_CACHE_ENABLED', '0') == '1'
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', 'downloads/audio')
+AUDIO_CACHE_MAX_BYTES = int(os.getenv('AUDIO_CACHE_MAX_BYTES', str(2 * 1024**3)))
+AUDIO_CACHE_MIN_PLAYS = 2 # Plays before a track is worth caching
+AUDIO_CACHE_MAX_DURATION = 20 * 60 # Seconds; long mixes/streams are never cached
+AUDIO_CACHE_PARALLEL_FILLS = 2
+AUDIO_CACHE_BITRATE = '128k'
+PLAY_COUNT_LIMIT = 10000 # Tracked play counts for not-yet-cached tracks (oldest dropped first)
+SAFE_KEY_RE = re.compile(r'[^A-Za-z0-9_-]')
+
+
+def cache_key(data):
+    """'<extractor>-<id>' for an info dict, or None if it can't be identified."""
+    if not data: return None
+    extractor = data.get('extractor_key') or data.get('extractor'); video_id = data.get('id')
+    if not extractor or not video_id: return None
+    return SAFE_KEY_RE.sub('_', f"{extractor.lower()}-{video_id}")
+
+
+class AudioCache:
+    """Size-capped directory of Opus files for frequently played tracks, evicted LRU.
+
+    Tracks are filled in the background (transcoded by ffmpeg from the stream URL, or
+    stream-copied when the source already is Opus) once they reach AUDIO_CACHE_MIN_PLAYS.
+    Cluster processes share the directory: a file's mtime is its last play, and the byte
+    cap is enforced against what is on disk, not against this process's own fills.
+    """
+
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES, enabled=AUDIO_CACHE_ENABLED):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._files = OrderedDict() # key -> size in bytes, least recently played first
+        self._play_counts = OrderedDict()
+        self._fills = {} # key -> asyncio.Task
+        self._fill_slots = asyncio.Semaphore(AUDIO_CACHE_PARALLEL_FILLS)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.failed_fills = 0
+        self.evictions = 0
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.opus")
+
+    def load_index(self):
+        """Rebuilds the index from disk, oldest access first. Blocking; call from setup."""
+        if not self.enabled: return
+        try: os.makedirs(self.directory, exist_ok=True)
+        except OSError as e: logging.error(f"Could not create audio cache directory: {e}"); self.enabled = False; return
+        for _, key, size in self._scan(remove_partial=True):
+            self._files[key] = size; self.total_bytes += size
+        logging.info(f"Audio cache loaded: {len(self._files)} file(s), {self.total_bytes / 1024**2:.1f} MiB.")
+
+    def _scan(self, remove_partial=False):
+        """Returns [(last used, key, size)] for every cached file on disk, oldest first. Blocking."""
+        files = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.part'):
+                    if remove_partial: self._remove_file(entry.path) # Interrupted fill (at startup; other clusters may be filling now)
+                elif entry.name.endswith('.opus'):
+                    try: stat = entry.stat()
+                    except FileNotFoundError: continue # Evicted by another process meanwhile
+                    files.append((max(stat.st_atime, stat.st_mtime), entry.name[:-5], stat.st_size))
+        return sorted(files)
+
+    def lookup(self, data):
+        """Returns the local file for a track if cached, counting a hit or miss."""
+        key = cache_key(data) if self.enabled else None
+        if key is None: return None
+        if key in self._files:
+            path = self.path_for(key)
+            try: os.utime(path) # Marks it recently played for every process sharing the directory
+            except FileNotFoundError: self.total_bytes -= self._files.pop(key) # Another process evicted it
+            else:
+                self._files.move_to_end(key); self.hits += 1
+                return path
+        self.misses += 1
+        return None
+
+    def record_play(self, data):
+        """Counts a streamed play and starts a background fill once the track is popular enough."""
+        key = cache_key(data) if self.enabled else None
+        if key is None or key in self._files or key in self._fills: return
+        if not data.get('url') or (data.get('duration') or AUDIO_CACHE_MAX_DURATION + 1) > AUDIO_CACHE_MAX_DURATION: return
+        count = self._play_counts.pop(key, 0) + 1
+        if count < AUDIO_CACHE_MIN_PLAYS:
+            self._play_counts[key] = count
+            if len(self._play_counts) > PLAY_COUNT_LIMIT: self._play_counts.popitem(last=False)
+            return
+        task = asyncio.ensure_future(self._fill(key, data))
+        self._fills[key] = task
+        task.add_done_callback(lambda _: self._fills.pop(key, None))
+
+    async def _fill(self, key, data):
+        path = self.path_for(key); part_path = f"{path}.part"
+        codec = ['-c:a', 'copy'] if data.get('acodec') == 'opus' else ['-c:a', 'libopus', '-b:a', AUDIO_CACHE_BITRATE]
+        args = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5',
+                '-i', data['url'], '-vn', *codec, '-f', 'opus', '-y', part_path]
+        process = None
+        async with self._fill_slots:
+            try:
+                process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+                _, stderr = await process.communicate()
+                if process.returncode != 0: raise RuntimeError(stderr.decode(errors='replace').strip()[-300:])
+                os.replace(part_path, path); size = os.path.getsize(path)
+            except asyncio.CancelledError:
+                if process and process.returncode is None: process.kill()
+                self._remove_file(part_path); raise
+            except Exception as e:
+                self.failed_fills += 1; self._remove_file(part_path)
+                logging.warning(f"Audio cache fill failed for {key}: {e}"); return
+        self._files[key] = size; self.total_bytes += size; self.fills += 1
+        logging.info(f"Audio cache filled {key} ({size / 1024**2:.1f} MiB).")
+        await self._evict()
+
+    async def _evict(self):
+        """Deletes the least recently played files until the whole directory fits max_bytes."""
+        files = await asyncio.to_thread(self._scan)
+        disk_bytes = sum(size for _, _, size in files); victims = []
+        for _, key, size in files[:-1]: # Never the newest file
+            if disk_bytes <= self.max_bytes: break
+            disk_bytes -= size; victims.append(key)
+        for key in victims:
+            size = self._files.pop(key, None)
+            if size is not None: self.total_bytes -= size
+            self.evictions += 1
+            await asyncio.to_thread(self._remove_file, self.path_for(key))
+
+    @staticmethod
+    def _remove_file(path):
+        try: os.remove(path)
+        except OSError: pass
+
+    def cancel_fills(self):
+        for task in list(self._fills.values()): task.cancel()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled, 'files': len(self._files), 'bytes': self.total_bytes, 'max_bytes': self.max_bytes,
+            'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'fills': self.fills, 'failed_fills': self.failed_fills, 'filling': len(self._fills), 'evictions': self.evictions,
+        }
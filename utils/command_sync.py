@@ -0,0 +1,48 @@
+# utils/command_sync.py
+
+import hashlib
+import json
+import logging
+import os
+
+# --- Constants ---
+COMMAND_HASH_FILE = os.getenv('COMMAND_HASH_FILE', 'downloads/command_tree_hashes.json')
+
+
+def command_tree_hash(tree, guild=None):
+    """Stable SHA-256 of the command payloads `tree.sync(guild=guild)` would upload."""
+    payload = [command.to_dict(tree) for command in tree.get_commands(guild=guild)]
+    payload.sort(key=lambda command: (command.get('type', 1), command['name']))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str).encode()).hexdigest()
+
+
+def _load_hashes(path):
+    try:
+        with open(path, encoding='utf-8') as f: return json.load(f)
+    except FileNotFoundError: return {}
+    except (OSError, ValueError) as e: logging.warning(f"Ignoring unreadable command hash file: {e}"); return {}
+
+
+def _save_hashes(path, hashes):
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(hashes, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e: logging.warning(f"Could not save command hash file: {e}")
+
+
+async def sync_if_changed(tree, application_id, *, guild=None, force=False, path=COMMAND_HASH_FILE):
+    """Syncs the tree (globally, or to `guild`) only if it changed since the last successful sync.
+
+    Returns the number of commands synced, or None if the sync was skipped.
+    """
+    key = f"{application_id}:{guild.id if guild else 'global'}"
+    digest = command_tree_hash(tree, guild=guild)
+    hashes = _load_hashes(path)
+    if not force and hashes.get(key) == digest:
+        logging.info(f"Command tree unchanged ({digest[:12]}), skipping sync for {key}.")
+        return None
+    synced = await tree.sync(guild=guild)
+    hashes[key] = digest; _save_hashes(path, hashes)
+    return len(synced)
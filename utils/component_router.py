@@ -0,0 +1,76 @@
+# utils/component_router.py
+
+import logging
+
+# --- Constants ---
+SEPARATOR = ':'
+MAX_CUSTOM_ID = 100 # Discord's limit
+
+
+def component_id(namespace, *parts):
+    """Builds a routable custom_id, e.g. component_id('music', guild_id, 'skip') -> 'music:123:skip'."""
+    custom_id = SEPARATOR.join((namespace, *map(str, parts)))
+    if len(custom_id) > MAX_CUSTOM_ID: raise ValueError(f"custom_id too long ({len(custom_id)} > {MAX_CUSTOM_ID}): {custom_id}")
+    return custom_id
+
+
+class ComponentRouter:
+    """Dispatch table from custom_id namespaces to component handlers.
+
+    Buttons carry everything their handler needs (e.g. 'role:<guild_id>:<role_id>'), so
+    messages can be sent with stopped views that discord.py never stores: nothing is kept
+    per message, and clicks on old messages still work after a restart. A click costs one
+    split and one dict lookup. IDs from before namespacing can be mapped onto a handler
+    with `add_legacy_id` / `add_legacy_prefix`; their guild part is left empty.
+    """
+
+    def __init__(self):
+        self._handlers = {} # namespace -> async handler(interaction, args)
+        self._legacy_ids = {} # custom_id -> (namespace, args)
+        self._legacy_prefixes = {} # 'role_assign' (of 'role_assign_<id>') -> namespace
+        self.dispatched = 0
+
+    def register(self, namespace, handler):
+        if SEPARATOR in namespace: raise ValueError(f"Namespace may not contain '{SEPARATOR}': {namespace}")
+        self._handlers[namespace] = handler
+
+    def unregister(self, namespace):
+        self._handlers.pop(namespace, None)
+        self._legacy_ids = {custom_id: route for custom_id, route in self._legacy_ids.items() if route[0] != namespace}
+        self._legacy_prefixes = {prefix: target for prefix, target in self._legacy_prefixes.items() if target != namespace}
+
+    def add_legacy_id(self, custom_id, namespace, *args):
+        self._legacy_ids[custom_id] = (namespace, ('', *map(str, args)))
+
+    def add_legacy_prefix(self, prefix, namespace):
+        """Routes '<prefix>_<value>' to `namespace` with args ('', value)."""
+        self._legacy_prefixes[prefix] = namespace
+
+    def resolve(self, custom_id):
+        """Returns (handler, args) for a custom_id, or (None, None) if no handler owns it."""
+        namespace, separator, rest = custom_id.partition(SEPARATOR)
+        if separator:
+            handler = self._handlers.get(namespace)
+            return (handler, tuple(rest.split(SEPARATOR))) if handler else (None, None)
+        route = self._legacy_ids.get(custom_id)
+        if route is None:
+            prefix, _, value = custom_id.rpartition('_')
+            namespace = self._legacy_prefixes.get(prefix)
+            if namespace is None: return None, None
+            route = (namespace, ('', value))
+        handler = self._handlers.get(route[0])
+        return (handler, route[1]) if handler else (None, None)
+
+    async def dispatch(self, interaction):
+        """Runs the handler owning the interaction's custom_id; returns False if there is none.
+
+        Unowned IDs are left alone: they may belong to a live discord.py view.
+        """
+        custom_id = (interaction.data or {}).get('custom_id')
+        if not custom_id: return False
+        handler, args = self.resolve(custom_id)
+        if handler is None: return False
+        self.dispatched += 1
+        try: await handler(interaction, args)
+        except Exception: logging.exception(f"Component handler failed for '{custom_id}' G{interaction.guild_id}")
+        return True
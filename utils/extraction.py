@@ -0,0 +1,235 @@
+# utils/extraction.py
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from utils.ytdl_cache import trim_info
+
+# --- Constants ---
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', '3'))
+EXTRACTION_MODE = os.getenv('EXTRACTION_MODE', 'thread') # 'thread' or 'process'
+PLAYLIST_WORKERS = 2 # Playlist walks stream results back, so they always run in threads
+PLAYLIST_BATCH_SIZE = 25
+
+
+class ExtractionError(Exception):
+    """Picklable stand-in for yt-dlp errors raised inside a worker."""
+
+
+# --- Worker Side (runs in pool threads / processes) ---
+_worker_profiles = {}
+_worker_state = threading.local()
+
+
+def _init_worker(profiles):
+    global _worker_profiles
+    _worker_profiles = profiles
+
+
+def _warm_up():
+    import yt_dlp # noqa: F401  (yt-dlp's import alone takes ~0.5-1 s, so it is paid off the startup path)
+
+
+def _get_ytdl(profile):
+    """Returns this worker's own YoutubeDL for `profile`; instances are never shared between threads."""
+    import yt_dlp
+    instances = getattr(_worker_state, 'instances', None)
+    if instances is None: instances = _worker_state.instances = {}
+    ydl = instances.get(profile)
+    if ydl is None: ydl = instances[profile] = yt_dlp.YoutubeDL(_worker_profiles[profile])
+    return ydl
+
+
+def _extract_job(profile, query, download):
+    import yt_dlp
+    ydl = _get_ytdl(profile)
+    try: data = ydl.extract_info(query, download=download)
+    except yt_dlp.utils.DownloadError as e: raise ExtractionError(str(e)) from None
+    if data and 'entries' in data:
+        entries = data['entries']
+        data = next(iter(entries), None) if entries else None
+    if not data: return None
+    if download:
+        data['_filename'] = ydl.prepare_filename(data)
+        return data
+    return trim_info(data) # Keeps results small, also when they have to cross a process boundary
+
+
+def _playlist_job(profile, url, limit, batch_size, emit, stop):
+    """Walks a playlist lazily in flat mode and emits ('meta', info) then ('batch', [entries]).
+
+    The first entry is emitted on its own so playback can start right away. Only trimmed
+    entries are ever held, and at most one batch at a time.
+    """
+    try:
+        import yt_dlp
+        ydl = _get_ytdl(profile)
+        try:
+            result = ydl.extract_info(url, download=False, process=False)
+            while result and result.get('_type') in ('url', 'url_transparent'): # Redirects, e.g. /watch?list= -> playlist
+                result = ydl.extract_info(result['url'], download=False, process=False, ie_key=result.get('ie_key'))
+            if not result: emit(('meta', None)); return
+            if result.get('_type') != 'playlist': # Not a playlist after all; hand back the single video as a flat entry
+                emit(('meta', {'title': result.get('title'), 'playlist': False}))
+                emit(('batch', [trim_info({**result, '_type': 'url', 'webpage_url': result.get('webpage_url') or url})])); return
+            emit(('meta', {'title': result.get('title'), 'playlist': True}))
+            batch = []; count = 0
+            for entry in result.get('entries') or ():
+                if stop.is_set() or count >= limit: break
+                if not entry: continue
+                batch.append(trim_info(entry)); count += 1
+                if count == 1 or len(batch) >= batch_size: emit(('batch', batch)); batch = []
+            if batch: emit(('batch', batch))
+        except yt_dlp.utils.DownloadError as e: raise ExtractionError(str(e)) from None
+    finally: emit(None)
+
+
+# --- Scheduler Side (runs on the event loop) ---
+class ExtractionJob:
+    __slots__ = ('guild_id', 'owner', 'args', 'future', 'enqueued_at')
+
+    def __init__(self, guild_id, owner, args, future):
+        self.guild_id = guild_id
+        self.owner = owner
+        self.args = args
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class ExtractionPool:
+    """Bounded yt-dlp worker pool with round-robin fairness between guilds.
+
+    Each guild has its own FIFO of pending jobs and guilds take turns for free workers,
+    so one guild queueing a long playlist can't starve the others. Pending jobs can be
+    cancelled by guild or by owner (the queue entry they resolve).
+    """
+
+    def __init__(self, profiles, *, workers=EXTRACTION_WORKERS, mode=EXTRACTION_MODE):
+        self.profiles = profiles
+        self.workers = max(1, workers)
+        self.mode = mode
+        self._executor = None
+        self._playlist_executor = None
+        self._pending = {} # guild_id -> deque[ExtractionJob]
+        self._turns = deque() # guild_ids with pending jobs, in round-robin order
+        self._running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_extract = 0.0
+        self.max_extract = 0.0
+
+    def _ensure_executor(self):
+        if self._executor is None:
+            if self.mode == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.profiles,))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ytdl', initializer=_init_worker, initargs=(self.profiles,))
+            logging.info(f"Extraction pool started: {self.workers} {self.mode} worker(s).")
+        return self._executor
+
+    def warm_up(self):
+        """Imports yt-dlp in a worker in the background, so the first /play doesn't pay for it."""
+        asyncio.get_running_loop().run_in_executor(self._ensure_executor(), _warm_up)
+
+    def shutdown(self):
+        for guild_id in list(self._pending): self.cancel_guild(guild_id)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True); self._executor = None
+        if self._playlist_executor is not None:
+            self._playlist_executor.shutdown(wait=False, cancel_futures=True); self._playlist_executor = None
+
+    async def iter_playlist(self, url, *, limit, profile='playlist', batch_size=PLAYLIST_BATCH_SIZE):
+        """Async generator over a playlist: yields ('meta', info) once, then ('batch', [entries]).
+
+        Walking stops early when the consumer stops iterating (e.g. the queue was cleared).
+        """
+        if self._playlist_executor is None:
+            self._playlist_executor = ThreadPoolExecutor(max_workers=PLAYLIST_WORKERS, thread_name_prefix='ytdl-playlist', initializer=_init_worker, initargs=(self.profiles,))
+        loop = asyncio.get_running_loop(); results = asyncio.Queue(); stop = threading.Event()
+        emit = lambda item: loop.call_soon_threadsafe(results.put_nowait, item)
+        work = loop.run_in_executor(self._playlist_executor, _playlist_job, profile, url, limit, batch_size, emit, stop)
+        try:
+            while (item := await results.get()) is not None: yield item
+            await work # Re-raises extraction errors
+        finally: stop.set()
+
+    async def extract(self, query, *, profile='default', download=False, guild_id=None, owner=None):
+        """Queues an extraction and waits for its (trimmed) info dict, or None if nothing was found."""
+        future = asyncio.get_running_loop().create_future()
+        job = ExtractionJob(guild_id, owner, (profile, query, download), future)
+        if guild_id not in self._pending:
+            self._pending[guild_id] = deque(); self._turns.append(guild_id)
+        self._pending[guild_id].append(job)
+        self._dispatch()
+        return await future
+
+    def _next_job(self):
+        while self._turns:
+            guild_id = self._turns.popleft(); jobs = self._pending[guild_id]
+            job = jobs.popleft()
+            if jobs: self._turns.append(guild_id)
+            else: del self._pending[guild_id]
+            if not job.future.done(): return job # Skip jobs whose waiter was cancelled
+            self.cancelled += 1
+        return None
+
+    def _dispatch(self):
+        while self._running < self.workers:
+            job = self._next_job()
+            if job is None: return
+            wait = time.monotonic() - job.enqueued_at
+            self.total_wait += wait; self.max_wait = max(self.max_wait, wait)
+            self._running += 1
+            started = time.monotonic()
+            work = asyncio.get_running_loop().run_in_executor(self._ensure_executor(), _extract_job, *job.args)
+            work.add_done_callback(lambda fut, job=job, started=started: self._finish(job, fut, started))
+
+    def _finish(self, job, work, started):
+        self._running -= 1
+        elapsed = time.monotonic() - started
+        self.total_extract += elapsed; self.max_extract = max(self.max_extract, elapsed)
+        if work.cancelled(): self.cancelled += 1
+        elif work.exception() is not None: self.failed += 1
+        else: self.completed += 1
+        if not job.future.done():
+            if work.cancelled(): job.future.cancel()
+            elif work.exception() is not None: job.future.set_exception(work.exception())
+            else: job.future.set_result(work.result())
+        self._dispatch()
+
+    def cancel_guild(self, guild_id):
+        """Drops all of a guild's pending jobs (e.g. on queue clear or disconnect)."""
+        jobs = self._pending.pop(guild_id, None)
+        if not jobs: return 0
+        try: self._turns.remove(guild_id)
+        except ValueError: pass
+        for job in jobs: job.future.cancel()
+        self.cancelled += len(jobs)
+        return len(jobs)
+
+    def cancel_owner(self, owner):
+        """Cancels pending jobs started for `owner`; the slot is skipped lazily at dispatch."""
+        count = 0
+        for jobs in self._pending.values():
+            for job in jobs:
+                if job.owner is owner and not job.future.done(): job.future.cancel(); count += 1
+        return count
+
+    def stats(self):
+        dispatched = self.completed + self.failed
+        return {
+            'mode': self.mode, 'workers': self.workers, 'running': self._running,
+            'pending': sum(len(jobs) for jobs in self._pending.values()),
+            'pending_by_guild': {guild_id: len(jobs) for guild_id, jobs in self._pending.items()},
+            'completed': self.completed, 'failed': self.failed, 'cancelled': self.cancelled,
+            'avg_queue_wait': self.total_wait / dispatched if dispatched else 0.0, 'max_queue_wait': self.max_wait,
+            'avg_extract_time': self.total_extract / dispatched if dispatched else 0.0, 'max_extract_time': self.max_extract,
+        }
@@ -0,0 +1,53 @@
+# utils/idle_timers.py
+
+import asyncio
+import logging
+
+
+class IdleTimers:
+    """Per-guild deadlines kept on the event loop's own timer heap.
+
+    Each (guild_id, kind) has at most one armed deadline; re-arming replaces it and
+    cancelling is O(1). Nothing runs between deadlines, so cost scales with armed
+    timers rather than with the number of guilds.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback # async callback(guild_id, kind)
+        self._handles = {} # (guild_id, kind) -> asyncio.TimerHandle
+        self._tasks = set() # Callbacks that are currently running
+        self.fired = 0
+
+    def arm(self, guild_id, kind, delay):
+        """(Re)starts the `kind` deadline for a guild, `delay` seconds from now."""
+        self.cancel(guild_id, kind)
+        loop = asyncio.get_running_loop()
+        self._handles[(guild_id, kind)] = loop.call_at(loop.time() + delay, self._fire, guild_id, kind)
+
+    def arm_if_unset(self, guild_id, kind, delay):
+        if (guild_id, kind) not in self._handles: self.arm(guild_id, kind, delay)
+
+    def cancel(self, guild_id, kind):
+        handle = self._handles.pop((guild_id, kind), None)
+        if handle: handle.cancel()
+
+    def cancel_guild(self, guild_id):
+        for key in [key for key in self._handles if key[0] == guild_id]: self._handles.pop(key).cancel()
+
+    def _fire(self, guild_id, kind):
+        self._handles.pop((guild_id, kind), None); self.fired += 1
+        task = asyncio.ensure_future(self._run(guild_id, kind))
+        self._tasks.add(task); task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, guild_id, kind):
+        try: await self.callback(guild_id, kind)
+        except asyncio.CancelledError: raise
+        except Exception: logging.exception(f"Idle timer '{kind}' failed G{guild_id}")
+
+    def close(self):
+        for handle in self._handles.values(): handle.cancel()
+        for task in self._tasks: task.cancel()
+        self._handles.clear()
+
+    def __len__(self):
+        return len(self._handles)
@@ -0,0 +1,100 @@
+# utils/loop_monitor.py
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from utils import metrics
+
+# --- Constants ---
+LOOP_SAMPLE_INTERVAL = 0.5 # Seconds between lag samples
+LOOP_STALL_THRESHOLD = float(os.getenv('LOOP_STALL_THRESHOLD', '0.1')) # Seconds the loop may be blocked before its stack is captured
+MAX_STALLS = 25
+STACK_DEPTH = 30
+
+LOOP_LAG_SECONDS = metrics.histogram('event_loop_lag_seconds', "How late the event loop ran a timer scheduled by the lag sampler.", buckets=(0.001, 0.005) + metrics.FAST_BUCKETS)
+LOOP_STALLS = metrics.counter('event_loop_stalls_total', "Times the event loop was blocked longer than LOOP_STALL_THRESHOLD.")
+
+
+class Stall:
+    __slots__ = ('wall_time', 'duration', 'stack', 'ongoing')
+
+    def __init__(self, duration, stack):
+        self.wall_time = time.time()
+        self.duration = duration # Grows to the full stall length once the loop runs again
+        self.stack = stack
+        self.ongoing = True
+
+
+class LoopMonitor:
+    """Always-on event loop lag sampler with a stack-capturing watchdog.
+
+    A timer on the loop records how late it fires (the lag histogram) and refreshes a
+    heartbeat. A watchdog thread checks the heartbeat; if the loop has been blocked
+    longer than `threshold`, it captures the loop thread's current stack, which names
+    the callback that is hogging it. Costs one timer per interval plus a mostly
+    sleeping thread.
+    """
+
+    def __init__(self, *, interval=LOOP_SAMPLE_INTERVAL, threshold=LOOP_STALL_THRESHOLD, max_stalls=MAX_STALLS):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = deque(maxlen=max_stalls)
+        self.max_lag = 0.0
+        self._loop = None
+        self._loop_thread = None
+        self._handle = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._beat = 0.0 # Monotonic time of the last sample
+        self._expected = 0.0
+        self._stall = None # Stall being recorded by the watchdog
+
+    def start(self):
+        """Starts sampling the running loop; call from inside it."""
+        if self._handle is not None: return
+        self._loop = asyncio.get_running_loop(); self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic(); self._expected = self._beat + self.interval
+        self._handle = self._loop.call_later(self.interval, self._sample)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True); self._thread.start()
+
+    def stop(self):
+        if self._handle: self._handle.cancel(); self._handle = None
+        self._stopped.set()
+        if self._thread: self._thread.join(1); self._thread = None
+
+    # --- Loop side ---
+    def _sample(self):
+        now = time.monotonic(); lag = max(0.0, now - self._expected)
+        LOOP_LAG_SECONDS.observe(lag); self.max_lag = max(self.max_lag, lag)
+        self._beat = now; self._expected = now + self.interval
+        stall = self._stall
+        if stall is not None:
+            self._stall = None; stall.duration = lag; stall.ongoing = False
+            logging.warning(f"Event loop was blocked for {lag:.3f}s; stack when detected:\n{stall.stack}")
+        self._handle = self._loop.call_later(self.interval, self._sample)
+
+    # --- Watchdog thread ---
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            blocked = time.monotonic() - self._beat - self.interval
+            if blocked < self.threshold or self._stall is not None: continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None: continue
+            stall = Stall(blocked, ''.join(traceback.format_stack(frame, limit=STACK_DEPTH)))
+            del frame
+            self._stall = stall; self.stalls.append(stall); LOOP_STALLS.inc()
+
+    def recent_stalls(self, limit=None):
+        """Most recent stalls first."""
+        stalls = list(reversed(self.stalls))
+        return stalls if limit is None else stalls[:limit]
+
+    def stats(self):
+        return {'running': self._handle is not None, 'stalls': len(self.stalls), 'max_lag': self.max_lag, 'threshold': self.threshold}
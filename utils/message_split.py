@@ -0,0 +1,45 @@
+# utils/message_split.py
+
+import re
+
+# --- Constants ---
+MESSAGE_LIMIT = 2000 # Discord's per-message content limit
+FENCE_CLOSE = '\n```'
+FENCE_RE = re.compile(r'^```([^\s`]*)[^\n]*$', re.M)
+
+
+def open_fence(text):
+    """Returns the language of the code block left open at the end of `text` ('' if untagged), or None."""
+    language = None
+    for match in FENCE_RE.finditer(text): language = match.group(1) if language is None else None
+    return language
+
+
+def _break_point(text, budget):
+    """Where to cut `text` so the first part fits `budget`: a paragraph or code block boundary
+    if one is in the second half of the window, else a line break, a space, or a hard cut."""
+    window = text[:budget]; language = None; boundaries = [window.rfind('\n\n')]
+    for match in FENCE_RE.finditer(window):
+        if language is None: language = match.group(1); boundaries.append(match.start()) # Before a block opens
+        else: language = None; boundaries.append(match.end()) # After it closes
+    for cut in (max(boundaries), window.rfind('\n'), window.rfind(' ') + 1):
+        if cut >= budget // 2: return cut
+    return budget
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """Splits `text` into messages of at most `limit` characters.
+
+    Cuts prefer paragraph and code block boundaries; a code block that has to be cut is
+    closed at the end of one message and reopened (same language) at the start of the next.
+    """
+    chunks = []; prefix = ''
+    while len(prefix) + len(text) > limit:
+        cut = _break_point(text, limit - len(prefix) - len(FENCE_CLOSE))
+        chunk = prefix + text[:cut].rstrip('\n ')
+        language = open_fence(chunk)
+        if language is None: prefix = ''
+        else: chunk += FENCE_CLOSE; prefix = f'```{language}\n'
+        chunks.append(chunk); text = text[cut:].lstrip('\n')
+    if text.strip() or not chunks: chunks.append(prefix + text)
+    return chunks
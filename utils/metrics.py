@@ -0,0 +1,157 @@
+# utils/metrics.py
+
+import logging
+import math
+import os
+
+import discord
+
+# --- Constants ---
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0')) # 0 disables the endpoint; clusters use METRICS_PORT + cluster_id
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FAST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs: return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf: return '+Inf'
+    if value == -math.inf: return '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {} # label values tuple -> value
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames): raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        for key, value in self._values.items(): yield self.name, key, (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self.samples(): lines.append(f"{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels); self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A gauge that is either set directly or computed at scrape time by `collect`.
+
+    `collect` returns {label values tuple: value}; it replaces the stored values on every scrape.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.collect is not None:
+            try: self._values = {tuple(str(value) for value in key): value for key, value in self.collect().items()}
+            except Exception: logging.exception(f"Collecting {self.name} failed")
+        yield from super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels); state = self._values.get(key)
+        if state is None: state = self._values[key] = [[0] * len(self.buckets), 0.0, 0] # Per-bucket counts, sum, count
+        for i, bound in enumerate(self.buckets):
+            if value <= bound: state[0][i] += 1; break
+        state[1] += value; state[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", key, (('le', _format_value(bound)),), cumulative
+            yield f"{self.name}_sum", key, (), total
+            yield f"{self.name}_count", key, (), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        # Extensions can be reloaded (and so re-register); they get the existing metric back
+        metric = self._metrics.get(name)
+        if metric is None: metric = self._metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls): raise ValueError(f"Metric {name} already registered as {metric.kind}")
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), collect=None):
+        gauge = self._get_or_create(Gauge, name, documentation, labelnames)
+        if collect is not None: gauge.collect = collect
+        return gauge
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+# --- Shared Interaction Metrics ---
+INTERACTION_ACK_SECONDS = histogram('discord_interaction_ack_seconds', "Time from interaction creation to its first response (ack or defer).", ('source',), buckets=FAST_BUCKETS + (3,))
+
+
+def observe_ack(interaction, source):
+    """Records how long an interaction waited for its ack; call right after responding/deferring."""
+    INTERACTION_ACK_SECONDS.observe(max(0.0, (discord.utils.utcnow() - interaction.created_at).total_seconds()), source=source)
+
+
+# --- HTTP Endpoint ---
+async def start_server(port=METRICS_PORT, host=METRICS_HOST, registry=REGISTRY):
+    """Serves `registry` at http://host:port/metrics; returns the aiohttp runner (call .cleanup() to stop)."""
+    from aiohttp import web
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8', headers={'X-Content-Type-Options': 'nosniff'})
+    app = web.Application(); app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None); await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
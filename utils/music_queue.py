@@ -0,0 +1,310 @@
+# utils/music_queue.py
+
+import os
+import random
+import sys
+
+# --- Constants ---
+MAX_QUEUE_LENGTH = int(os.getenv('MAX_QUEUE_LENGTH', '10000'))
+MAX_QUEUE_BYTES = int(os.getenv('MAX_QUEUE_BYTES', str(8 * 1024**2))) # Approximate, per guild
+QUEUE_PAGE_SIZE = 10
+MIN_ORDER_GAP = 1e-9 # Order keys closer than this get renumbered
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class QueueEntry:
+    """One queued track. Holds the requester's ID rather than the Member object."""
+    __slots__ = ('query', 'requester_id', 'guild_id', 'meta', 'data', 'expires_at', 'pending', 'lookahead_failed', 'dropped', 'size', 'counted_duration', 'queued_in', 'order_key', 'start_at', 'requested_at')
+
+    def __init__(self, query, requester_id, guild_id, meta=None):
+        self.query = query
+        self.requester_id = requester_id
+        self.guild_id = guild_id
+        self.meta = meta # Flat lookup (title/ID/duration), if any
+        self.data = None # Full info with stream URL, filled by look-ahead/resolution
+        self.expires_at = 0
+        self.pending = None # In-flight resolution task
+        self.lookahead_failed = False
+        self.dropped = False
+        self.size = estimate_size(self)
+        self.counted_duration = 0 # Duration included in the owning queue's running total
+        self.queued_in = None # (queue, epoch) while the entry sits in a TrackQueue
+        self.order_key = None # Sort key that survives restarts, see TrackQueue.listener
+        self.start_at = 0 # Seconds into the track to start at (resumed tracks)
+        self.requested_at = None # Monotonic time of the /play that should start this entry right away
+
+    @property
+    def duration(self):
+        info = self.data or self.meta
+        return (info.get('duration') or 0) if info else 0
+
+
+def estimate_size(entry):
+    """Rough bytes held by an entry (the object, its query and the flat metadata)."""
+    size = sys.getsizeof(entry) + sys.getsizeof(entry.query)
+    if entry.meta:
+        size += sys.getsizeof(entry.meta) + sum(sys.getsizeof(v) for v in entry.meta.values())
+    return size
+
+
+# --- Implicit treap: a balanced tree ordered by position, augmented with subtree sizes ---
+class _Node:
+    __slots__ = ('entry', 'priority', 'size', 'left', 'right')
+
+    def __init__(self, entry, priority=None):
+        self.entry = entry
+        self.priority = random.random() if priority is None else priority
+        self.size = 1
+        self.left = None
+        self.right = None
+
+
+def _size(node):
+    return node.size if node else 0
+
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _merge(a, b):
+    if not a or not b: return a or b
+    if a.priority > b.priority:
+        a.right = _merge(a.right, b); _update(a); return a
+    b.left = _merge(a, b.left); _update(b); return b
+
+
+def _split(node, k):
+    """Splits into (first k entries, the rest)."""
+    if not node: return None, None
+    if _size(node.left) >= k:
+        left, node.left = _split(node.left, k); _update(node); return left, node
+    node.right, right = _split(node.right, k - _size(node.left) - 1); _update(node); return node, right
+
+
+def _build(entries):
+    """Builds a balanced treap from a list in O(n log n); parents get the higher priorities."""
+    if not entries: return None
+    priorities = sorted((random.random() for _ in entries), reverse=True)
+    nodes = [None] * len(entries); order = [] # Node indexes in BFS order of the balanced shape
+    stack = [(0, len(entries))]; head = 0
+    while head < len(stack):
+        lo, hi = stack[head]; head += 1
+        mid = (lo + hi) // 2; order.append((lo, mid, hi))
+        if lo < mid: stack.append((lo, mid))
+        if mid + 1 < hi: stack.append((mid + 1, hi))
+    for (lo, mid, hi), priority in zip(order, priorities): nodes[mid] = _Node(entries[mid], priority)
+    for lo, mid, hi in reversed(order): # Children before parents
+        node = nodes[mid]
+        if lo < mid: node.left = nodes[(lo + mid) // 2]
+        if mid + 1 < hi: node.right = nodes[(mid + 1 + hi) // 2]
+        _update(node)
+    return nodes[len(entries) // 2]
+
+
+class TrackQueue:
+    """Per-guild track queue with O(log n) indexed access, insert, remove-at and move.
+
+    Iteration and `slice()` walk the tree in order without copying the queue, so
+    rendering a page of a 10k-entry queue costs O(log n + page). The total queued
+    duration is kept as a running sum, and rendered pages are cached until a mutation
+    touches their index range.
+
+    Every entry carries a float `order_key` that sorts like its position, so `listener`
+    (if set) can persist each mutation as single-row changes: listener(op, entries) with
+    op 'insert', 'remove', 'clear' or 'reset' (all keys were reassigned).
+    """
+
+    def __init__(self, entries=(), *, max_length=MAX_QUEUE_LENGTH, max_bytes=MAX_QUEUE_BYTES):
+        self.max_length = max_length
+        self.max_bytes = max_bytes
+        self.memory_bytes = 0
+        self.total_duration = 0
+        self.unknown_durations = 0 # Entries whose length isn't known yet
+        self._epoch = 0 # Bumped by clear(), which detaches entries without visiting them
+        self._pages = {} # page -> rendered text
+        self.listener = None
+        entries = list(entries)
+        for entry in entries: self._attach(entry)
+        if any(entry.order_key is None for entry in entries):
+            for i, entry in enumerate(entries): entry.order_key = float(i)
+        self._root = _build(entries)
+
+    def __len__(self):
+        return _size(self._root)
+
+    def __bool__(self):
+        return self._root is not None
+
+    def __iter__(self):
+        return self.slice(0, len(self))
+
+    def __getitem__(self, index):
+        node = self._root; index = self._check_index(index)
+        while True:
+            left = _size(node.left)
+            if index < left: node = node.left
+            elif index == left: return node.entry
+            else: index -= left + 1; node = node.right
+
+    def _check_index(self, index):
+        length = len(self)
+        if index < 0: index += length
+        if not 0 <= index < length: raise IndexError('queue index out of range')
+        return index
+
+    def slice(self, start, stop):
+        """Yields entries [start, stop) in order."""
+        stop = min(stop, len(self)); remaining = stop - start
+        if remaining <= 0: return
+        node = self._root; stack = []
+        while node: # Descend to `start`, remembering the nodes still to visit
+            left = _size(node.left)
+            if start < left: stack.append(node); node = node.left
+            elif start == left: stack.append(node); node = None
+            else: start -= left + 1; node = node.right
+        while stack and remaining:
+            node = stack.pop(); yield node.entry; remaining -= 1
+            node = node.right
+            while node: stack.append(node); node = node.left
+
+    # --- Running Totals ---
+    def _attach(self, entry):
+        entry.queued_in = (self, self._epoch); entry.counted_duration = entry.duration
+        self.memory_bytes += entry.size; self.total_duration += entry.counted_duration
+        if not entry.counted_duration: self.unknown_durations += 1
+
+    def _detach(self, entry):
+        entry.queued_in = None
+        self.memory_bytes -= entry.size; self.total_duration -= entry.counted_duration
+        if not entry.counted_duration: self.unknown_durations -= 1
+
+    def recount(self, entry):
+        """Picks up an entry's duration after it was resolved; no-op if it is no longer queued here."""
+        if entry.queued_in != (self, self._epoch) or entry.duration == entry.counted_duration: return
+        if not entry.counted_duration: self.unknown_durations -= 1
+        self.total_duration += entry.duration - entry.counted_duration; entry.counted_duration = entry.duration
+        if not entry.counted_duration: self.unknown_durations += 1
+
+    # --- Rendered Pages ---
+    def page_count(self, page_size=QUEUE_PAGE_SIZE):
+        return max(1, -(-len(self) // page_size))
+
+    def render_page(self, page, render, page_size=QUEUE_PAGE_SIZE):
+        """Returns the text of one page, built by `render(index, entry)` per line and cached."""
+        text = self._pages.get(page)
+        if text is None:
+            start = page * page_size
+            text = self._pages[page] = "\n".join(render(start + i, entry) for i, entry in enumerate(self.slice(start, start + page_size)))
+        return text
+
+    def invalidate(self, start=0, stop=None, page_size=QUEUE_PAGE_SIZE):
+        """Drops cached pages overlapping indexes [start, stop); stop=None means to the end."""
+        if not self._pages: return
+        first = start // page_size; last = None if stop is None else (stop - 1) // page_size
+        for page in [page for page in self._pages if page >= first and (last is None or page <= last)]: del self._pages[page]
+
+    # --- Order Keys ---
+    def _key_for(self, index):
+        """Order key for an entry about to be inserted at `index`, or None if the gap is exhausted."""
+        before = self[index - 1].order_key if index > 0 else None
+        after = self[index].order_key if index < len(self) else None
+        if before is None and after is None: return 0.0
+        if before is None: return after - 1.0
+        if after is None: return before + 1.0
+        return (before + after) / 2 if after - before > MIN_ORDER_GAP else None
+
+    def _renumber(self):
+        for i, entry in enumerate(self): entry.order_key = float(i)
+        self._notify('reset', list(self))
+
+    def _notify(self, op, entries):
+        if self.listener is not None: self.listener(op, entries)
+
+    # --- Mutations ---
+    def can_add(self, entry=None, count=1):
+        if len(self) + count > self.max_length: return False
+        return entry is None or self.memory_bytes + entry.size <= self.max_bytes
+
+    def insert(self, index, entry):
+        if not self.can_add(entry): raise QueueFullError(f"Queue is full ({len(self)} tracks).")
+        index = max(0, min(index, len(self)))
+        entry.order_key = self._key_for(index)
+        left, right = _split(self._root, index)
+        self._root = _merge(_merge(left, _Node(entry)), right)
+        self._attach(entry); self.invalidate(index)
+        if entry.order_key is None: self._renumber()
+        else: self._notify('insert', (entry,))
+
+    def append(self, entry):
+        self.insert(len(self), entry)
+
+    def extend(self, entries):
+        """Appends as many entries as fit; returns how many were added."""
+        added = 0
+        for entry in entries:
+            if not self.can_add(entry): break
+            self.append(entry); added += 1
+        return added
+
+    def pop(self, index=-1):
+        index = self._check_index(index)
+        left, rest = _split(self._root, index)
+        node, right = _split(rest, 1)
+        self._root = _merge(left, right)
+        self._detach(node.entry); self.invalidate(index)
+        self._notify('remove', (node.entry,))
+        return node.entry
+
+    def popleft(self):
+        return self.pop(0)
+
+    def drop_front(self, count):
+        """Removes and returns the first `count` entries (used by skip-to)."""
+        removed, self._root = _split(self._root, count)
+        entries = list(TrackQueue._iter_nodes(removed))
+        for entry in entries: self._detach(entry)
+        if entries: self.invalidate(0); self._notify('remove', entries)
+        return entries
+
+    @staticmethod
+    def _iter_nodes(node):
+        stack = []
+        while stack or node:
+            while node: stack.append(node); node = node.left
+            node = stack.pop(); yield node.entry; node = node.right
+
+    def move(self, src, dst):
+        """Moves the entry at `src` so it ends up at index `dst`."""
+        src = self._check_index(src); dst = max(0, min(dst, len(self) - 1))
+        left, rest = _split(self._root, src)
+        node, right = _split(rest, 1)
+        self._root = _merge(left, right)
+        self._notify('remove', (node.entry,)); node.entry.order_key = self._key_for(dst)
+        left, right = _split(self._root, dst)
+        self._root = _merge(_merge(left, node), right)
+        self.invalidate(min(src, dst), max(src, dst) + 1)
+        if node.entry.order_key is None: self._renumber()
+        else: self._notify('insert', (node.entry,))
+        return node.entry
+
+    def shuffle(self):
+        entries = list(self); random.shuffle(entries)
+        self._root = _build(entries); self._pages.clear()
+        self._renumber()
+
+    def clear(self):
+        self._root = None; self._epoch += 1; self._pages.clear()
+        self.memory_bytes = 0; self.total_duration = 0; self.unknown_durations = 0
+        self._notify('clear', ())
+
+    def restore(self, entries):
+        """Replaces the contents with persisted entries, keeping their order keys; the listener isn't told."""
+        self._root = None; self._epoch += 1; self._pages.clear()
+        self.memory_bytes = 0; self.total_duration = 0; self.unknown_durations = 0
+        entries = list(entries)
+        for entry in entries: self._attach(entry)
+        self._root = _build(entries)
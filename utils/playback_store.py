@@ -0,0 +1,151 @@
+# utils/playback_store.py
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Constants ---
+PLAYBACK_DB_FILE = os.getenv('PLAYBACK_DB_FILE', 'downloads/playback_state.db')
+PLAYBACK_RESUME = os.getenv('PLAYBACK_RESUME', '1') == '1'
+PLAYBACK_FLUSH_INTERVAL = 0.5 # Seconds writes are batched for before one transaction commits them
+PLAYBACK_STATE_MAX_AGE = 24 * 3600 # Seconds; older guild state is not resumed
+GUILD_FIELDS = ('voice_channel_id', 'text_channel_id', 'effect', 'track', 'position')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS guild_state (
+    guild_id INTEGER PRIMARY KEY, voice_channel_id INTEGER, text_channel_id INTEGER, effect TEXT,
+    track TEXT, position REAL NOT NULL DEFAULT 0, updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS queue_entries (
+    guild_id INTEGER NOT NULL, order_key REAL NOT NULL, query TEXT NOT NULL, requester_id INTEGER, meta TEXT,
+    PRIMARY KEY (guild_id, order_key)
+) WITHOUT ROWID;
+"""
+
+
+class PlaybackStore:
+    """Crash-safe playback state in SQLite (WAL), written incrementally.
+
+    Callers record single-row changes (a queue insert/remove, an effect, the current track,
+    its position); they are batched for PLAYBACK_FLUSH_INTERVAL and committed in one
+    transaction on a dedicated writer thread, so the event loop never waits on disk.
+    Several cluster processes can share the file.
+    """
+
+    def __init__(self, path=PLAYBACK_DB_FILE, enabled=PLAYBACK_RESUME):
+        self.path = path
+        self.enabled = enabled
+        self._conn = None
+        self._ops = [] # (sql, params) in submission order
+        self._positions = {} # guild_id -> index in _ops of its pending position update
+        self._executor = None
+        self._flusher = None
+        self.writes = 0
+        self.flushes = 0
+
+    def open(self):
+        """Opens (creating if needed) the database. Blocking; call from setup."""
+        if not self.enabled: return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL'); self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('PRAGMA busy_timeout=5000') # Other clusters may hold the write lock briefly
+            self._conn.executescript(SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"Could not open playback state DB, resume disabled: {e}"); self.enabled = False; return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='playback-store')
+
+    # --- Recording (event loop side) ---
+    def _submit(self, sql, params):
+        if self._conn is None: return # Disabled, or already closed
+        self._ops.append((sql, params))
+        if self._flusher is None or self._flusher.done(): self._flusher = asyncio.ensure_future(self._flush_later())
+
+    def update_guild(self, guild_id, **fields):
+        """Upserts some of a guild's state columns (see GUILD_FIELDS); 'track' takes a dict or None."""
+        if 'track' in fields and fields['track'] is not None: fields['track'] = json.dumps(fields['track'])
+        columns = [column for column in GUILD_FIELDS if column in fields]
+        sql = (f"INSERT INTO guild_state (guild_id, {', '.join(columns)}, updated_at) VALUES (?, {', '.join('?' * len(columns))}, ?) "
+               f"ON CONFLICT(guild_id) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in columns)}, updated_at = excluded.updated_at")
+        self._submit(sql, (guild_id, *(fields[column] for column in columns), time.time()))
+
+    def save_position(self, guild_id, position):
+        """Records the playing track's position; repeated calls before a flush collapse into one write."""
+        params = (position, time.time(), guild_id)
+        index = self._positions.get(guild_id)
+        if index is not None and index < len(self._ops): self._ops[index] = (self._ops[index][0], params); return
+        self._positions[guild_id] = len(self._ops)
+        self._submit("UPDATE guild_state SET position = ?, updated_at = ? WHERE guild_id = ?", params)
+
+    def queue_changed(self, guild_id, op, entries):
+        """TrackQueue listener: mirrors one queue mutation as row inserts/deletes."""
+        if op in ('clear', 'reset'): self._submit("DELETE FROM queue_entries WHERE guild_id = ?", (guild_id,))
+        if op in ('insert', 'reset'):
+            for entry in entries:
+                self._submit("INSERT OR REPLACE INTO queue_entries (guild_id, order_key, query, requester_id, meta) VALUES (?, ?, ?, ?, ?)",
+                             (guild_id, entry.order_key, entry.query, entry.requester_id, json.dumps(entry.meta) if entry.meta else None))
+        elif op == 'remove':
+            for entry in entries: self._submit("DELETE FROM queue_entries WHERE guild_id = ? AND order_key = ?", (guild_id, entry.order_key))
+
+    def forget_guild(self, guild_id):
+        """Drops everything stored for a guild (it left voice on purpose)."""
+        self._submit("DELETE FROM queue_entries WHERE guild_id = ?", (guild_id,))
+        self._submit("DELETE FROM guild_state WHERE guild_id = ?", (guild_id,))
+
+    async def _flush_later(self):
+        await asyncio.sleep(PLAYBACK_FLUSH_INTERVAL)
+        ops = self._take_ops()
+        if ops: await asyncio.get_running_loop().run_in_executor(self._executor, self._write, ops)
+
+    def _take_ops(self):
+        ops = self._ops; self._ops = []; self._positions.clear()
+        return ops
+
+    # --- Writer thread ---
+    def _write(self, ops):
+        try:
+            self._conn.execute('BEGIN IMMEDIATE')
+            for sql, params in ops: self._conn.execute(sql, params)
+            self._conn.execute('COMMIT')
+            self.writes += len(ops); self.flushes += 1
+        except sqlite3.Error as e:
+            logging.error(f"Playback state write failed ({len(ops)} change(s) lost): {e}")
+            try: self._conn.execute('ROLLBACK')
+            except sqlite3.Error: pass
+
+    # --- Loading & Shutdown (blocking) ---
+    def load(self, max_age=PLAYBACK_STATE_MAX_AGE):
+        """Returns {guild_id: state} for recently active guilds, each with its queue rows in order.
+
+        Rows older than `max_age` are deleted. Blocking; run in a thread.
+        """
+        if not self.enabled: return {}
+        conn = self._conn; cutoff = time.time() - max_age
+        with conn:
+            conn.execute("DELETE FROM guild_state WHERE updated_at < ?", (cutoff,))
+            conn.execute("DELETE FROM queue_entries WHERE guild_id NOT IN (SELECT guild_id FROM guild_state)")
+        states = {}
+        for row in conn.execute(f"SELECT guild_id, {', '.join(GUILD_FIELDS)} FROM guild_state"):
+            state = dict(zip(('guild_id', *GUILD_FIELDS), row))
+            state['track'] = json.loads(state['track']) if state['track'] else None; state['entries'] = []
+            states[state['guild_id']] = state
+        for guild_id, order_key, query, requester_id, meta in conn.execute("SELECT guild_id, order_key, query, requester_id, meta FROM queue_entries ORDER BY guild_id, order_key"):
+            if guild_id in states: states[guild_id]['entries'].append((order_key, query, requester_id, json.loads(meta) if meta else None))
+        return states
+
+    def close(self):
+        """Commits whatever is still pending and closes the database."""
+        if not self.enabled or self._conn is None: return
+        if self._flusher: self._flusher.cancel()
+        ops = self._take_ops()
+        if ops: self._executor.submit(self._write, ops).result()
+        self._executor.shutdown(wait=True)
+        self._conn.close(); self._conn = None
+
+    def stats(self):
+        return {'enabled': self.enabled, 'pending': len(self._ops), 'writes': self.writes, 'flushes': self.flushes}
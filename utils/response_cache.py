@@ -0,0 +1,127 @@
+# utils/response_cache.py
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from utils import metrics
+
+# --- Constants ---
+ASK_CACHE_TTL = float(os.getenv('ASK_CACHE_TTL', '600')) # Seconds an answer is reused for
+ASK_CACHE_MAX_ENTRIES = int(os.getenv('ASK_CACHE_MAX_ENTRIES', '500'))
+ASK_CACHE_OPT_OUT_FILE = os.getenv('ASK_CACHE_OPT_OUT_FILE', 'downloads/ask_cache_opt_out.json')
+
+# hit = answered from the cache, coalesced = waited for an identical in-flight request,
+# miss = made the upstream call, bypass = guild opted out
+ASK_CACHE_LOOKUPS = metrics.counter('ai_cache_lookups_total', "/ask response cache lookups, by result.", ('result',))
+
+
+def prompt_key(prompt):
+    """Normalizes a prompt so case, spacing and trailing punctuation don't split cache entries."""
+    return ' '.join(prompt.casefold().split()).rstrip('?!.… ')
+
+
+class CachedResponse:
+    __slots__ = ('text', 'outcome', 'stored_at')
+
+    def __init__(self, text, outcome, stored_at):
+        self.text = text
+        self.outcome = outcome # 'ok', or e.g. 'blocked': a refusal is as reusable as an answer
+        self.stored_at = stored_at
+
+
+class ResponseCache:
+    """TTL + LRU cache of AI answers by normalized prompt, with in-flight request coalescing.
+
+    A prompt that is already being generated is not sent upstream again: later callers
+    await the same task. The task is shielded, so one caller giving up doesn't cancel the
+    answer for the others. Only answers `generate` marks as cacheable are stored.
+    """
+
+    def __init__(self, *, ttl=ASK_CACHE_TTL, max_entries=ASK_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> CachedResponse, oldest first
+        self._inflight = {} # key -> asyncio.Task
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None: return None
+        if time.monotonic() - entry.stored_at > self.ttl: del self._entries[key]; return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, text, outcome='ok'):
+        self._entries[key] = CachedResponse(text, outcome, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False); self.evictions += 1
+
+    async def get_or_generate(self, key, generate):
+        """Returns (text, outcome, result): a cached answer, a shared in-flight one, or a fresh one.
+
+        `generate()` must return (text, outcome, cacheable); `result` is 'hit', 'coalesced' or 'miss'.
+        Exceptions from `generate` reach every caller waiting on it.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            self.hits += 1; ASK_CACHE_LOOKUPS.inc(result='hit')
+            return entry.text, entry.outcome, 'hit'
+        task = self._inflight.get(key)
+        if task is not None: self.coalesced += 1; result = 'coalesced'
+        else:
+            self.misses += 1; result = 'miss'
+            task = self._inflight[key] = asyncio.ensure_future(self._fill(key, generate))
+        ASK_CACHE_LOOKUPS.inc(result=result)
+        text, outcome = await asyncio.shield(task)
+        return text, outcome, result
+
+    async def _fill(self, key, generate):
+        try:
+            text, outcome, cacheable = await generate()
+            if cacheable: self.put(key, text, outcome)
+            return text, outcome
+        finally: self._inflight.pop(key, None)
+
+    def bypass(self):
+        """Counts a lookup skipped because the guild opted out."""
+        self.bypassed += 1; ASK_CACHE_LOOKUPS.inc(result='bypass')
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            'entries': len(self._entries), 'inflight': len(self._inflight), 'hits': self.hits, 'coalesced': self.coalesced,
+            'misses': self.misses, 'bypassed': self.bypassed, 'evictions': self.evictions,
+            'hit_ratio': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+# --- Per-Guild Opt-Out (blocking; run in a thread) ---
+def load_opt_outs(path=ASK_CACHE_OPT_OUT_FILE):
+    try:
+        with open(path, encoding='utf-8') as f: return {int(guild_id) for guild_id in json.load(f)}
+    except FileNotFoundError: return set()
+    except (OSError, ValueError, TypeError) as e: logging.error(f"Failed to load {path}: {e}"); return set()
+
+
+def save_opt_outs(guild_ids, path=ASK_CACHE_OPT_OUT_FILE):
+    tmp_path = f'{path}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(sorted(guild_ids), f)
+        os.replace(tmp_path, path)
+    except OSError as e: logging.error(f"Failed to save {path}: {e}")
@@ -0,0 +1,140 @@
+# utils/role_store.py
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Constants ---
+ROLE_DB_FILE = os.getenv('ROLE_DB_FILE', 'role_config.db')
+LEGACY_ROLE_CONFIG_FILE = 'role_config.json' # Imported once into an empty database
+ROLE_SYNC_INTERVAL = 5 # Seconds between checks for changes made by other processes
+CHANGE_LOG_MAX_AGE = 24 * 3600 # Seconds change log rows are kept for lagging processes
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS role_buttons (
+    guild_id INTEGER NOT NULL, role_id INTEGER NOT NULL, label TEXT NOT NULL, style TEXT NOT NULL, emoji TEXT,
+    PRIMARY KEY (guild_id, role_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS role_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, changed_at REAL NOT NULL
+);
+"""
+
+
+class RoleStore:
+    """Self-assignable role buttons in SQLite (WAL), shared by every cluster process.
+
+    Each /setup_role or /remove_role writes one row in its own transaction on a dedicated
+    thread, so the event loop never touches the disk and a crash can't leave a half-written
+    file. Writes also append to a change log; other processes notice new commits through
+    `PRAGMA data_version` and reload only the guilds that changed.
+    """
+
+    def __init__(self, path=ROLE_DB_FILE):
+        self.path = path
+        self._conn = None
+        self._executor = None
+        self._watcher = None
+        self._data_version = None
+        self._last_seq = 0
+        self.writes = 0
+
+    def _run(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    # --- Setup ---
+    async def open(self):
+        """Opens (creating and migrating if needed) the database; returns {guild_id: {role_id: config}}."""
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='role-store')
+        return await self._run(self._open)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL'); self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.executescript(SCHEMA)
+        self._conn.execute('BEGIN IMMEDIATE') # Only one process migrates
+        try:
+            if self._conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+                self._import_legacy(); self._conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self._conn.execute('DELETE FROM role_changes WHERE changed_at < ?', (time.time() - CHANGE_LOG_MAX_AGE,))
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK'); raise
+        self._last_seq = self._conn.execute('SELECT COALESCE(MAX(seq), 0) FROM role_changes').fetchone()[0]
+        self._data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        mappings = {}
+        for guild_id, role_id, label, style, emoji in self._conn.execute('SELECT guild_id, role_id, label, style, emoji FROM role_buttons'):
+            mappings.setdefault(guild_id, {})[role_id] = {'label': label, 'style': style, 'emoji': emoji}
+        logging.info(f"Role store opened: {sum(len(roles) for roles in mappings.values())} button(s) in {len(mappings)} guild(s).")
+        return mappings
+
+    def _import_legacy(self):
+        try:
+            with open(LEGACY_ROLE_CONFIG_FILE, encoding='utf-8') as f: legacy = json.load(f)
+        except FileNotFoundError: return
+        except (OSError, ValueError) as e: logging.error(f"Could not import {LEGACY_ROLE_CONFIG_FILE}: {e}"); return
+        rows = [(int(guild_id), int(role_id), config.get('label', f'Role {role_id}'), config.get('style', 'secondary'), config.get('emoji'))
+                for guild_id, roles in legacy.items() for role_id, config in roles.items()]
+        self._conn.executemany('INSERT OR IGNORE INTO role_buttons (guild_id, role_id, label, style, emoji) VALUES (?, ?, ?, ?, ?)', rows)
+        logging.info(f"Imported {len(rows)} role button(s) from {LEGACY_ROLE_CONFIG_FILE}.")
+
+    # --- Writes (one row + one change log entry, atomically) ---
+    async def set_button(self, guild_id, role_id, config):
+        await self._run(self._write, guild_id, 'INSERT OR REPLACE INTO role_buttons (guild_id, role_id, label, style, emoji) VALUES (?, ?, ?, ?, ?)',
+                        (guild_id, role_id, config['label'], config['style'], config.get('emoji')))
+
+    async def remove_button(self, guild_id, role_id):
+        await self._run(self._write, guild_id, 'DELETE FROM role_buttons WHERE guild_id = ? AND role_id = ?', (guild_id, role_id))
+
+    def _write(self, guild_id, sql, params):
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._conn.execute(sql, params)
+            self._conn.execute('INSERT INTO role_changes (guild_id, changed_at) VALUES (?, ?)', (guild_id, time.time()))
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK'); raise
+        self.writes += 1
+
+    # --- Change Notifications (from other processes) ---
+    def start_watching(self, on_change):
+        """Calls `on_change(guild_id, buttons)` on the loop whenever another process changed a guild."""
+        self._watcher = asyncio.ensure_future(self._watch(on_change))
+
+    async def _watch(self, on_change):
+        while True:
+            await asyncio.sleep(ROLE_SYNC_INTERVAL)
+            try: changed = await self._run(self._poll)
+            except sqlite3.Error as e: logging.warning(f"Role store sync failed: {e}"); continue
+            for guild_id, buttons in changed.items():
+                try: on_change(guild_id, buttons)
+                except Exception: logging.exception(f"Role change handler failed G{guild_id}")
+
+    def _poll(self):
+        data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version: return {} # Nothing committed by anyone else
+        self._data_version = data_version
+        rows = self._conn.execute('SELECT seq, guild_id FROM role_changes WHERE seq > ?', (self._last_seq,)).fetchall()
+        if not rows: return {}
+        self._last_seq = max(seq for seq, _ in rows)
+        changed = {}
+        for guild_id in {guild_id for _, guild_id in rows}: # Own writes show up too; reloading them is harmless
+            changed[guild_id] = {role_id: {'label': label, 'style': style, 'emoji': emoji} for role_id, label, style, emoji in
+                                 self._conn.execute('SELECT role_id, label, style, emoji FROM role_buttons WHERE guild_id = ?', (guild_id,))}
+        return changed
+
+    # --- Shutdown (blocking) ---
+    def close(self):
+        if self._watcher: self._watcher.cancel(); self._watcher = None
+        if self._executor is None: return
+        if self._conn is not None: self._executor.submit(self._conn.close).result()
+        self._executor.shutdown(wait=True); self._executor = None; self._conn = None
+
+    def stats(self):
+        return {'writes': self.writes, 'last_seq': self._last_seq}
@@ -0,0 +1,125 @@
+# utils/role_toggles.py
+
+import asyncio
+import logging
+
+from utils import metrics
+
+# --- Constants ---
+ROLE_BATCH_WINDOW = 1.0 # Seconds a member's clicks are collected before one member.edit applies them
+
+ROLE_MEMBER_EDITS = metrics.counter('role_member_edits_total', "member.edit calls made for batched role button clicks, by result.", ('result',))
+
+# Why a configured role can't be toggled right now (None = it can)
+MISSING, NOT_CONFIGURED, NO_PERMISSION, TOO_HIGH, MANAGED = 'missing', 'not_configured', 'no_permission', 'too_high', 'managed'
+
+
+class RoleEligibilityIndex:
+    """Per-guild cache of which configured button roles the bot can assign.
+
+    Built on first use from the guild's role mappings, the bot's permissions and its top
+    role; dropped whenever one of those changes (role/member update events, config edits).
+    """
+
+    def __init__(self, mappings_for):
+        self.mappings_for = mappings_for # guild_id -> {role_id: button config}
+        self._guilds = {} # guild_id -> {role_id: (role or None, problem or None)}
+        self.builds = 0
+
+    def check(self, guild, role_id):
+        """Returns (role, problem) for a button click; `problem` is None if the toggle may proceed."""
+        index = self._guilds.get(guild.id)
+        if index is None: index = self._guilds[guild.id] = self._build(guild)
+        return index.get(role_id, (None, NOT_CONFIGURED))
+
+    def _build(self, guild):
+        self.builds += 1
+        me = guild.me; can_manage = me.guild_permissions.manage_roles; index = {}
+        for role_id in self.mappings_for(guild.id):
+            role = guild.get_role(role_id)
+            if role is None: index[role_id] = (None, MISSING)
+            elif not can_manage: index[role_id] = (role, NO_PERMISSION)
+            elif me.top_role <= role: index[role_id] = (role, TOO_HIGH)
+            elif role.managed or role.is_default(): index[role_id] = (role, MANAGED)
+            else: index[role_id] = (role, None)
+        return index
+
+    def invalidate(self, guild_id):
+        self._guilds.pop(guild_id, None)
+
+    def clear(self):
+        self._guilds.clear()
+
+
+class PendingEdit:
+    __slots__ = ('member', 'desired', 'waiters', 'task')
+
+    def __init__(self, member):
+        self.member = member
+        self.desired = {} # role_id -> (role, should have it)
+        self.waiters = []
+        self.task = None
+
+
+class RoleToggleBatcher:
+    """Coalesces one member's rapid role toggles into a single member.edit(roles=...).
+
+    Each click is resolved against the state the member's earlier (still pending) clicks
+    produce, so its own reply can say 'added' or 'removed' right away; the REST call
+    happens once, ROLE_BATCH_WINDOW after the first click of a burst.
+    """
+
+    def __init__(self, *, window=ROLE_BATCH_WINDOW):
+        self.window = window
+        self._pending = {} # (guild_id, member_id) -> PendingEdit
+        self.clicks = 0
+        self.edits = 0
+
+    async def toggle(self, member, role):
+        """Toggles `role` for `member`; returns 'added' or 'removed' once the batched edit went through.
+
+        Raises whatever member.edit raised (discord.Forbidden, discord.HTTPException).
+        """
+        key = (member.guild.id, member.id); pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = PendingEdit(member)
+            pending.task = asyncio.ensure_future(self._flush_later(key, pending))
+        pending.member = member; self.clicks += 1
+        _, has_role = pending.desired.get(role.id, (role, any(r.id == role.id for r in member.roles)))
+        pending.desired[role.id] = (role, not has_role)
+        waiter = asyncio.get_running_loop().create_future(); pending.waiters.append(waiter)
+        await waiter
+        return 'removed' if has_role else 'added'
+
+    async def _flush_later(self, key, pending):
+        await asyncio.sleep(self.window)
+        if self._pending.get(key) is pending: del self._pending[key] # Later clicks start a new batch
+        try: await self._apply(pending)
+        except Exception as e:
+            for waiter in pending.waiters:
+                if not waiter.done(): waiter.set_exception(e)
+        else:
+            for waiter in pending.waiters:
+                if not waiter.done(): waiter.set_result(None)
+
+    async def _apply(self, pending):
+        member = pending.member.guild.get_member(pending.member.id) or pending.member # Freshest cached roles
+        current = {role.id: role for role in member.roles if not role.is_default()}
+        roles = dict(current)
+        for role_id, (role, wanted) in pending.desired.items():
+            if wanted: roles[role_id] = role
+            else: roles.pop(role_id, None)
+        if roles.keys() == current.keys(): return # Clicks cancelled each other out
+        try: await member.edit(roles=list(roles.values()), reason=f"Self-service role buttons ({len(pending.waiters)} click(s))")
+        except Exception: ROLE_MEMBER_EDITS.inc(result='error'); raise
+        self.edits += 1; ROLE_MEMBER_EDITS.inc(result='ok')
+        logging.info(f"Applied {len(pending.desired)} role change(s) in one edit for {member.id} G{member.guild.id}")
+
+    def close(self):
+        for pending in self._pending.values():
+            pending.task.cancel()
+            for waiter in pending.waiters: waiter.cancel()
+        self._pending.clear()
+
+    def stats(self):
+        return {'clicks': self.clicks, 'edits': self.edits, 'pending': len(self._pending)}
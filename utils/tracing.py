@@ -0,0 +1,98 @@
+# utils/tracing.py
+
+import logging
+import os
+import time
+from collections import deque
+
+from utils import metrics
+
+# --- Constants ---
+SPAN_SLOW_THRESHOLD = float(os.getenv('SPAN_SLOW_THRESHOLD', '0.25')) # Seconds; a trace with a span this slow is kept
+TRACE_SLOW_THRESHOLD = float(os.getenv('TRACE_SLOW_THRESHOLD', '2.0')) # Seconds; a trace this slow overall is kept
+MAX_SLOW_TRACES = 50
+
+SPAN_SECONDS = metrics.histogram('music_span_seconds', "Duration of traced pipeline stages.", ('trace', 'span'), buckets=metrics.FAST_BUCKETS + (5, 10, 30))
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'started', 'offset', 'duration', 'error')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.offset = self.duration = 0.0
+        self.error = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        self.trace._add(self, self.started, duration, exc_type.__name__ if exc_type else None)
+        return False
+
+
+class Trace:
+    """Timings of one pass through a pipeline (e.g. starting a track), split into named spans.
+
+    Spans may be added after `finish()` (work the pass scheduled, like a message send);
+    they still count towards deciding whether the trace is slow.
+    """
+    __slots__ = ('tracer', 'name', 'guild_id', 'wall_time', 'started', 'duration', 'spans', 'kept')
+
+    def __init__(self, tracer, name, guild_id=None):
+        self.tracer = tracer
+        self.name = name
+        self.guild_id = guild_id
+        self.wall_time = time.time()
+        self.started = time.perf_counter()
+        self.duration = None # Set by finish()
+        self.spans = []
+        self.kept = False
+
+    def span(self, name):
+        """Context manager timing one stage; usable around awaits."""
+        return Span(self, name)
+
+    def _add(self, span, started, duration, error):
+        span.offset = started - self.started; span.duration = duration; span.error = error
+        self.spans.append(span)
+        SPAN_SECONDS.observe(duration, trace=self.name, span=span.name)
+        if self.duration is not None and duration >= SPAN_SLOW_THRESHOLD: self.tracer._keep(self)
+
+    def finish(self):
+        if self.duration is not None: return
+        self.duration = time.perf_counter() - self.started
+        if self.duration >= TRACE_SLOW_THRESHOLD or any(span.duration >= SPAN_SLOW_THRESHOLD for span in self.spans): self.tracer._keep(self)
+
+    def describe(self):
+        spans = ', '.join(f"{span.name} {span.duration:.3f}s @+{span.offset:.2f}s" + (f" ({span.error})" if span.error else '') for span in self.spans)
+        stamp = time.strftime('%H:%M:%S', time.localtime(self.wall_time))
+        return f"{stamp} {self.name} G{self.guild_id} {self.duration or 0:.3f}s: {spans or 'no spans'}"
+
+
+class Tracer:
+    """Creates traces and keeps the most recent slow ones for inspection."""
+
+    def __init__(self, max_slow=MAX_SLOW_TRACES):
+        self.slow = deque(maxlen=max_slow)
+        self.started = 0
+
+    def start(self, name, guild_id=None):
+        self.started += 1
+        return Trace(self, name, guild_id)
+
+    def _keep(self, trace):
+        if trace.kept: return
+        trace.kept = True; self.slow.append(trace)
+        logging.info(f"Slow trace: {trace.describe()}")
+
+    def recent_slow(self, limit=None):
+        """Most recent slow traces first."""
+        traces = list(reversed(self.slow))
+        return traces if limit is None else traces[:limit]
+
+
+tracer = Tracer()
@@ -0,0 +1,91 @@
+# utils/ui_scheduler.py
+
+import asyncio
+import logging
+import time
+
+import discord
+
+# --- Constants ---
+UI_DEBOUNCE = 0.35 # Seconds a slot waits for newer state before sending
+CHANNEL_BUCKET_SIZE = 5 # Discord allows ~5 message creates/edits per channel per 5 s
+CHANNEL_BUCKET_PERIOD = 5.0
+MAX_IDLE_BUCKETS = 512
+
+
+class ChannelBucket:
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self):
+        self.tokens = float(CHANNEL_BUCKET_SIZE)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(CHANNEL_BUCKET_SIZE, self.tokens + (now - self.updated_at) * CHANNEL_BUCKET_SIZE / CHANNEL_BUCKET_PERIOD)
+        self.updated_at = now
+
+    def delay(self):
+        """Seconds until a token is available (0 if one can be taken now)."""
+        self.refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) * CHANNEL_BUCKET_PERIOD / CHANNEL_BUCKET_SIZE
+
+
+class UIScheduler:
+    """Coalesces UI updates per (guild, slot) and paces them per channel.
+
+    `submit` only records the latest job for a slot; a flusher sends it after a short
+    debounce, so a burst of state changes (e.g. rapid skips) costs one REST call.
+    """
+
+    def __init__(self, *, debounce=UI_DEBOUNCE):
+        self.debounce = debounce
+        self._jobs = {} # (guild_id, slot) -> (channel_id, job coroutine function)
+        self._flushers = {} # (guild_id, slot) -> asyncio.Task
+        self._buckets = {} # channel_id -> ChannelBucket
+        self.submitted = 0
+        self.sent = 0
+
+    def submit(self, guild_id, slot, channel_id, job):
+        """Schedules `job()` for a slot, replacing any not-yet-sent job for the same slot."""
+        key = (guild_id, slot)
+        self._jobs[key] = (channel_id, job); self.submitted += 1
+        if key not in self._flushers:
+            self._flushers[key] = asyncio.ensure_future(self._flush(key))
+
+    async def _flush(self, key):
+        try:
+            while key in self._jobs:
+                await asyncio.sleep(self.debounce)
+                channel_id, _ = self._jobs[key]
+                await self._take_token(channel_id)
+                channel_id, job = self._jobs.pop(key) # Latest state as of now
+                try: await job(); self.sent += 1
+                except discord.HTTPException as e: logging.warning(f"UI update {key} failed: {e}")
+                except Exception: logging.exception(f"UI update {key} failed")
+        finally:
+            if self._flushers.get(key) is asyncio.current_task(): del self._flushers[key]
+
+    async def _take_token(self, channel_id):
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_IDLE_BUCKETS: self._prune_buckets()
+            bucket = self._buckets[channel_id] = ChannelBucket()
+        while (delay := bucket.delay()) > 0: await asyncio.sleep(delay)
+        bucket.tokens -= 1
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for channel_id, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= CHANNEL_BUCKET_SIZE: del self._buckets[channel_id]
+
+    def drop_guild(self, guild_id):
+        """Forgets every pending update for a guild (e.g. after it disconnected)."""
+        for key in [key for key in self._flushers if key[0] == guild_id]:
+            self._flushers.pop(key).cancel()
+        for key in [key for key in self._jobs if key[0] == guild_id]:
+            del self._jobs[key]
+
+    def close(self):
+        for task in self._flushers.values(): task.cancel()
+        self._flushers.clear(); self._jobs.clear()
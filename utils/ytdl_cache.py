@@ -0,0 +1,165 @@
+# utils/ytdl_cache.py
+
+import gzip
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs, urlencode
+
+# --- Constants ---
+YTDL_CACHE_FILE = 'downloads/ytdl_cache.json.gz'
+YTDL_CACHE_MAX_ENTRIES = 2000
+METADATA_MAX_AGE = 7 * 24 * 3600 # Seconds before a cached lookup is treated as a full miss
+DEFAULT_STREAM_URL_TTL = 3600 # Seconds, used when the stream URL carries no 'expire' param
+
+# Only these keys of a yt-dlp info dict are kept; 'formats' & co. are what make info dicts huge
+CACHED_INFO_KEYS = (
+    'id', 'title', 'url', 'webpage_url', 'duration', 'thumbnail', 'extractor', 'extractor_key',
+    'uploader', 'channel', 'uploader_url', 'channel_url', 'view_count', 'like_count', 'upload_date',
+    'ext', 'acodec', 'abr', 'asr',
+)
+TRACKING_PARAMS = {'si', 'feature', 'pp', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content'}
+YOUTUBE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+
+def stream_url_expiry(data, resolved_at):
+    """Returns the unix time at which the stream URL in `data` stops being playable."""
+    if not data.get('url'): return 0 # Flat (metadata-only) result, nothing to stream yet
+    try:
+        expire = parse_qs(urlparse(data.get('url', '')).query).get('expire')
+        if expire: return float(expire[0])
+    except (TypeError, ValueError): pass
+    return resolved_at + DEFAULT_STREAM_URL_TTL
+
+
+def trim_info(data):
+    """Copies the fields the bot actually uses out of a full yt-dlp info dict."""
+    info = {key: data[key] for key in CACHED_INFO_KEYS if data.get(key) is not None}
+    if not info.get('thumbnail') and data.get('thumbnails'):
+        thumbnails = sorted(data['thumbnails'], key=lambda t: (t.get('width') or 0) * (t.get('height') or 0), reverse=True)
+        if thumbnails and thumbnails[0].get('url'): info['thumbnail'] = thumbnails[0]['url']
+    if data.get('_type') == 'url':
+        # Flat result: 'url' is the page to resolve later, not a stream
+        info['webpage_url'] = data.get('webpage_url') or info.pop('url', None)
+        info.pop('url', None)
+        if data.get('ie_key'): info.setdefault('extractor_key', data['ie_key'])
+    return info
+
+
+def search_key(query):
+    return 'search:' + ' '.join(query.lower().split())
+
+
+def url_key(url):
+    """Normalizes a URL so share links, tracking params and host aliases hit the same entry."""
+    try: parsed = urlparse(url.strip())
+    except ValueError: return 'url:' + url.strip()
+    host = (parsed.hostname or '').lower().removeprefix('www.').removeprefix('m.')
+    video_id = None
+    if host == 'youtu.be': video_id = parsed.path.lstrip('/').split('/')[0]
+    elif host in ('youtube.com', 'music.youtube.com'):
+        if parsed.path == '/watch': video_id = (parse_qs(parsed.query).get('v') or [None])[0]
+        elif parsed.path.startswith(('/shorts/', '/live/', '/embed/')): video_id = parsed.path.split('/')[2]
+    if video_id and YOUTUBE_ID_RE.match(video_id): return f'youtube:{video_id}'
+    query = sorted((k, v) for k, vs in parse_qs(parsed.query).items() if k not in TRACKING_PARAMS for v in vs)
+    return f"url:{host}{parsed.path.rstrip('/')}" + (f'?{urlencode(query)}' if query else '')
+
+
+class CachedInfo:
+    __slots__ = ('info', 'expires_at', 'stored_at')
+
+    def __init__(self, info, expires_at, stored_at):
+        self.info = info
+        self.expires_at = expires_at # When the stream URL goes stale
+        self.stored_at = stored_at # When the metadata was first resolved
+
+    def stream_is_fresh(self, margin=0):
+        return time.time() < self.expires_at - margin
+
+
+class YTDLCache:
+    """LRU cache of trimmed yt-dlp info dicts, keyed by normalized search term or URL.
+
+    Metadata outlives the stream URL: a lookup whose URL has expired (or a flat,
+    metadata-only result that never had one) is still returned with `stream_is_fresh()`
+    False, so callers can re-resolve just the webpage URL instead of re-running the search.
+    """
+
+    def __init__(self, path=YTDL_CACHE_FILE, max_entries=YTDL_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._dirty = False
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, margin=0):
+        """Returns the CachedInfo for `key` (possibly with a stale stream URL), or None on a miss."""
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry.stored_at > METADATA_MAX_AGE:
+            if entry is not None: del self._entries[key]; self._dirty = True
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        if entry.stream_is_fresh(margin): self.hits += 1
+        else: self.stale_hits += 1
+        return entry
+
+    def put(self, key, info, *, resolved_at=None):
+        """Stores a trimmed info dict, keeping the original metadata timestamp on refreshes."""
+        resolved_at = resolved_at or time.time()
+        previous = self._entries.get(key)
+        stored_at = previous.stored_at if previous else resolved_at
+        self._entries[key] = CachedInfo(info, stream_url_expiry(info, resolved_at), stored_at)
+        self._entries.move_to_end(key)
+        self._dirty = True
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False); self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'entries': len(self._entries), 'hits': self.hits, 'stale_hits': self.stale_hits,
+            'misses': self.misses, 'evictions': self.evictions,
+            'hit_ratio': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
+
+    # --- Persistence ---
+    def load(self):
+        """Loads the on-disk store (oldest first, so LRU order survives restarts)."""
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f: rows = json.load(f)
+        except FileNotFoundError: logging.info(f"{self.path} not found. YTDL cache starting empty."); return
+        except Exception as e: logging.error(f"Failed to load YTDL cache: {e}"); return
+        now = time.time()
+        for key, info, expires_at, stored_at in rows:
+            if now - stored_at <= METADATA_MAX_AGE: self._entries[key] = CachedInfo(info, expires_at, stored_at)
+        while len(self._entries) > self.max_entries: self._entries.popitem(last=False)
+        logging.info(f"YTDL cache loaded with {len(self._entries)} entries.")
+
+    def snapshot(self):
+        """Returns the rows to persist and clears the dirty flag; cheap enough for the event loop."""
+        self._dirty = False
+        return [[key, e.info, e.expires_at, e.stored_at] for key, e in self._entries.items()]
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    def write(self, rows):
+        """Writes a snapshot atomically. Blocking; run it in an executor."""
+        tmp_path = f'{self.path}.{os.getpid()}.tmp' # Cluster processes share the store; each writes its own temp file
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+                json.dump(rows, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except Exception as e: logging.error(f"Failed to save YTDL cache: {e}")